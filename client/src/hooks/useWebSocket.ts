@@ -25,6 +25,11 @@ export function useWebSocket(onMessage: MessageHandler) {
     ws.onmessage = (event) => {
       try {
         const data = JSON.parse(event.data);
+        // Server heartbeat; an unanswered socket is closed after a while
+        if (data.type === 'ping') {
+          ws.send(JSON.stringify({ type: 'pong' }));
+          return;
+        }
         handlersRef.current(data);
       } catch {
         // ignore malformed messages
@@ -19,6 +19,14 @@ import server.models.server  # noqa: F401
 import server.models.channel  # noqa: F401
 import server.models.server_member  # noqa: F401
 import server.models.message  # noqa: F401
+import server.models.message_archive  # noqa: F401
+import server.models.message_archive_target  # noqa: F401
+import server.models.prekey  # noqa: F401
+import server.models.attachment  # noqa: F401
+import server.models.channel_read  # noqa: F401
+import server.models.envelope  # noqa: F401
+import server.models.conversation  # noqa: F401
+import server.models.conversation_participant  # noqa: F401
 
 config = context.config
 config.set_main_option("sqlalchemy.url", settings.database_url)
@@ -0,0 +1,97 @@
+"""initial schema
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = "0001"
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "users",
+        sa.Column("id", postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column("username", sa.String(length=32), nullable=False),
+        sa.Column("password_hash", sa.Text(), nullable=False),
+        sa.Column("identity_key_public", sa.Text(), nullable=True),
+        sa.Column("signed_prekey_public", sa.Text(), nullable=True),
+        sa.Column("signed_prekey_signature", sa.Text(), nullable=True),
+        sa.Column("one_time_prekeys", postgresql.JSONB(astext_type=sa.Text()), nullable=True),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index("ix_users_username", "users", ["username"], unique=True)
+
+    op.create_table(
+        "servers",
+        sa.Column("id", postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column("name", sa.String(length=64), nullable=False),
+        sa.Column("owner_id", postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column("invite_code", sa.String(length=16), nullable=False),
+        sa.Column("icon_url", sa.String(length=512), nullable=True),
+        sa.ForeignKeyConstraint(["owner_id"], ["users.id"]),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index("ix_servers_invite_code", "servers", ["invite_code"], unique=True)
+
+    op.create_table(
+        "channels",
+        sa.Column("id", postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column("server_id", postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column("name", sa.String(length=64), nullable=False),
+        sa.Column("type", sa.Enum("TEXT", "VOICE", name="channeltype"), nullable=False),
+        sa.ForeignKeyConstraint(["server_id"], ["servers.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index("ix_channels_server_id", "channels", ["server_id"])
+
+    op.create_table(
+        "server_members",
+        sa.Column("id", postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column("user_id", postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column("server_id", postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column("role", sa.Enum("OWNER", "ADMIN", "MEMBER", name="memberrole"), nullable=False),
+        sa.ForeignKeyConstraint(["user_id"], ["users.id"], ondelete="CASCADE"),
+        sa.ForeignKeyConstraint(["server_id"], ["servers.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("user_id", "server_id"),
+    )
+    op.create_index("ix_server_members_user_id", "server_members", ["user_id"])
+    op.create_index("ix_server_members_server_id", "server_members", ["server_id"])
+
+    op.create_table(
+        "messages",
+        sa.Column("id", postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column("channel_id", postgresql.UUID(as_uuid=True), nullable=True),
+        sa.Column("conversation_id", postgresql.UUID(as_uuid=True), nullable=True),
+        sa.Column("sender_id", postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column("ciphertext", sa.Text(), nullable=False),
+        sa.Column("nonce", sa.Text(), nullable=True),
+        sa.Column("sender_device_id", sa.Text(), nullable=True),
+        sa.Column("created_at", sa.DateTime(timezone=True), nullable=False),
+        sa.ForeignKeyConstraint(["channel_id"], ["channels.id"], ondelete="CASCADE"),
+        sa.ForeignKeyConstraint(["sender_id"], ["users.id"]),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index("ix_messages_channel_id", "messages", ["channel_id"])
+    op.create_index("ix_messages_conversation_id", "messages", ["conversation_id"])
+
+
+def downgrade() -> None:
+    op.drop_table("messages")
+    op.drop_table("server_members")
+    op.drop_table("channels")
+    op.drop_table("servers")
+    op.drop_table("users")
+    sa.Enum(name="memberrole").drop(op.get_bind(), checkfirst=True)
+    sa.Enum(name="channeltype").drop(op.get_bind(), checkfirst=True)
@@ -0,0 +1,46 @@
+"""composite (target, created_at, id) indexes for message history
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "0002"
+down_revision: Union[str, None] = "0001"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # CONCURRENTLY so a large messages table stays writable while indexes build
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_messages_channel_id_created_at_id",
+            "messages",
+            ["channel_id", "created_at", "id"],
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+        op.create_index(
+            "ix_messages_conversation_id_created_at_id",
+            "messages",
+            ["conversation_id", "created_at", "id"],
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+        # The composite indexes lead with the same columns
+        op.drop_index("ix_messages_channel_id", "messages", postgresql_concurrently=True, if_exists=True)
+        op.drop_index("ix_messages_conversation_id", "messages", postgresql_concurrently=True, if_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index("ix_messages_channel_id", "messages", ["channel_id"], postgresql_concurrently=True)
+        op.create_index("ix_messages_conversation_id", "messages", ["conversation_id"], postgresql_concurrently=True)
+        op.drop_index("ix_messages_channel_id_created_at_id", "messages", postgresql_concurrently=True)
+        op.drop_index("ix_messages_conversation_id_created_at_id", "messages", postgresql_concurrently=True)
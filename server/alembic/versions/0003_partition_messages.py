@@ -0,0 +1,107 @@
+"""monthly range partitioning of messages, retention and archives
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 00:00:00
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = "0003"
+down_revision: Union[str, None] = "0002"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Partitions are created up to this many months past the current one; the
+# maintenance task (services/message_maintenance.py) keeps extending them
+MONTHS_AHEAD = 3
+
+
+def _create_messages(partitioned: bool) -> None:
+    op.create_table(
+        "messages",
+        sa.Column("id", postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column("channel_id", postgresql.UUID(as_uuid=True), nullable=True),
+        sa.Column("conversation_id", postgresql.UUID(as_uuid=True), nullable=True),
+        sa.Column("sender_id", postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column("ciphertext", sa.Text(), nullable=False),
+        sa.Column("nonce", sa.Text(), nullable=True),
+        sa.Column("sender_device_id", sa.Text(), nullable=True),
+        sa.Column("created_at", sa.DateTime(timezone=True), nullable=False),
+        sa.ForeignKeyConstraint(["channel_id"], ["channels.id"], ondelete="CASCADE"),
+        sa.ForeignKeyConstraint(["sender_id"], ["users.id"]),
+        # The partition key has to be part of every unique constraint
+        sa.PrimaryKeyConstraint("id", "created_at") if partitioned else sa.PrimaryKeyConstraint("id"),
+        **({"postgresql_partition_by": "RANGE (created_at)"} if partitioned else {}),
+    )
+    op.create_index("ix_messages_channel_id_created_at_id", "messages", ["channel_id", "created_at", "id"])
+    op.create_index("ix_messages_conversation_id_created_at_id", "messages", ["conversation_id", "created_at", "id"])
+
+
+def _rename_legacy() -> None:
+    op.rename_table("messages", "messages_legacy")
+    op.execute("ALTER INDEX messages_pkey RENAME TO messages_legacy_pkey")
+    op.execute("ALTER INDEX ix_messages_channel_id_created_at_id RENAME TO ix_messages_legacy_channel")
+    op.execute("ALTER INDEX ix_messages_conversation_id_created_at_id RENAME TO ix_messages_legacy_conversation")
+
+
+def upgrade() -> None:
+    # Rewrites the table: run during a maintenance window on large installs
+    _rename_legacy()
+    _create_messages(partitioned=True)
+
+    # One partition per UTC month from the oldest message through MONTHS_AHEAD
+    op.execute(
+        f"""
+        DO $$
+        DECLARE
+            month date;
+        BEGIN
+            FOR month IN
+                SELECT generate_series(
+                    date_trunc('month', coalesce((SELECT min(created_at) FROM messages_legacy), now()) AT TIME ZONE 'UTC'),
+                    date_trunc('month', now() AT TIME ZONE 'UTC') + interval '{MONTHS_AHEAD} months',
+                    interval '1 month'
+                )::date
+            LOOP
+                EXECUTE format(
+                    'CREATE TABLE IF NOT EXISTS %I PARTITION OF messages FOR VALUES FROM (%L) TO (%L)',
+                    to_char(month, '"messages_y"YYYY"m"MM'),
+                    month::timestamp AT TIME ZONE 'UTC',
+                    (month + interval '1 month')::timestamp AT TIME ZONE 'UTC'
+                );
+            END LOOP;
+        END $$
+        """
+    )
+    op.execute("INSERT INTO messages SELECT * FROM messages_legacy")
+    op.drop_table("messages_legacy")
+    op.execute("ANALYZE messages")
+
+    op.add_column("servers", sa.Column("message_retention_days", sa.Integer(), nullable=True))
+    op.create_table(
+        "message_archives",
+        sa.Column("id", postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column("month", sa.Date(), nullable=False),
+        sa.Column("prefix", sa.String(256), nullable=False),
+        sa.Column("row_count", sa.Integer(), nullable=False),
+        sa.Column("archived_at", sa.DateTime(timezone=True), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("month"),
+    )
+
+
+def downgrade() -> None:
+    # Archived months stay in object storage; only rows still in Postgres come back
+    op.drop_table("message_archives")
+    op.drop_column("servers", "message_retention_days")
+
+    _rename_legacy()
+    _create_messages(partitioned=False)
+    op.execute("INSERT INTO messages SELECT * FROM messages_legacy")
+    op.drop_table("messages_legacy")
@@ -0,0 +1,47 @@
+"""move one-time prekeys from users.one_time_prekeys to their own table
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 00:00:00
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = "0004"
+down_revision: Union[str, None] = "0003"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "one_time_prekeys",
+        sa.Column("user_id", postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column("key_id", sa.BigInteger(), sa.Identity(), nullable=False),
+        sa.Column("public_key", sa.Text(), nullable=False),
+        sa.ForeignKeyConstraint(["user_id"], ["users.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("user_id", "key_id"),
+    )
+    # Keep each user's upload order, which is the order keys are handed out
+    op.execute(
+        "INSERT INTO one_time_prekeys (user_id, public_key) "
+        "SELECT u.id, k.value FROM users u "
+        "CROSS JOIN LATERAL jsonb_array_elements_text(u.one_time_prekeys) WITH ORDINALITY AS k(value, n) "
+        "WHERE jsonb_typeof(u.one_time_prekeys) = 'array' "
+        "ORDER BY u.id, k.n"
+    )
+    op.drop_column("users", "one_time_prekeys")
+
+
+def downgrade() -> None:
+    op.add_column("users", sa.Column("one_time_prekeys", postgresql.JSONB(), nullable=True))
+    op.execute(
+        "UPDATE users u SET one_time_prekeys = coalesce("
+        "(SELECT jsonb_agg(p.public_key ORDER BY p.key_id) FROM one_time_prekeys p WHERE p.user_id = u.id), '[]')"
+    )
+    op.drop_table("one_time_prekeys")
@@ -0,0 +1,43 @@
+"""attachments stored in object storage
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18 00:00:00
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = "0005"
+down_revision: Union[str, None] = "0004"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "attachments",
+        sa.Column("id", postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column("uploader_id", postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column("server_id", postgresql.UUID(as_uuid=True), nullable=True),
+        sa.Column("conversation_id", postgresql.UUID(as_uuid=True), nullable=True),
+        sa.Column("size", sa.BigInteger(), nullable=False),
+        sa.Column("content_type", sa.String(128), nullable=False),
+        sa.Column("status", sa.Enum("PENDING", "COMPLETE", name="attachmentstatus"), nullable=False),
+        sa.Column("upload_id", sa.String(256), nullable=True),
+        sa.Column("created_at", sa.DateTime(timezone=True), nullable=False),
+        sa.ForeignKeyConstraint(["uploader_id"], ["users.id"], ondelete="CASCADE"),
+        sa.ForeignKeyConstraint(["server_id"], ["servers.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index("ix_attachments_server_id", "attachments", ["server_id"])
+    op.create_index("ix_attachments_status_created_at", "attachments", ["status", "created_at"])
+
+
+def downgrade() -> None:
+    op.drop_table("attachments")
+    sa.Enum(name="attachmentstatus").drop(op.get_bind(), checkfirst=True)
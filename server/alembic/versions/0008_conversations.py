@@ -0,0 +1,95 @@
+"""DM conversations, participants and inbox summaries
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-18 00:00:00
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = "0008"
+down_revision: Union[str, None] = "0007"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "conversations",
+        sa.Column("id", postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column("created_by", postgresql.UUID(as_uuid=True), nullable=True),
+        sa.Column("direct_key", sa.String(73), nullable=True),
+        sa.Column("created_at", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("last_message_id", postgresql.UUID(as_uuid=True), nullable=True),
+        sa.Column("last_message_at", sa.DateTime(timezone=True), nullable=True),
+        sa.ForeignKeyConstraint(["created_by"], ["users.id"], ondelete="SET NULL"),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("direct_key"),
+    )
+    op.create_table(
+        "conversation_participants",
+        sa.Column("conversation_id", postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column("user_id", postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column("joined_at", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("last_message_at", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("unread_count", sa.Integer(), server_default="0", nullable=False),
+        sa.Column("last_read_at", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("last_read_id", postgresql.UUID(as_uuid=True), nullable=True),
+        sa.ForeignKeyConstraint(["conversation_id"], ["conversations.id"], ondelete="CASCADE"),
+        sa.ForeignKeyConstraint(["user_id"], ["users.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("conversation_id", "user_id"),
+    )
+    op.create_index(
+        "ix_conversation_participants_inbox",
+        "conversation_participants",
+        ["user_id", "last_message_at", "conversation_id"],
+    )
+
+    # Conversations used to exist only as ids on messages, with no record of
+    # who they were addressed to. Recreate them with everyone who has sent to
+    # them, or still has an undelivered envelope from them, as participants and
+    # nothing unread. Recipients who never replied and have acknowledged every
+    # envelope cannot be recovered here; a participant adds them back with
+    # POST /dms/{id}/participants.
+    op.execute(
+        "INSERT INTO conversations (id, created_at, last_message_id, last_message_at) "
+        "SELECT DISTINCT ON (conversation_id) conversation_id, "
+        "min(created_at) OVER (PARTITION BY conversation_id), id, created_at "
+        "FROM messages WHERE conversation_id IS NOT NULL "
+        "ORDER BY conversation_id, created_at DESC, id DESC"
+    )
+    op.execute(
+        "INSERT INTO conversation_participants (conversation_id, user_id, joined_at, last_message_at) "
+        "SELECT p.conversation_id, p.user_id, min(p.joined_at), c.last_message_at "
+        "FROM ("
+        "SELECT conversation_id, sender_id AS user_id, created_at AS joined_at "
+        "FROM messages WHERE conversation_id IS NOT NULL "
+        "UNION ALL "
+        "SELECT m.conversation_id, e.recipient_id, m.created_at "
+        "FROM message_envelopes e JOIN messages m ON m.id = e.message_id AND m.created_at = e.created_at "
+        "WHERE m.conversation_id IS NOT NULL"
+        ") p JOIN conversations c ON c.id = p.conversation_id "
+        "GROUP BY p.conversation_id, p.user_id, c.last_message_at"
+    )
+    # Two-person conversations become direct ones so POST /dms finds them
+    # instead of creating a duplicate; when legacy data has several for one
+    # pair, the most recently active keeps the key
+    op.execute(
+        "UPDATE conversations c SET direct_key = d.direct_key FROM ("
+        "SELECT DISTINCT ON (k.direct_key) k.conversation_id, k.direct_key FROM ("
+        "SELECT conversation_id, min(user_id::text) || ':' || max(user_id::text) AS direct_key "
+        "FROM conversation_participants GROUP BY conversation_id HAVING count(*) = 2"
+        ") k JOIN conversations lc ON lc.id = k.conversation_id "
+        "ORDER BY k.direct_key, lc.last_message_at DESC, lc.id"
+        ") d WHERE c.id = d.conversation_id"
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("conversation_participants")
+    op.drop_table("conversations")
@@ -0,0 +1,24 @@
+"""index attachments by uploader for the DM attachment quota
+
+Revision ID: 0010
+Revises: 0009
+Create Date: 2026-10-18 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "0010"
+down_revision: Union[str, None] = "0009"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index("ix_attachments_uploader_id", "attachments", ["uploader_id"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_attachments_uploader_id", table_name="attachments")
@@ -0,0 +1,71 @@
+# WebSocket codec microbenchmark.
+#
+# Compares stdlib json, the orjson-backed JSON codec and the MessagePack codec on
+# chat broadcasts with realistic ciphertext sizes, and shows what encoding once
+# per broadcast saves over encoding once per recipient. Run from the repository root:
+#
+#   python -m server.bench.codecs
+import argparse
+import base64
+import json
+import os
+import time
+import uuid
+from datetime import datetime, timezone
+
+from server.ws.codec import JSON, MSGPACK
+
+
+def make_message(ciphertext_size: int) -> dict:
+    return {
+        "type": "message",
+        "id": str(uuid.uuid4()),
+        "channel_id": str(uuid.uuid4()),
+        "sender_id": str(uuid.uuid4()),
+        "sender_username": "alice",
+        "content": base64.b64encode(os.urandom(ciphertext_size)).decode(),
+        "nonce": base64.b64encode(os.urandom(24)).decode(),
+        "created_at": datetime.now(timezone.utc).isoformat(),
+    }
+
+
+def per_op_us(fn, iterations: int) -> float:
+    started = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - started) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="WebSocket codec microbenchmark")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[64, 512, 4096, 65536], help="ciphertext bytes")
+    parser.add_argument("--iterations", type=int, default=20_000)
+    parser.add_argument("--recipients", type=int, default=1000)
+    args = parser.parse_args()
+
+    print(f"{'size':>7} {'codec':>8} {'frame':>8} {'encode us':>10} {'decode us':>10}")
+    for size in args.sizes:
+        message = make_message(size)
+        iterations = max(100, args.iterations * 64 // max(size, 64))
+        rows = [
+            ("stdlib", json.dumps(message), lambda: json.dumps(message), json.loads),
+            ("orjson", JSON.encode(message), lambda: JSON.encode(message), JSON.decode),
+            ("msgpack", MSGPACK.encode(message), lambda: MSGPACK.encode(message), MSGPACK.decode),
+        ]
+        for name, frame, encode, decode in rows:
+            frame_bytes = len(frame.encode()) if isinstance(frame, str) else len(frame)
+            encode_us = per_op_us(encode, iterations)
+            decode_us = per_op_us(lambda: decode(frame), iterations)
+            print(f"{size:>7} {name:>8} {frame_bytes:>8} {encode_us:>10.2f} {decode_us:>10.2f}")
+
+    message = make_message(512)
+    per_recipient = per_op_us(lambda: [json.dumps(message) for _ in range(args.recipients)], 50)
+    once = per_op_us(lambda: [JSON.encode(message)] * args.recipients, 50)
+    print(
+        f"\nbroadcast to {args.recipients} recipients (512B ciphertext): "
+        f"stdlib per recipient {per_recipient:.0f}us, orjson once per codec {once:.0f}us"
+    )
+
+
+if __name__ == "__main__":
+    main()
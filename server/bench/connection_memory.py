@@ -0,0 +1,74 @@
+# Per-connection memory benchmark for ConnectionManager.
+#
+# Opens N fake connections (one user each, as on a busy node), then has each
+# join R rooms drawn from a shared pool, and reports the Python heap growth
+# per connection and per room membership as traced by tracemalloc. These are
+# the numbers behind CONNECTION_OVERHEAD_BYTES and ROOM_MEMBERSHIP_BYTES in
+# server/ws/connection.py. Run from the repository root:
+#
+#   python -m server.bench.connection_memory --connections 100000 --rooms-per-connection 5
+import argparse
+import asyncio
+import gc
+import random
+import tracemalloc
+import uuid
+
+from server.bench.manager_churn import FakeWebSocket
+from server.ws.manager import ConnectionManager
+
+
+def traced() -> int:
+    gc.collect()
+    return tracemalloc.get_traced_memory()[0]
+
+
+async def run(args):
+    rng = random.Random(args.seed)
+    manager = ConnectionManager()
+    # Sockets, ids and room names exist before measuring; the server gets them
+    # from the transport and the client, not from the manager
+    sockets = [FakeWebSocket() for _ in range(args.connections)]
+    user_ids = [uuid.uuid4() for _ in range(args.connections)]
+    usernames = [f"user{i}" for i in range(args.connections)]
+    room_ids = [f"channel:{uuid.uuid4()}" for _ in range(args.rooms)]
+    picks = [rng.sample(room_ids, args.rooms_per_connection) for _ in range(args.connections)]
+
+    tracemalloc.start()
+    before = traced()
+    connections = [
+        await manager.connect(socket, user_id, username)
+        for socket, user_id, username in zip(sockets, user_ids, usernames)
+    ]
+    # Let every writer task reach its first wait, as on an idle node
+    await asyncio.sleep(0)
+    connected = traced()
+    for conn, rooms in zip(connections, picks):
+        for room_id in rooms:
+            await manager.join_room(room_id, conn)
+    joined = traced()
+    tracemalloc.stop()
+
+    per_connection = (connected - before) / args.connections
+    memberships = args.connections * args.rooms_per_connection
+    per_membership = (joined - connected) / memberships if memberships else 0.0
+    print(f"connections: {args.connections}, rooms: {len(manager.rooms)}, memberships: {memberships}")
+    print(f"per connection:      {per_connection:8.0f} bytes")
+    print(f"per room membership: {per_membership:8.0f} bytes")
+    print(f"total:               {(joined - before) / 2**20:8.1f} MiB")
+
+    for conn in connections:
+        await manager.disconnect(conn)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--connections", type=int, default=20_000)
+    parser.add_argument("--rooms", type=int, default=5_000)
+    parser.add_argument("--rooms-per-connection", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=1)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+# Channel history pagination benchmark over a large seeded messages table.
+#
+# Seeds `--rows` messages (default 50M) across `--channels` channels with four
+# messages per timestamp so ties are common, then walks history backwards page by
+# page with the keyset cursor engine and with the old `created_at < before`
+# filter, reporting per-page latency and rows lost or repeated at page
+# boundaries. Needs a migrated database (alembic upgrade head); seeding 50M rows
+# takes a while and ~10GB of disk. From the repository root:
+#
+#   python -m server.bench.history_pagination --rows 50000000
+#   python -m server.bench.history_pagination --skip-seed --pages 200
+import argparse
+import asyncio
+import statistics
+import time
+import uuid
+from datetime import date
+
+from sqlalchemy import func, select, text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from server.config import settings
+from server.models.message import Message
+from server.models.user import User
+from server.services.history import encode_cursor, fetch_history
+from server.services.message_maintenance import ensure_partitions
+
+BENCH_USER = "bench_history"
+SEED_CHUNK = 1_000_000
+
+
+async def seed(db: AsyncSession, rows: int, channels: int):
+    user_id, server_id = uuid.uuid4(), uuid.uuid4()
+    channel_ids = [uuid.uuid4() for _ in range(channels)]
+    await db.execute(
+        text("INSERT INTO users (id, username, password_hash) VALUES (:id, :name, 'x')"),
+        {"id": user_id, "name": BENCH_USER},
+    )
+    await db.execute(
+        text("INSERT INTO servers (id, name, owner_id, invite_code) VALUES (:id, 'bench', :owner, :code)"),
+        {"id": server_id, "owner": user_id, "code": uuid.uuid4().hex[:16]},
+    )
+    await db.execute(
+        text("INSERT INTO channels (id, server_id, name, type) VALUES (:id, :server, 'bench', 'TEXT')"),
+        [{"id": channel_id, "server": server_id} for channel_id in channel_ids],
+    )
+    await db.commit()
+    # Seeded rows start in January 2024, before the partitions the migration creates
+    await ensure_partitions(db, 0, start=date(2024, 1, 1))
+
+    started = time.perf_counter()
+    for offset in range(0, rows, SEED_CHUNK):
+        # Skewed towards the first channels, like real traffic; 4 rows per second
+        await db.execute(
+            text(
+                "INSERT INTO messages (id, channel_id, sender_id, ciphertext, created_at) "
+                "SELECT gen_random_uuid(), "
+                "(CAST(:channels AS uuid[]))[1 + floor(power(random(), 3) * CAST(:n AS int))::int], "
+                ":sender, md5(g::text), "
+                "timestamptz '2024-01-01' + (g / 4) * interval '1 second' "
+                "FROM generate_series(CAST(:start AS bigint), CAST(:stop AS bigint)) AS g"
+            ),
+            {
+                "channels": [str(c) for c in channel_ids],
+                "n": channels,
+                "sender": user_id,
+                "start": offset,
+                "stop": min(offset + SEED_CHUNK, rows) - 1,
+            },
+        )
+        await db.commit()
+        done = min(offset + SEED_CHUNK, rows)
+        print(f"seeded {done:,}/{rows:,} rows ({time.perf_counter() - started:.0f}s)")
+    await db.execute(text("ANALYZE messages"))
+    await db.commit()
+
+
+async def hottest_channel(db: AsyncSession) -> uuid.UUID:
+    result = await db.execute(
+        select(Message.channel_id)
+        .join(User, User.id == Message.sender_id)
+        .where(User.username == BENCH_USER)
+        .group_by(Message.channel_id)
+        .order_by(func.count().desc())
+        .limit(1)
+    )
+    return result.scalar_one()
+
+
+async def walk_keyset(db: AsyncSession, channel_id: uuid.UUID, pages: int, limit: int):
+    timings, seen, before = [], [], None
+    for _ in range(pages):
+        started = time.perf_counter()
+        rows = await fetch_history(db, Message.channel_id, channel_id, before=before, limit=limit)
+        timings.append(time.perf_counter() - started)
+        if not rows:
+            break
+        seen.extend(msg.id for msg, _ in rows)
+        before = encode_cursor(rows[0][0].created_at, rows[0][0].id)
+    return timings, seen
+
+
+async def walk_timestamp(db: AsyncSession, channel_id: uuid.UUID, pages: int, limit: int):
+    # The previous implementation: filter on created_at alone, no tiebreaker
+    timings, seen, before = [], [], None
+    for _ in range(pages):
+        query = select(Message, User.username).join(User, User.id == Message.sender_id).where(
+            Message.channel_id == channel_id
+        )
+        if before is not None:
+            query = query.where(Message.created_at < before)
+        query = query.order_by(Message.created_at.desc()).limit(limit)
+        started = time.perf_counter()
+        rows = (await db.execute(query)).all()
+        timings.append(time.perf_counter() - started)
+        if not rows:
+            break
+        seen.extend(msg.id for msg, _ in rows)
+        before = rows[-1][0].created_at
+    return timings, seen
+
+
+def report(name: str, timings: list[float], seen: list[uuid.UUID], expected: int):
+    ordered = sorted(timings)
+    print(
+        f"{name:>10}: {len(timings)} pages  "
+        f"p50 {ordered[len(ordered) // 2] * 1000:.2f}ms  "
+        f"p99 {ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000:.2f}ms  "
+        f"mean {statistics.mean(timings) * 1000:.2f}ms  "
+        f"rows {len(seen)} (unique {len(set(seen))}, expected {expected})"
+    )
+
+
+async def run(args):
+    engine = create_async_engine(args.database_url)
+    session = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    async with session() as db:
+        if not args.skip_seed:
+            await seed(db, args.rows, args.channels)
+        channel_id = await hottest_channel(db)
+        total = (await db.execute(select(func.count()).where(Message.channel_id == channel_id))).scalar_one()
+        expected = min(total, args.pages * args.limit)
+        print(f"channel {channel_id}: {total:,} messages")
+
+        plan = await db.execute(
+            text(
+                "EXPLAIN ANALYZE SELECT id FROM messages WHERE channel_id = :c "
+                "AND (created_at, id) < (now(), :id) ORDER BY created_at DESC, id DESC LIMIT :l"
+            ),
+            {"c": channel_id, "id": uuid.UUID(int=2**128 - 1), "l": args.limit},
+        )
+        print("\n".join(row[0] for row in plan.all()))
+
+        report("keyset", *await walk_keyset(db, channel_id, args.pages, args.limit), expected)
+        report("timestamp", *await walk_timestamp(db, channel_id, args.pages, args.limit), expected)
+    await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Keyset vs timestamp history pagination")
+    parser.add_argument("--database-url", default=settings.database_url)
+    parser.add_argument("--rows", type=int, default=50_000_000)
+    parser.add_argument("--channels", type=int, default=1000)
+    parser.add_argument("--pages", type=int, default=100)
+    parser.add_argument("--limit", type=int, default=50)
+    parser.add_argument("--skip-seed", action="store_true")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
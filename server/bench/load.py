@@ -0,0 +1,448 @@
+# Load test for the messaging server.
+#
+# Registers `--clients` users, groups them into servers of `--server-size`
+# members with `--channels` channels each and pairs them up for DMs, then opens
+# one WebSocket per user and drives a weighted mix of actions at `--rate`
+# actions per second per client (Poisson arrivals):
+#
+#   message       channel message; latency is until the sender gets its own broadcast
+#   dm_message    DM to the client's pair, timed the same way
+#   history       GET /channels/{id}/messages, timed to the response
+#   join_channel  leave and rejoin a channel, timed until "joined"
+#
+# Reports sent and delivered messages per second, p50/p95/p99 latency per
+# action, error frames by code, and the server's CPU and resident memory
+# (read from /proc, so Linux only, for --spawn or --server-pid). Results can be
+# saved as a baseline and later runs compared against it; --compare exits 1 if
+# anything regressed by more than --tolerance.
+#
+# With --spawn the app is started under uvicorn against the database and Redis
+# in the environment (docker-compose.yml, migrated with alembic upgrade head).
+# Per-user send limits (ws_user_messages_per_second) still apply, so keep
+# --rate below them. From the repository root:
+#
+#   python -m server.bench.load --spawn --clients 2000 --duration 60 --save server/bench/baseline.json
+#   python -m server.bench.load --spawn --clients 2000 --duration 60 --compare server/bench/baseline.json
+#   python -m server.bench.load --url http://localhost:8000 --server-pid 4242 --clients 500
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import secrets
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from websockets.asyncio.client import connect
+
+from server.bench.send_latency import rest
+
+DEFAULT_MIX = "message=70,dm_message=20,history=8,join_channel=2"
+# Per-client sends still unanswered after this long count as timeouts
+REPLY_TIMEOUT = 10.0
+
+
+def parse_mix(spec: str) -> tuple[list[str], list[float]]:
+    actions, weights = [], []
+    for part in spec.split(","):
+        action, _, weight = part.partition("=")
+        if action not in ("message", "dm_message", "history", "join_channel"):
+            raise SystemExit(f"Unknown action in --mix: {action}")
+        actions.append(action)
+        weights.append(float(weight))
+    return actions, weights
+
+
+def percentile(ordered: list[float], q: float) -> float:
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+# CPU and resident memory of a process and its children (uvicorn workers)
+class ProcessSampler:
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.cpu_percent: list[float] = []
+        self.rss_bytes: list[int] = []
+        self._task: asyncio.Task | None = None
+
+    def _pids(self) -> list[int]:
+        pids, stack = [], [self.pid]
+        while stack:
+            pid = stack.pop()
+            pids.append(pid)
+            for task in Path(f"/proc/{pid}/task").glob("*/children"):
+                stack += [int(child) for child in task.read_text().split()]
+        return pids
+
+    def _read(self) -> tuple[float, int]:
+        ticks, pages = 0, 0
+        for pid in self._pids():
+            try:
+                fields = Path(f"/proc/{pid}/stat").read_text().rsplit(")", 1)[1].split()
+                ticks += int(fields[11]) + int(fields[12])
+                pages += int(Path(f"/proc/{pid}/statm").read_text().split()[1])
+            except (FileNotFoundError, ProcessLookupError):
+                continue
+        return ticks / os.sysconf("SC_CLK_TCK"), pages * os.sysconf("SC_PAGE_SIZE")
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+    async def _run(self):
+        cpu, wall = self._read()[0], time.perf_counter()
+        while True:
+            await asyncio.sleep(1.0)
+            now_cpu, rss = self._read()
+            now = time.perf_counter()
+            self.cpu_percent.append((now_cpu - cpu) / (now - wall) * 100)
+            self.rss_bytes.append(rss)
+            cpu, wall = now_cpu, now
+
+    def summary(self) -> dict:
+        if not self.cpu_percent:
+            return {}
+        return {
+            "cpu_percent_mean": round(sum(self.cpu_percent) / len(self.cpu_percent), 1),
+            "cpu_percent_max": round(max(self.cpu_percent), 1),
+            "rss_mb_max": round(max(self.rss_bytes) / 2**20, 1),
+        }
+
+
+class Recorder:
+    def __init__(self):
+        self.measuring = False
+        self.sent = 0
+        self.delivered = 0
+        self.timeouts = 0
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.errors: Counter = Counter()
+
+    def record(self, action: str, seconds: float):
+        if self.measuring:
+            self.latencies[action].append(seconds * 1000)
+
+
+async def call(base_url: str, method: str, path: str, body: dict | None = None, token: str | None = None):
+    # Retries while the server sheds load (e.g. password hashing at capacity)
+    while True:
+        try:
+            return await asyncio.to_thread(rest, base_url, method, path, body, token)
+        except urllib.error.HTTPError as e:
+            if e.code != 429:
+                raise
+            await asyncio.sleep(float(e.headers.get("Retry-After", 1)))
+
+
+class Client:
+    def __init__(self, index: int, args, recorder: Recorder, rng: random.Random):
+        self.index = index
+        self.args = args
+        self.recorder = recorder
+        self.rng = rng
+        self.token = ""
+        self.user_id = ""
+        self.channel_ids: list[str] = []
+        self.conversation_id = ""
+        self.ws = None
+        self.reader: asyncio.Task | None = None
+        self.seq = 0
+        # content -> (action, sent at)
+        self.pending: dict[str, tuple[str, float]] = {}
+        self.joined: dict[str, asyncio.Future] = {}
+
+    async def register(self):
+        body = {"username": f"load_{secrets.token_hex(6)}", "password": secrets.token_urlsafe(16)}
+        auth = await call(self.args.url, "POST", "/auth/register", body)
+        self.token, self.user_id = auth["token"], auth["user_id"]
+
+    async def open(self):
+        ws_url = self.args.url.replace("http", "ws", 1) + "/ws?token=" + self.token
+        self.ws = await connect(ws_url, max_queue=None)
+        self.reader = asyncio.create_task(self.read())
+        for channel_id in self.channel_ids:
+            await self.join(channel_id)
+        await self.ws.send(json.dumps({"type": "join_dm", "conversation_id": self.conversation_id}))
+
+    async def join(self, channel_id: str):
+        self.joined[channel_id] = asyncio.get_running_loop().create_future()
+        await self.ws.send(json.dumps({"type": "join_channel", "channel_id": channel_id}))
+        await asyncio.wait_for(self.joined[channel_id], REPLY_TIMEOUT)
+
+    async def read(self):
+        async for frame in self.ws:
+            data = json.loads(frame)
+            kind = data.get("type")
+            if kind in ("message", "dm_message"):
+                if self.recorder.measuring:
+                    self.recorder.delivered += 1
+                if data.get("sender_id") == self.user_id:
+                    sent = self.pending.pop(data.get("content"), None)
+                    if sent is not None:
+                        self.recorder.record(sent[0], time.perf_counter() - sent[1])
+            elif kind == "joined":
+                future = self.joined.pop(data.get("channel_id"), None)
+                if future is not None and not future.done():
+                    future.set_result(None)
+            elif kind == "ping":
+                # Server heartbeat for sockets that were quiet for a while
+                await self.ws.send(json.dumps({"type": "pong"}))
+            elif kind == "error":
+                self.recorder.errors[data.get("code") or data.get("detail")] += 1
+
+    async def act(self, action: str):
+        started = time.perf_counter()
+        if action in ("message", "dm_message"):
+            self.seq += 1
+            content = f"{self.index}.{self.seq}.{secrets.token_urlsafe(self.args.size)}"
+            frame = {"type": action, "content": content}
+            if action == "message":
+                frame["channel_id"] = self.rng.choice(self.channel_ids)
+            else:
+                frame["conversation_id"] = self.conversation_id
+            self.pending[content] = (action, started)
+            await self.ws.send(json.dumps(frame))
+            if self.recorder.measuring:
+                self.recorder.sent += 1
+        elif action == "history":
+            channel_id = self.rng.choice(self.channel_ids)
+            await call(self.args.url, "GET", f"/channels/{channel_id}/messages?limit=50", None, self.token)
+            self.recorder.record(action, time.perf_counter() - started)
+        elif action == "join_channel":
+            channel_id = self.rng.choice(self.channel_ids)
+            await self.ws.send(json.dumps({"type": "leave_channel", "channel_id": channel_id}))
+            await self.join(channel_id)
+            self.recorder.record(action, time.perf_counter() - started)
+
+    async def drive(self, actions: list[str], weights: list[float], stop_at: float):
+        while True:
+            await asyncio.sleep(self.rng.expovariate(self.args.rate))
+            now = time.perf_counter()
+            if now >= stop_at:
+                return
+            for content, (_, sent) in list(self.pending.items()):
+                if now - sent > REPLY_TIMEOUT:
+                    del self.pending[content]
+                    if self.recorder.measuring:
+                        self.recorder.timeouts += 1
+            try:
+                await self.act(self.rng.choices(actions, weights)[0])
+            except (asyncio.TimeoutError, urllib.error.URLError) as e:
+                self.recorder.errors[type(e).__name__] += 1
+
+    async def close(self):
+        await self.ws.close()
+        self.reader.cancel()
+
+
+async def gather_limited(coros, limit: int):
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(coro):
+        async with semaphore:
+            return await coro
+
+    return await asyncio.gather(*(run(c) for c in coros))
+
+
+async def build_topology(clients: list[Client], args):
+    # Servers of `server_size` members, the first member owning it; DM pairs
+    # are neighbours in the same server
+    for start in range(0, len(clients), args.server_size):
+        members = clients[start:start + args.server_size]
+        owner = members[0]
+        server = await call(args.url, "POST", "/servers", {"name": f"load {start}"}, owner.token)
+        for i in range(1, args.channels):
+            await call(args.url, "POST", "/channels", {"server_id": server["id"], "name": f"load-{i}"}, owner.token)
+        await gather_limited(
+            [call(args.url, "POST", "/servers/join", {"invite_code": server["invite_code"]}, m.token) for m in members[1:]],
+            args.concurrency,
+        )
+        channels = await call(args.url, "GET", f"/channels/by-server/{server['id']}", None, owner.token)
+        channel_ids = [c["id"] for c in channels]
+        for member in members:
+            member.channel_ids = channel_ids
+        pairs = list(zip(members[::2], members[1::2]))
+        if len(members) % 2 and len(members) > 1:
+            # The odd one out shares a conversation with the first member,
+            # which only it joins
+            pairs.append((members[-1], members[0]))
+        conversations = await gather_limited(
+            [call(args.url, "POST", "/dms", {"participant_ids": [b.user_id]}, a.token) for a, b in pairs],
+            args.concurrency,
+        )
+        for (a, b), conversation in zip(pairs, conversations):
+            a.conversation_id = conversation["id"]
+            if not b.conversation_id:
+                b.conversation_id = conversation["id"]
+
+
+def spawn(args) -> subprocess.Popen:
+    command = [
+        sys.executable, "-m", "uvicorn", "server.main:app",
+        "--port", str(args.port), "--workers", str(args.workers), "--log-level", "warning",
+        # Compression is negotiated per codec; see ws_per_message_deflate
+        "--ws-per-message-deflate", "false",
+    ]
+    process = subprocess.Popen(command, env={**os.environ, "WHISPER_WS_PER_MESSAGE_DEFLATE": "false"})
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            rest(args.url, "GET", "/health")
+            return process
+        except (urllib.error.URLError, ConnectionError):
+            time.sleep(0.2)
+    process.terminate()
+    raise SystemExit("Server did not become healthy within 30s")
+
+
+async def run(args) -> dict:
+    actions, weights = parse_mix(args.mix)
+    # REST calls run in threads; enough of them that history latency is not
+    # dominated by waiting for one
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(args.concurrency))
+    rng = random.Random(args.seed)
+    recorder = Recorder()
+    clients = [Client(i, args, recorder, random.Random(rng.random())) for i in range(args.clients)]
+
+    print(f"registering {args.clients} users")
+    await gather_limited([c.register() for c in clients], args.concurrency)
+    await build_topology(clients, args)
+    print(f"connecting {args.clients} sockets")
+    await gather_limited([c.open() for c in clients], args.concurrency)
+
+    sampler = ProcessSampler(args.server_pid) if args.server_pid else None
+    stop_at = time.perf_counter() + args.warmup + args.duration
+    drivers = [asyncio.create_task(c.drive(actions, weights, stop_at)) for c in clients]
+    await asyncio.sleep(args.warmup)
+    print(f"measuring for {args.duration}s")
+    recorder.measuring = True
+    if sampler:
+        sampler.start()
+    measured_from = time.perf_counter()
+    await asyncio.gather(*drivers)
+    # Let in-flight broadcasts land before closing
+    await asyncio.sleep(1.0)
+    recorder.measuring = False
+    elapsed = time.perf_counter() - measured_from
+    if sampler:
+        await sampler.stop()
+    await gather_limited([c.close() for c in clients], args.concurrency)
+
+    return {
+        "config": {
+            key: getattr(args, key)
+            for key in ("clients", "server_size", "channels", "rate", "mix", "size", "duration", "workers", "seed")
+        },
+        "sent_per_sec": round(recorder.sent / elapsed, 1),
+        "delivered_per_sec": round(recorder.delivered / elapsed, 1),
+        "timeouts": recorder.timeouts,
+        "errors": dict(recorder.errors),
+        "latency_ms": {
+            action: {
+                "count": len(samples),
+                "p50": round(percentile(sorted(samples), 0.50), 2),
+                "p95": round(percentile(sorted(samples), 0.95), 2),
+                "p99": round(percentile(sorted(samples), 0.99), 2),
+            }
+            for action, samples in sorted(recorder.latencies.items())
+            if samples
+        },
+        "server": sampler.summary() if sampler else {},
+    }
+
+
+def comparable(result: dict) -> dict[str, tuple[float, bool]]:
+    # metric -> (value, higher is better)
+    metrics = {
+        "sent_per_sec": (result["sent_per_sec"], True),
+        "delivered_per_sec": (result["delivered_per_sec"], True),
+    }
+    for action, latency in result["latency_ms"].items():
+        for q in ("p50", "p95", "p99"):
+            metrics[f"{action} {q} ms"] = (latency[q], False)
+    for key, value in result["server"].items():
+        metrics[key] = (value, False)
+    return metrics
+
+
+def compare(baseline: dict, result: dict, tolerance: float) -> bool:
+    if baseline["config"] != result["config"]:
+        print("warning: baseline was recorded with a different configuration")
+        print(f"  baseline: {baseline['config']}\n  current:  {result['config']}")
+    before, after = comparable(baseline), comparable(result)
+    regressed = False
+    print(f"{'metric':<28}{'baseline':>12}{'current':>12}{'change':>10}")
+    for name, (value, higher_is_better) in after.items():
+        if name not in before:
+            continue
+        base = before[name][0]
+        change = (value - base) / base if base else 0.0
+        worse = -change if higher_is_better else change
+        flag = "  REGRESSION" if worse > tolerance else ""
+        regressed |= bool(flag)
+        print(f"{name:<28}{base:>12.2f}{value:>12.2f}{change:>+9.1%}{flag}")
+    return not regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Messaging server load test")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--spawn", action="store_true", help="start the app under uvicorn for the run")
+    parser.add_argument("--port", type=int, default=8765, help="port for --spawn")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers for --spawn")
+    parser.add_argument("--server-pid", type=int, help="sample CPU/memory of this process and its children")
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--server-size", type=int, default=50, help="members per server")
+    parser.add_argument("--channels", type=int, default=3, help="channels per server")
+    parser.add_argument("--rate", type=float, default=1.0, help="actions per second per client")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="weighted actions, e.g. " + DEFAULT_MIX)
+    parser.add_argument("--size", type=int, default=192, help="random content bytes per message")
+    parser.add_argument("--duration", type=float, default=60.0, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=10.0, help="unmeasured seconds before that")
+    parser.add_argument("--concurrency", type=int, default=100, help="parallel setup requests")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--save", type=Path, help="write results to this JSON file")
+    parser.add_argument("--compare", type=Path, help="compare with a saved baseline")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed relative regression")
+    args = parser.parse_args()
+
+    # Thousands of sockets need more descriptors than the usual default
+    _, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    process = None
+    if args.spawn:
+        args.url = f"http://127.0.0.1:{args.port}"
+        process = spawn(args)
+        args.server_pid = process.pid
+    try:
+        result = asyncio.run(run(args))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    print(json.dumps(result, indent=2))
+    if args.save:
+        args.save.write_text(json.dumps(result, indent=2) + "\n")
+        print(f"saved to {args.save}")
+    if args.compare and not compare(json.loads(args.compare.read_text()), result, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
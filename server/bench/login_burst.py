@@ -0,0 +1,84 @@
+# Event-loop latency during a login burst.
+#
+# Fires `--logins` concurrent password verifications at the configured Argon2
+# cost while a ticker task measures how late the event loop wakes it up, the
+# same delay every WebSocket on the worker would see. Compares verifying inline
+# on the loop (the previous behaviour) with the bounded hashing pool, and counts
+# requests the pool sheds with 429. Needs no database. From the repository root:
+#
+#   python -m server.bench.login_burst --logins 200
+import argparse
+import asyncio
+import time
+
+from passlib.hash import argon2
+
+from server.config import settings
+from server.services.auth import HasherBusy, PasswordHasher
+
+TICK = 0.005
+
+
+async def ticker(lags: list[float], stop: asyncio.Event):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(TICK)
+        lags.append(time.perf_counter() - started - TICK)
+
+
+async def burst(name: str, verify, logins: int):
+    lags, stop = [], asyncio.Event()
+    tick = asyncio.create_task(ticker(lags, stop))
+    await asyncio.sleep(0.05)
+    started = time.perf_counter()
+    results = await asyncio.gather(*(verify() for _ in range(logins)), return_exceptions=True)
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await tick
+
+    shed = sum(isinstance(r, HasherBusy) for r in results)
+    ordered = sorted(lags)
+    print(
+        f"{name:>7}: {logins - shed} verified, {shed} shed (429) in {elapsed:.2f}s  "
+        f"loop lag p50 {ordered[len(ordered) // 2] * 1000:.1f}ms  "
+        f"p99 {ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000:.1f}ms  "
+        f"max {ordered[-1] * 1000:.1f}ms"
+    )
+
+
+async def run(args):
+    hasher = PasswordHasher(
+        args.workers,
+        args.max_pending,
+        settings.argon2_time_cost,
+        settings.argon2_memory_cost,
+        settings.argon2_parallelism,
+    )
+    stored = await hasher.hash("correct horse battery staple")
+    inline = argon2.using(
+        time_cost=settings.argon2_time_cost,
+        memory_cost=settings.argon2_memory_cost,
+        parallelism=settings.argon2_parallelism,
+    )
+
+    async def verify_inline():
+        return inline.verify("correct horse battery staple", stored)
+
+    async def verify_pool():
+        return await hasher.verify("correct horse battery staple", stored)
+
+    await burst("inline", verify_inline, args.logins)
+    await burst("pool", verify_pool, args.logins)
+    hasher.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Event-loop latency during a login burst")
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=settings.password_hash_workers)
+    parser.add_argument("--max-pending", type=int, default=settings.password_hash_max_pending)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+# Connection churn benchmark for ConnectionManager.
+#
+# Opens N fake connections spread over M rooms, then repeatedly disconnects and
+# reconnects random connections (a reconnect storm after a deploy) and reports
+# per-operation latency. Run from the repository root:
+#
+#   python -m server.bench.manager_churn --connections 50000 --rooms 10000
+import argparse
+import asyncio
+import random
+import statistics
+import time
+import uuid
+
+from server.ws.manager import ConnectionManager
+
+
+class FakeWebSocket:
+    async def accept(self, subprotocol: str | None = None):
+        pass
+
+    async def send_text(self, data: str):
+        pass
+
+    async def send_bytes(self, data: bytes):
+        pass
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+def percentile(samples: list[float], pct: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+async def open_connection(manager: ConnectionManager, user_id: uuid.UUID, rooms: list[str]):
+    conn = await manager.connect(FakeWebSocket(), user_id, "bench")
+    for room_id in rooms:
+        await manager.join_room(room_id, conn)
+    return conn
+
+
+async def run(args):
+    rng = random.Random(args.seed)
+    manager = ConnectionManager()
+    room_ids = [f"channel:{uuid.uuid4()}" for _ in range(args.rooms)]
+    # Several devices per user so per-connection membership is exercised
+    user_ids = [uuid.uuid4() for _ in range(max(1, args.connections // args.devices))]
+
+    def pick_rooms():
+        return rng.sample(room_ids, args.rooms_per_connection)
+
+    started = time.perf_counter()
+    connections = [
+        await open_connection(manager, user_ids[i % len(user_ids)], pick_rooms())
+        for i in range(args.connections)
+    ]
+    print(f"setup: {args.connections} connections in {time.perf_counter() - started:.2f}s")
+    print(f"stats: {manager.stats()}")
+
+    disconnects, reconnects = [], []
+    for _ in range(args.churn):
+        i = rng.randrange(len(connections))
+        conn = connections[i]
+
+        t0 = time.perf_counter()
+        await manager.disconnect(conn)
+        disconnects.append(time.perf_counter() - t0)
+
+        t0 = time.perf_counter()
+        connections[i] = await open_connection(manager, conn.user_id, pick_rooms())
+        reconnects.append(time.perf_counter() - t0)
+
+    for name, samples in (("disconnect", disconnects), ("reconnect+join", reconnects)):
+        print(
+            f"{name:>15}: mean {statistics.mean(samples) * 1e6:8.1f}us  "
+            f"p50 {percentile(samples, 50) * 1e6:8.1f}us  "
+            f"p99 {percentile(samples, 99) * 1e6:8.1f}us  "
+            f"({len(samples) / sum(samples):,.0f} ops/s)"
+        )
+    print(f"stats: {manager.stats()}")
+
+    for conn in connections:
+        await manager.disconnect(conn)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ConnectionManager connect/disconnect churn benchmark")
+    parser.add_argument("--connections", type=int, default=50_000)
+    parser.add_argument("--rooms", type=int, default=10_000)
+    parser.add_argument("--rooms-per-connection", type=int, default=5)
+    parser.add_argument("--devices", type=int, default=2, help="connections per user")
+    parser.add_argument("--churn", type=int, default=20_000, help="disconnect/reconnect cycles")
+    parser.add_argument("--seed", type=int, default=0)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+# WebSocket rate limiter microbenchmark.
+#
+# Measures what the inbound checks add to every frame: the frame size and
+# per-connection bucket check on all frames, and the per-user and per-room
+# buckets on chat messages, on both the accepted and the rejected path. Decoding
+# the same frame is timed alongside for scale. Local buckets only; the optional
+# Redis window is a network round trip per message and is not measured here.
+# Run from the repository root:
+#
+#   python -m server.bench.ratelimit
+import argparse
+import asyncio
+import base64
+import os
+import time
+import uuid
+from types import SimpleNamespace
+
+from server.ws.codec import JSON
+from server.ws.ratelimit import RateLimiter
+
+
+def make_limiter(rate: float) -> RateLimiter:
+    return RateLimiter(
+        max_frame_bytes=131_072,
+        connection_rate=rate,
+        connection_burst=int(rate),
+        user_rate=rate,
+        user_burst=int(rate),
+        room_rate=rate,
+        room_burst=int(rate),
+        close_after=1 << 62,
+        shared_window=10.0,
+    )
+
+
+def make_conn():
+    return SimpleNamespace(user_id=uuid.uuid4(), bucket=None, rejected_frames=0)
+
+
+def per_op_ns(fn, iterations: int) -> float:
+    started = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - started) / iterations * 1e9
+
+
+async def per_op_ns_async(fn, iterations: int) -> float:
+    started = time.perf_counter()
+    for _ in range(iterations):
+        await fn()
+    return (time.perf_counter() - started) / iterations * 1e9
+
+
+async def run(iterations: int, rooms: int):
+    frame = JSON.encode(
+        {
+            "type": "message",
+            "channel_id": str(uuid.uuid4()),
+            "content": base64.b64encode(os.urandom(512)).decode(),
+        }
+    )
+    room_ids = [f"channel:{uuid.uuid4()}" for _ in range(rooms)]
+
+    # Rates high enough that nothing is rejected
+    accepting = make_limiter(1e12)
+    conn = make_conn()
+    i = iter(range(1 << 62))
+    frame_ok = per_op_ns(lambda: accepting.allow_frame(conn, frame), iterations)
+    message_ok = await per_op_ns_async(
+        lambda: accepting.allow_message(conn, room_ids[next(i) % rooms], "message"), iterations
+    )
+
+    # No burst and a negligible rate, so every check rejects
+    rejecting = make_limiter(1e-9)
+    conn = make_conn()
+    frame_rejected = per_op_ns(lambda: rejecting.allow_frame(conn, frame), iterations)
+    message_rejected = await per_op_ns_async(
+        lambda: rejecting.allow_message(conn, room_ids[0], "message"), iterations
+    )
+
+    oversized = "x" * 200_000
+    frame_too_large = per_op_ns(lambda: accepting.allow_frame(conn, oversized), iterations)
+    decode = per_op_ns(lambda: JSON.decode(frame), iterations)
+    overhead = per_op_ns(lambda: None, iterations)
+
+    print(f"{iterations} iterations, {len(frame)}-byte frame, {rooms} rooms")
+    print(f"  {'check':<32}{'ns/frame':>10}")
+    for name, ns in (
+        ("frame, accepted", frame_ok),
+        ("frame, rejected", frame_rejected),
+        ("frame, too large", frame_too_large),
+        ("message (user+room), accepted", message_ok),
+        ("message (user+room), rejected", message_rejected),
+        ("decode (for scale)", decode),
+        ("empty loop (harness overhead)", overhead),
+    ):
+        print(f"  {name:<32}{ns:>10.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="WebSocket rate limiter microbenchmark")
+    parser.add_argument("--iterations", type=int, default=200_000)
+    parser.add_argument("--rooms", type=int, default=1_000)
+    args = parser.parse_args()
+    asyncio.run(run(args.iterations, args.rooms))
+
+
+if __name__ == "__main__":
+    main()
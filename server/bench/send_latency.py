@@ -0,0 +1,88 @@
+# Send -> receive latency for channel messages against a running server.
+#
+# Registers a sender and a receiver, puts both in a fresh server's #general
+# channel, then has the sender post messages one at a time and measures how long
+# each takes to arrive on the receiver's socket. Start the stack from
+# docker-compose.yml, run the app with uvicorn, then from the repository root:
+#
+#   python -m server.bench.send_latency --url http://localhost:8000 --messages 2000
+import argparse
+import asyncio
+import json
+import secrets
+import statistics
+import time
+import urllib.request
+
+from websockets.asyncio.client import connect
+
+
+def rest(base_url: str, method: str, path: str, body: dict | None = None, token: str | None = None):
+    request = urllib.request.Request(
+        base_url + path,
+        method=method,
+        data=json.dumps(body).encode() if body is not None else None,
+        headers={"Content-Type": "application/json", **({"Authorization": f"Bearer {token}"} if token else {})},
+    )
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read())
+
+
+async def register(base_url: str) -> str:
+    body = {"username": f"bench_{secrets.token_hex(6)}", "password": secrets.token_urlsafe(16)}
+    auth = await asyncio.to_thread(rest, base_url, "POST", "/auth/register", body)
+    return auth["token"]
+
+
+async def setup_channel(base_url: str, sender: str, receiver: str) -> str:
+    server = await asyncio.to_thread(rest, base_url, "POST", "/servers", {"name": "latency bench"}, sender)
+    await asyncio.to_thread(rest, base_url, "POST", "/servers/join", {"invite_code": server["invite_code"]}, receiver)
+    channels = await asyncio.to_thread(rest, base_url, "GET", f"/channels/by-server/{server['id']}", None, sender)
+    return channels[0]["id"]
+
+
+async def join(ws, channel_id: str):
+    await ws.send(json.dumps({"type": "join_channel", "channel_id": channel_id}))
+    while json.loads(await ws.recv())["type"] != "joined":
+        pass
+
+
+async def run(args):
+    sender, receiver = await register(args.url), await register(args.url)
+    channel_id = await setup_channel(args.url, sender, receiver)
+    ws_url = args.url.replace("http", "ws", 1) + "/ws?token="
+
+    async with connect(ws_url + sender) as sender_ws, connect(ws_url + receiver) as receiver_ws:
+        await join(sender_ws, channel_id)
+        await join(receiver_ws, channel_id)
+
+        samples = []
+        for i in range(args.warmup + args.messages):
+            content = f"bench-{i}-{secrets.token_hex(args.size // 2)}"
+            started = time.perf_counter()
+            await sender_ws.send(json.dumps({"type": "message", "channel_id": channel_id, "content": content}))
+            while json.loads(await receiver_ws.recv()).get("content") != content:
+                pass
+            if i >= args.warmup:
+                samples.append((time.perf_counter() - started) * 1000)
+
+    samples.sort()
+    print(
+        f"{len(samples)} messages: "
+        f"p50 {samples[len(samples) // 2]:.2f}ms  "
+        f"p99 {samples[min(len(samples) - 1, int(len(samples) * 0.99))]:.2f}ms  "
+        f"mean {statistics.mean(samples):.2f}ms  max {samples[-1]:.2f}ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Channel message send -> receive latency")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--messages", type=int, default=1000)
+    parser.add_argument("--warmup", type=int, default=50)
+    parser.add_argument("--size", type=int, default=256, help="approximate content size in characters")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
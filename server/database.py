@@ -1,11 +1,233 @@
-from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+import asyncio
+import itertools
+import logging
+import re
+import time
+import uuid
+from contextlib import asynccontextmanager
+
+from sqlalchemy import event, func, select, text
+from sqlalchemy.exc import TimeoutError as PoolTimeout
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
 from server.config import settings
+from server.services.cache import MISSING, TTLCache
+from server.services.metrics import db_checkout_seconds, db_query_seconds
+
+logger = logging.getLogger(__name__)
+
+# First keyword of a statement, used as its metrics label
+STATEMENT_KIND = re.compile(r"\s*(\w+)")
+STATEMENT_KINDS = frozenset(("SELECT", "INSERT", "UPDATE", "DELETE", "WITH"))
+
+
+# How long callers wait to get a connection from the pool, including opening a
+# new one and the pre-ping when enabled. A rising tail means the pool is too
+# small for the load (or connections are held too long).
+class PoolMetrics:
+    def __init__(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def observe(self, seconds: float):
+        self.checkouts += 1
+        self.wait_seconds += seconds
+        self.max_wait_seconds = max(self.max_wait_seconds, seconds)
+        db_checkout_seconds.observe(seconds)
+
+    def stats(self) -> dict:
+        pool = engine.pool
+        return {
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "overflow": pool.overflow(),
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "mean_wait_ms": round(self.wait_seconds / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+            "max_wait_ms": round(self.max_wait_seconds * 1000, 3),
+        }
+
+
+pool_metrics = PoolMetrics()
+
+
+class TimedPool(AsyncAdaptedQueuePool):
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            return super().connect()
+        except PoolTimeout:
+            pool_metrics.timeouts += 1
+            raise
+        finally:
+            pool_metrics.observe(time.perf_counter() - started)
+
+
+def _query_started(conn, cursor, statement, parameters, context, executemany):
+    context.query_started = time.perf_counter()
+
+
+def _query_finished(conn, cursor, statement, parameters, context, executemany):
+    match = STATEMENT_KIND.match(statement)
+    kind = match.group(1).upper() if match else ""
+    db_query_seconds.observe(
+        time.perf_counter() - context.query_started, kind if kind in STATEMENT_KINDS else "other"
+    )
+
+
+def statement_cache_args(size: int) -> dict:
+    # Per-connection prepared statement caches (SQLAlchemy's and asyncpg's own).
+    # 0 turns both off and gives every statement a unique name, so a
+    # transaction-mode PgBouncer handing the connection to another server
+    # connection never finds a name already prepared or missing; that is what
+    # asyncpg needs behind it. advisory_lock() still needs a session-mode pool.
+    if size:
+        return {"prepared_statement_cache_size": size}
+    return {
+        "prepared_statement_cache_size": 0,
+        "statement_cache_size": 0,
+        "prepared_statement_name_func": lambda: f"__asyncpg_{uuid.uuid4()}__",
+    }
+
+
+def make_engine(url: str) -> AsyncEngine:
+    engine = create_async_engine(
+        url,
+        echo=False,
+        poolclass=TimedPool,
+        pool_size=settings.db_pool_size,
+        max_overflow=settings.db_max_overflow,
+        pool_timeout=settings.db_pool_timeout_seconds,
+        pool_pre_ping=settings.db_pool_pre_ping,
+        pool_recycle=settings.db_pool_recycle_seconds,
+        connect_args=statement_cache_args(settings.db_statement_cache_size),
+    )
+    # Times each statement's round trip, including the wait for results
+    event.listen(engine.sync_engine, "before_cursor_execute", _query_started)
+    event.listen(engine.sync_engine, "after_cursor_execute", _query_finished)
+    return engine
 
-engine = create_async_engine(settings.database_url, echo=False)
+
+engine = make_engine(settings.database_url)
 async_session = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
 
 async def get_db():
     async with async_session() as session:
         yield session
+
+
+@asynccontextmanager
+async def advisory_lock(key: int):
+    # Session-level pg advisory lock for jobs every worker runs but only one
+    # should execute at a time; yields whether this worker got it
+    async with engine.connect() as conn:
+        locked = await conn.scalar(select(func.pg_try_advisory_lock(key)))
+        try:
+            yield locked
+        finally:
+            if locked:
+                await conn.execute(select(func.pg_advisory_unlock(key)))
+
+
+# Replication lag in seconds; 0 on a replica that has replayed everything it
+# received (so an idle primary does not look like lag) or on a non-replica
+LAG_QUERY = text(
+    "SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE coalesce(extract(epoch FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+)
+
+
+class Replica:
+    def __init__(self, url: str):
+        self.engine = make_engine(url)
+        self.session = async_sessionmaker(self.engine, class_=AsyncSession, expire_on_commit=False)
+        self.name = self.engine.url.render_as_string(hide_password=True)
+        self.healthy = False
+        self.lag = 0.0
+        self.sessions = 0
+
+
+# Routes read-only sessions to streaming replicas, round-robin over the ones a
+# background check last saw reachable and within `max_lag` seconds; with none
+# configured or none healthy, reads go to the primary.
+#
+# A user who just wrote is pinned to the primary for `max_lag` seconds so they
+# read their own writes. Pins are per process, so this is best effort when a
+# client's requests are spread over several workers. Pointing a replica URL at
+# the primary itself works as a local stand-in.
+class ReplicaRouter:
+    def __init__(self, urls: list[str], max_lag: float, interval: float):
+        self.replicas = [Replica(url) for url in urls]
+        self.max_lag = max_lag
+        self.interval = interval
+        self.primary_reads = 0
+        self._pins = TTLCache(max_entries=100_000, ttl=max_lag)
+        self._cycle = itertools.cycle(self.replicas)
+        self._task: asyncio.Task | None = None
+
+    async def start(self):
+        if self.replicas:
+            await self.check()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for replica in self.replicas:
+            await replica.engine.dispose()
+
+    def pin(self, user_id: uuid.UUID):
+        if self.replicas:
+            self._pins.set(user_id, True)
+
+    def session(self, user_id: uuid.UUID | None = None) -> AsyncSession:
+        if self.replicas and (user_id is None or self._pins.get(user_id) is MISSING):
+            for _ in range(len(self.replicas)):
+                replica = next(self._cycle)
+                if replica.healthy:
+                    replica.sessions += 1
+                    return replica.session()
+        self.primary_reads += 1
+        return async_session()
+
+    async def check(self):
+        for replica in self.replicas:
+            try:
+                async with replica.engine.connect() as conn:
+                    replica.lag = float(await conn.scalar(LAG_QUERY))
+                healthy = replica.lag <= self.max_lag
+            except Exception:
+                healthy = False
+            if healthy != replica.healthy:
+                logger.warning("Replica %s is now %s (lag %.1fs)", replica.name, "up" if healthy else "down", replica.lag)
+            replica.healthy = healthy
+
+    def stats(self) -> dict:
+        return {
+            "primary_reads": self.primary_reads,
+            "replicas": [
+                {"name": r.name, "healthy": r.healthy, "lag_seconds": round(r.lag, 3), "sessions": r.sessions}
+                for r in self.replicas
+            ],
+        }
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.check()
+
+
+replicas = ReplicaRouter(
+    settings.database_replica_urls,
+    settings.replica_max_lag_seconds,
+    settings.replica_check_interval_seconds,
+)
@@ -2,12 +2,12 @@ import uuid
 
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
-from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from server.database import get_db
-from server.models.user import User
-from server.services.auth import decode_access_token
+from server.database import get_db, replicas
+from server.models.server_member import MemberRole
+from server.services.authz import authz
+from server.services.principals import Principal, principals
 
 security = HTTPBearer()
 
@@ -15,12 +15,28 @@ security = HTTPBearer()
 async def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security),
     db: AsyncSession = Depends(get_db),
-) -> User:
-    user_id = decode_access_token(credentials.credentials)
-    if user_id is None:
+) -> Principal:
+    principal = await principals.resolve(credentials.credentials, db)
+    if principal is None:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
-    result = await db.execute(select(User).where(User.id == uuid.UUID(user_id)))
-    user = result.scalar_one_or_none()
-    if user is None:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
-    return user
+    return principal
+
+
+async def get_read_db(user: Principal = Depends(get_current_user)):
+    # For read-only queries that tolerate replication lag; authorization checks
+    # stay on get_db so a lagging replica can never be cached as "not a member"
+    async with replicas.session(user.id) as session:
+        yield session
+
+
+async def verify_membership(user_id: uuid.UUID, server_id: uuid.UUID, db: AsyncSession) -> MemberRole:
+    role = await authz.member_role(user_id, server_id, db)
+    if role is None:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not a member of this server")
+    return role
+
+
+async def verify_participant(user_id: uuid.UUID, conversation_id: uuid.UUID, db: AsyncSession):
+    # 404 rather than 403 so conversation ids cannot be probed for existence
+    if not await authz.is_participant(user_id, conversation_id, db):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Conversation not found")
@@ -1,26 +1,87 @@
-import uuid
+import logging
+import time
 from contextlib import asynccontextmanager
 
 import redis.asyncio as aioredis
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 
 from server.config import settings
-from server.database import async_session
-from server.services.auth import decode_access_token
+from server.database import async_session, pool_metrics, replicas
+from server.services import metrics, tracing
+from server.services.attachments import attachment_janitor
+from server.services.auth import passwords
+from server.services.authz import authz
+from server.services.message_maintenance import message_maintenance
+from server.services.message_writer import message_writer
+from server.services.metrics import loop_monitor
+from server.services.principals import principals
+from server.services.recent_history import recent_history
 from server.routes.auth import router as auth_router
 from server.routes.keys import router as keys_router
 from server.routes.servers import router as servers_router
 from server.routes.channels import router as channels_router
+from server.routes.dms import router as dms_router
+from server.routes.attachments import router as attachments_router
+from server.routes.sync import router as sync_router
+from server.routes.envelopes import router as envelopes_router
+from server.ws.broker import RedisBroker
+from server.ws.codec import negotiate
+from server.ws.connection import SLOW_CONSUMER_CLOSE_CODE
+from server.ws.lifecycle import heartbeat
 from server.ws.manager import manager
 from server.ws.messaging import handle_ws_message
+from server.ws.presence import presence
+from server.ws.ratelimit import FLOOD_CLOSE_CODE, limiter
+
+logger = logging.getLogger(__name__)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    tracing.setup()
+    if settings.ws_per_message_deflate:
+        logger.warning(
+            "WebSocket permessage-deflate costs ~300KB per socket; run uvicorn with "
+            "--ws-per-message-deflate=false and set WHISPER_WS_PER_MESSAGE_DEFLATE=false"
+        )
+    await loop_monitor.start()
     app.state.redis = aioredis.from_url(settings.redis_url)
+    await principals.start(app.state.redis)
+    await replicas.start()
+    if settings.ws_broker == "redis":
+        await manager.set_broker(RedisBroker(app.state.redis))
+    else:
+        await manager.broker.start()
+    if settings.authz_cache_redis:
+        await authz.start(app.state.redis)
+    if recent_history.backend == "redis":
+        recent_history.start(app.state.redis)
+    await message_writer.start()
+    # Presence is only shared when sockets are spread over workers
+    await presence.start(app.state.redis if settings.ws_broker == "redis" else None)
+    limiter.start(app.state.redis if settings.ws_rate_limit_redis else None)
+    await heartbeat.start()
+    await message_maintenance.start()
+    await attachment_janitor.start()
     yield
+    await attachment_janitor.stop()
+    await message_maintenance.stop()
+    await heartbeat.stop()
+    limiter.stop()
+    await presence.stop()
+    recent_history.stop()
+    await authz.stop()
+    await principals.stop()
+    await manager.broker.stop()
+    # Drain buffered messages after sockets stop producing them
+    await message_writer.stop()
+    passwords.shutdown()
+    await replicas.stop()
     await app.state.redis.close()
+    await loop_monitor.stop()
+    tracing.shutdown()
 
 
 app = FastAPI(title="Whisper", lifespan=lifespan)
@@ -38,27 +99,100 @@ app.include_router(auth_router)
 app.include_router(keys_router)
 app.include_router(servers_router)
 app.include_router(channels_router)
+app.include_router(dms_router)
+app.include_router(attachments_router)
+app.include_router(sync_router)
+app.include_router(envelopes_router)
 
 
 @app.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket, token: str = Query(...)):
-    user_id_str = decode_access_token(token)
-    if not user_id_str:
+async def websocket_endpoint(
+    websocket: WebSocket,
+    token: str = Query(...),
+    codec: str | None = Query(None),
+    device_id: str | None = Query(None, max_length=64),
+):
+    if not manager.admit():
+        # Node is at its connection or memory limit; clients retry with backoff
+        await websocket.accept()
+        await websocket.close(code=SLOW_CONSUMER_CLOSE_CODE, reason="Server at capacity")
+        return
+
+    negotiated, subprotocol = negotiate(codec, websocket.scope.get("subprotocols", []))
+    if negotiated is None:
+        await websocket.close(code=4002, reason="Unsupported codec")
+        return
+
+    # Reconnect storms mostly hit the principal cache instead of Postgres
+    async with async_session() as db:
+        principal = await principals.resolve(token, db)
+    if principal is None:
         await websocket.close(code=4001, reason="Invalid token")
         return
 
-    user_id = uuid.UUID(user_id_str)
-    await manager.connect(websocket, user_id)
+    conn = await manager.connect(websocket, principal.id, principal.username, negotiated, subprotocol, device_id)
 
+    # One session for the life of the socket. It only holds a pooled connection
+    # while a frame is using Postgres and is closed after every frame, so idle
+    # sockets hold none and frames answered from caches never check one out.
+    db = async_session()
     try:
+        await presence.connected(conn, db)
+        await db.close()
         while True:
-            raw = await websocket.receive_text()
-            async with async_session() as db:
-                await handle_ws_message(websocket, user_id, raw, db)
+            # Text frames for JSON clients, binary frames for MessagePack clients
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            conn.last_seen = time.monotonic()
+            raw = message["text"] if message.get("text") is not None else message.get("bytes", b"")
+            try:
+                await handle_ws_message(conn, raw, db)
+            finally:
+                await db.close()
+            if limiter.flooding(conn):
+                await conn.close(FLOOD_CLOSE_CODE)
+                break
     except WebSocketDisconnect:
-        manager.disconnect(websocket, user_id)
+        pass
+    finally:
+        await manager.disconnect(conn)
+        await presence.disconnected(conn)
 
 
+# Component stats shown by /stats and exported by /metrics
+COMPONENT_STATS = {
+    "ws": manager.stats,
+    "db": pool_metrics.stats,
+    "replicas": replicas.stats,
+    "authz": authz.stats,
+    "principals": principals.stats,
+    "messages": message_writer.stats,
+    "recent_history": recent_history.stats,
+    "presence": presence.stats,
+    "rate_limits": limiter.stats,
+    "heartbeat": heartbeat.stats,
+    "maintenance": message_maintenance.stats,
+    "attachments": attachment_janitor.stats,
+    "passwords": passwords.stats,
+    "event_loop": loop_monitor.stats,
+}
+for name, stats in COMPONENT_STATS.items():
+    metrics.StatsCollector(name, stats)
+
+
+# Load balancer probe: unauthenticated and cheap, so it reveals nothing
 @app.get("/health")
 async def health():
     return {"status": "ok"}
+
+
+if settings.metrics_enabled:
+    @app.get("/metrics", include_in_schema=False)
+    async def prometheus_metrics():
+        return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+    # The same component stats as JSON; some walk every connection
+    @app.get("/stats", include_in_schema=False)
+    async def component_stats():
+        return {name: stats() for name, stats in COMPONENT_STATS.items()}
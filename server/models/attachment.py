@@ -0,0 +1,39 @@
+import uuid
+import enum
+from datetime import datetime, timezone
+from typing import Optional
+
+from sqlalchemy import BigInteger, DateTime, Enum, ForeignKey, Index, String
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.orm import Mapped, mapped_column
+
+from server.models.base import Base
+
+
+class AttachmentStatus(str, enum.Enum):
+    PENDING = "pending"
+    COMPLETE = "complete"
+
+
+# An encrypted blob stored in MinIO under `attachments/{id}`. Clients upload and
+# download it directly with presigned URLs; `size` is the declared size while
+# pending and the stored size once complete, and counts against the server
+# quota, or the uploader's quota for conversation attachments, either way.
+class Attachment(Base):
+    __tablename__ = "attachments"
+    __table_args__ = (Index("ix_attachments_status_created_at", "status", "created_at"),)
+
+    id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    uploader_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
+    server_id: Mapped[Optional[uuid.UUID]] = mapped_column(UUID(as_uuid=True), ForeignKey("servers.id", ondelete="CASCADE"), nullable=True, index=True)
+    conversation_id: Mapped[Optional[uuid.UUID]] = mapped_column(UUID(as_uuid=True), nullable=True)
+    size: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    content_type: Mapped[str] = mapped_column(String(128), nullable=False)
+    status: Mapped[AttachmentStatus] = mapped_column(Enum(AttachmentStatus), nullable=False, default=AttachmentStatus.PENDING)
+    # Set for multipart uploads until they complete
+    upload_id: Mapped[Optional[str]] = mapped_column(String(256), nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc), nullable=False)
+
+    @property
+    def object_name(self) -> str:
+        return f"attachments/{self.id}"
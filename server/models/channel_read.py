@@ -0,0 +1,19 @@
+import uuid
+from datetime import datetime
+
+from sqlalchemy import DateTime, ForeignKey
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.orm import Mapped, mapped_column
+
+from server.models.base import Base
+
+
+# How far each user has read in each channel, as the (created_at, id) key of
+# the last message they saw. Unread counts are messages after it.
+class ChannelRead(Base):
+    __tablename__ = "channel_reads"
+
+    user_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    channel_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), ForeignKey("channels.id", ondelete="CASCADE"), primary_key=True)
+    last_read_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+    last_read_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), nullable=False)
@@ -0,0 +1,30 @@
+import uuid
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import DateTime, ForeignKey, Index, Integer
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.orm import Mapped, mapped_column
+
+from server.models.base import Base
+
+
+# A user's membership in a conversation and their view of it. last_message_at
+# is copied from the conversation onto every participant row so a user's inbox
+# is one range scan of ix_conversation_participants_inbox, newest first.
+# unread_count counts other participants' messages since last_read_*; sends
+# increment it and PUT /dms/{id}/read recomputes it.
+class ConversationParticipant(Base):
+    __tablename__ = "conversation_participants"
+    __table_args__ = (
+        Index("ix_conversation_participants_inbox", "user_id", "last_message_at", "conversation_id"),
+    )
+
+    conversation_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), ForeignKey("conversations.id", ondelete="CASCADE"), primary_key=True)
+    user_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    joined_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+    # The conversation's created_at until its first message
+    last_message_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+    unread_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default="0")
+    last_read_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), nullable=True)
+    last_read_id: Mapped[Optional[uuid.UUID]] = mapped_column(UUID(as_uuid=True), nullable=True)
@@ -0,0 +1,25 @@
+import uuid
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import DateTime, ForeignKey, Index, String, Text
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.orm import Mapped, mapped_column
+
+from server.models.base import Base
+
+
+# One ciphertext of a message per recipient device. The message row keeps the
+# metadata (and an empty ciphertext); envelopes wait here until the device
+# acknowledges them. The primary key is the device's mailbox in delivery order.
+class MessageEnvelope(Base):
+    __tablename__ = "message_envelopes"
+
+    __table_args__ = (Index("ix_message_envelopes_created_at", "created_at"),)
+
+    recipient_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    device_id: Mapped[str] = mapped_column(String(64), primary_key=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), primary_key=True)
+    message_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), primary_key=True)
+    ciphertext: Mapped[str] = mapped_column(Text, nullable=False)
+    nonce: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
@@ -2,7 +2,7 @@ import uuid
 from datetime import datetime, timezone
 from typing import Optional
 
-from sqlalchemy import Text, ForeignKey, DateTime
+from sqlalchemy import Text, ForeignKey, DateTime, Index
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import Mapped, mapped_column
 
@@ -11,12 +11,21 @@ from server.models.base import Base
 
 class Message(Base):
     __tablename__ = "messages"
+    # Keyset pagination indexes for channel and DM history; they also serve
+    # plain channel_id / conversation_id lookups. The table is range-partitioned
+    # by month on created_at (see services/message_maintenance.py), which is why
+    # created_at is part of the primary key.
+    __table_args__ = (
+        Index("ix_messages_channel_id_created_at_id", "channel_id", "created_at", "id"),
+        Index("ix_messages_conversation_id_created_at_id", "conversation_id", "created_at", "id"),
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
 
     id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    channel_id: Mapped[Optional[uuid.UUID]] = mapped_column(UUID(as_uuid=True), ForeignKey("channels.id", ondelete="CASCADE"), nullable=True, index=True)
-    conversation_id: Mapped[Optional[uuid.UUID]] = mapped_column(UUID(as_uuid=True), nullable=True, index=True)
+    channel_id: Mapped[Optional[uuid.UUID]] = mapped_column(UUID(as_uuid=True), ForeignKey("channels.id", ondelete="CASCADE"), nullable=True)
+    conversation_id: Mapped[Optional[uuid.UUID]] = mapped_column(UUID(as_uuid=True), nullable=True)
     sender_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=False)
     ciphertext: Mapped[str] = mapped_column(Text, nullable=False)
     nonce: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
     sender_device_id: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
-    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc), nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), primary_key=True, default=lambda: datetime.now(timezone.utc), nullable=False)
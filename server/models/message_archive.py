@@ -0,0 +1,24 @@
+import uuid
+from datetime import date, datetime, timezone
+
+from sqlalchemy import Boolean, Date, DateTime, Integer, String
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.orm import Mapped, mapped_column
+
+from server.models.base import Base
+
+
+# A monthly messages partition exported to object storage and dropped from
+# Postgres. Objects live under `{prefix}/channel/{id}.ndjson.gz` and
+# `{prefix}/conversation/{id}.ndjson.gz`, one per history target. With
+# targets_indexed, message_archive_targets lists every object of the month;
+# months archived before that table existed have to be probed.
+class MessageArchive(Base):
+    __tablename__ = "message_archives"
+
+    id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    month: Mapped[date] = mapped_column(Date, unique=True, nullable=False)
+    prefix: Mapped[str] = mapped_column(String(256), nullable=False)
+    row_count: Mapped[int] = mapped_column(Integer, nullable=False)
+    targets_indexed: Mapped[bool] = mapped_column(Boolean, nullable=False, default=True, server_default="false")
+    archived_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc), nullable=False)
@@ -0,0 +1,22 @@
+import uuid
+from datetime import date, datetime
+
+from sqlalchemy import Date, DateTime, Integer, String
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.orm import Mapped, mapped_column
+
+from server.models.base import Base
+
+
+# One row per channel / conversation in an archived month, written with the
+# archive, so history reads only fetch objects that exist and overlap the page
+class MessageArchiveTarget(Base):
+    __tablename__ = "message_archive_targets"
+
+    # "channel" or "conversation"
+    kind: Mapped[str] = mapped_column(String(16), primary_key=True)
+    target_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), primary_key=True)
+    month: Mapped[date] = mapped_column(Date, primary_key=True)
+    row_count: Mapped[int] = mapped_column(Integer, nullable=False)
+    first_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+    last_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
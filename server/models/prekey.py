@@ -0,0 +1,18 @@
+import uuid
+
+from sqlalchemy import BigInteger, ForeignKey, Identity, Text
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.orm import Mapped, mapped_column
+
+from server.models.base import Base
+
+
+# One row per uploaded one-time prekey. key_id comes from a sequence, so
+# claiming the lowest key_id hands keys out in upload order; the (user_id,
+# key_id) primary key is the index the claim walks.
+class OneTimePrekey(Base):
+    __tablename__ = "one_time_prekeys"
+
+    user_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    key_id: Mapped[int] = mapped_column(BigInteger, Identity(), primary_key=True)
+    public_key: Mapped[str] = mapped_column(Text, nullable=False)
@@ -1,7 +1,7 @@
 import uuid
 from typing import Optional
 
-from sqlalchemy import String, ForeignKey
+from sqlalchemy import String, ForeignKey, Integer
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import Mapped, mapped_column
 
@@ -16,3 +16,5 @@ class Server(Base):
     owner_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=False)
     invite_code: Mapped[str] = mapped_column(String(16), unique=True, nullable=False, index=True)
     icon_url: Mapped[Optional[str]] = mapped_column(String(512), nullable=True)
+    # Channel messages older than this are deleted; None keeps them forever
+    message_retention_days: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
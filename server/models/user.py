@@ -2,7 +2,7 @@ import uuid
 from typing import Optional
 
 from sqlalchemy import String, Text
-from sqlalchemy.dialects.postgresql import JSONB, UUID
+from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import Mapped, mapped_column
 
 from server.models.base import Base
@@ -17,4 +17,3 @@ class User(Base):
     identity_key_public: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
     signed_prekey_public: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
     signed_prekey_signature: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
-    one_time_prekeys: Mapped[Optional[dict]] = mapped_column(JSONB, default=list, nullable=True)
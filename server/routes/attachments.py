@@ -0,0 +1,180 @@
+import math
+import uuid
+from typing import Optional
+
+from pydantic import BaseModel, Field
+from fastapi import APIRouter, Depends, HTTPException, status
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from server.config import settings
+from server.database import get_db
+from server.deps import get_current_user, verify_membership, verify_participant
+from server.models.attachment import Attachment, AttachmentStatus
+from server.models.server import Server
+from server.models.user import User
+from server.services import storage
+from server.services.attachments import discard, server_usage, uploader_usage
+from server.services.principals import Principal
+
+router = APIRouter(prefix="/attachments", tags=["attachments"])
+
+
+class CreateAttachmentRequest(BaseModel):
+    # Exactly one of server_id / conversation_id
+    server_id: Optional[uuid.UUID] = None
+    conversation_id: Optional[uuid.UUID] = None
+    size: int = Field(gt=0, le=settings.attachment_max_bytes)
+    content_type: str = Field(default="application/octet-stream", max_length=128)
+
+
+class UploadPart(BaseModel):
+    part_number: int
+    url: str
+
+
+class UploadResponse(BaseModel):
+    id: str
+    # Small files: multipart/form-data POST to `url` with `fields` followed by
+    # the file as `file`; the policy rejects bodies over the declared size
+    url: Optional[str] = None
+    fields: dict[str, str] = {}
+    # Multipart: PUT each `part_size` chunk to its URL, then complete with the ETags
+    upload_id: Optional[str] = None
+    part_size: Optional[int] = None
+    parts: list[UploadPart] = []
+    expires_in: int
+
+
+class CompletedPart(BaseModel):
+    part_number: int
+    etag: str
+
+
+class CompleteRequest(BaseModel):
+    parts: list[CompletedPart] = []
+
+
+class AttachmentResponse(BaseModel):
+    id: str
+    size: int
+    content_type: str
+    url: str
+    expires_in: int
+
+
+@router.post("", response_model=UploadResponse, status_code=status.HTTP_201_CREATED)
+async def create_attachment(
+    body: CreateAttachmentRequest,
+    user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    if (body.server_id is None) == (body.conversation_id is None):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Give either server_id or conversation_id")
+
+    if body.server_id is not None:
+        await verify_membership(user.id, body.server_id, db)
+        # Locking the server row serializes concurrent quota checks for it
+        await db.execute(select(Server.id).where(Server.id == body.server_id).with_for_update())
+        if await server_usage(db, body.server_id) + body.size > settings.attachment_server_quota_bytes:
+            raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail="Server storage quota exceeded")
+    else:
+        await verify_participant(user.id, body.conversation_id, db)
+        # DM attachments count against the uploader, serialized on their user row
+        await db.execute(select(User.id).where(User.id == user.id).with_for_update())
+        if await uploader_usage(db, user.id) + body.size > settings.attachment_user_quota_bytes:
+            raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail="Storage quota exceeded")
+
+    attachment = Attachment(
+        id=uuid.uuid4(),
+        uploader_id=user.id,
+        server_id=body.server_id,
+        conversation_id=body.conversation_id,
+        size=body.size,
+        content_type=body.content_type,
+        status=AttachmentStatus.PENDING,
+    )
+    ttl = settings.attachment_url_ttl_seconds
+    response = UploadResponse(id=str(attachment.id), expires_in=ttl)
+    if body.size <= settings.attachment_part_size:
+        response.url, response.fields = storage.presigned_post(attachment.object_name, ttl, body.size)
+    else:
+        attachment.upload_id = await storage.create_multipart(attachment.object_name, body.content_type)
+        response.upload_id = attachment.upload_id
+        response.part_size = settings.attachment_part_size
+        response.parts = [
+            UploadPart(
+                part_number=n,
+                url=storage.presigned_url("PUT", attachment.object_name, ttl, partNumber=str(n), uploadId=attachment.upload_id),
+            )
+            for n in range(1, math.ceil(body.size / settings.attachment_part_size) + 1)
+        ]
+    db.add(attachment)
+    await db.commit()
+    return response
+
+
+@router.post("/{attachment_id}/complete", response_model=AttachmentResponse)
+async def complete_attachment(
+    attachment_id: uuid.UUID,
+    body: CompleteRequest,
+    user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    result = await db.execute(select(Attachment).where(Attachment.id == attachment_id).with_for_update())
+    attachment = result.scalar_one_or_none()
+    if attachment is None or attachment.uploader_id != user.id:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Attachment not found")
+
+    if attachment.status == AttachmentStatus.PENDING:
+        if attachment.upload_id:
+            if not body.parts:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Multipart upload needs its parts")
+            await storage.complete_multipart(
+                attachment.object_name, attachment.upload_id, [(p.part_number, p.etag) for p in body.parts]
+            )
+        # Presigned part PUTs cannot cap the body size, so enforce the declared
+        # size here; once the multipart upload is completed its part URLs stop
+        # working, and single uploads are capped by their POST policy
+        size = await storage.object_size(attachment.object_name)
+        if size is None:
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Upload not found in storage")
+        if size > attachment.size:
+            await discard(attachment)
+            await db.delete(attachment)
+            await db.commit()
+            raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail="Upload larger than declared")
+        attachment.size = size
+        attachment.upload_id = None
+        attachment.status = AttachmentStatus.COMPLETE
+        await db.commit()
+
+    return download_response(attachment)
+
+
+@router.get("/{attachment_id}", response_model=AttachmentResponse)
+async def get_attachment(
+    attachment_id: uuid.UUID,
+    user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    result = await db.execute(select(Attachment).where(Attachment.id == attachment_id))
+    attachment = result.scalar_one_or_none()
+    if attachment is None or attachment.status != AttachmentStatus.COMPLETE:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Attachment not found")
+    if attachment.server_id is not None:
+        await verify_membership(user.id, attachment.server_id, db)
+    else:
+        await verify_participant(user.id, attachment.conversation_id, db)
+    return download_response(attachment)
+
+
+def download_response(attachment: Attachment) -> AttachmentResponse:
+    ttl = settings.attachment_url_ttl_seconds
+    return AttachmentResponse(
+        id=str(attachment.id),
+        size=attachment.size,
+        content_type=attachment.content_type,
+        url=storage.presigned_url("GET", attachment.object_name, ttl),
+        expires_in=ttl,
+    )
@@ -4,12 +4,30 @@ from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from server.database import get_db
+from server.deps import get_current_user
 from server.models.user import User
-from server.services.auth import create_access_token, hash_password, verify_password
+from server.services.auth import HasherBusy, create_access_token, passwords
+from server.services.principals import Principal, RevocationUnavailable, principals
 
 router = APIRouter(prefix="/auth", tags=["auth"])
 
 
+def revocation_unavailable() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Sessions cannot be revoked right now, retry shortly",
+        headers={"Retry-After": "5"},
+    )
+
+
+def too_busy() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail="Too many authentication requests, retry shortly",
+        headers={"Retry-After": "1"},
+    )
+
+
 class RegisterRequest(BaseModel):
     username: str = Field(min_length=3, max_length=32)
     password: str = Field(min_length=8)
@@ -23,6 +41,11 @@ class LoginRequest(BaseModel):
     password: str
 
 
+class ChangePasswordRequest(BaseModel):
+    current_password: str
+    new_password: str = Field(min_length=8)
+
+
 class AuthResponse(BaseModel):
     token: str
     user_id: str
@@ -35,13 +58,17 @@ async def register(body: RegisterRequest, db: AsyncSession = Depends(get_db)):
     if existing.scalar_one_or_none():
         raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Username taken")
 
+    try:
+        password_hash = await passwords.hash(body.password)
+    except HasherBusy:
+        raise too_busy()
+
     user = User(
         username=body.username,
-        password_hash=hash_password(body.password),
+        password_hash=password_hash,
         identity_key_public=body.identity_key_public,
         signed_prekey_public=body.signed_prekey_public,
         signed_prekey_signature=body.signed_prekey_signature,
-        one_time_prekeys=[],
     )
     db.add(user)
     await db.commit()
@@ -55,8 +82,57 @@ async def register(body: RegisterRequest, db: AsyncSession = Depends(get_db)):
 async def login(body: LoginRequest, db: AsyncSession = Depends(get_db)):
     result = await db.execute(select(User).where(User.username == body.username))
     user = result.scalar_one_or_none()
-    if not user or not verify_password(body.password, user.password_hash):
+    if not user:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
+    try:
+        valid = await passwords.verify(body.password, user.password_hash)
+    except HasherBusy:
+        raise too_busy()
+    if not valid:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
 
-    token = create_access_token(str(user.id))
+    # Upgrade hashes made with older Argon2 parameters; best effort under load
+    if passwords.needs_rehash(user.password_hash):
+        try:
+            user.password_hash = await passwords.hash(body.password)
+            await db.commit()
+            passwords.rehashed += 1
+        except HasherBusy:
+            pass
+
+    token = create_access_token(str(user.id), await principals.token_version(user.id))
     return AuthResponse(token=token, user_id=str(user.id), username=user.username)
+
+
+@router.post("/logout", status_code=status.HTTP_204_NO_CONTENT)
+async def logout(user: Principal = Depends(get_current_user)):
+    # Tokens are stateless, so this signs the user out of every session
+    try:
+        await principals.revoke(user.id)
+    except RevocationUnavailable:
+        raise revocation_unavailable()
+
+
+@router.post("/password", response_model=AuthResponse)
+async def change_password(
+    body: ChangePasswordRequest,
+    user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    result = await db.execute(select(User).where(User.id == user.id))
+    row = result.scalar_one()
+    try:
+        if not await passwords.verify(body.current_password, row.password_hash):
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
+        row.password_hash = await passwords.hash(body.new_password)
+    except HasherBusy:
+        raise too_busy()
+    # Revoke existing sessions before the new password takes effect, so it is
+    # never changed while old tokens stay valid; then hand back a token for
+    # this one. If the commit fails the user is only signed out.
+    try:
+        version = await principals.revoke(user.id)
+    except RevocationUnavailable:
+        raise revocation_unavailable()
+    await db.commit()
+    return AuthResponse(token=create_access_token(str(user.id), version), user_id=str(user.id), username=user.username)
@@ -2,16 +2,21 @@ import uuid
 from typing import Optional
 
 from pydantic import BaseModel, Field
-from fastapi import APIRouter, Depends, HTTPException, Query, status
-from sqlalchemy import select
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
+from sqlalchemy import select, tuple_
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from server.database import get_db
-from server.deps import get_current_user
-from server.models.user import User
+from server.database import get_db, replicas
+from server.deps import get_current_user, get_read_db, verify_membership
 from server.models.channel import Channel, ChannelType
-from server.models.server_member import ServerMember
+from server.models.channel_read import ChannelRead
 from server.models.message import Message
+from server.services.authz import authz
+from server.services.history import decode_cursor, encode_cursor, fetch_history
+from server.services.message_maintenance import retention_cutoff
+from server.services.principals import Principal
+from server.services.recent_history import recent_history
 
 router = APIRouter(prefix="/channels", tags=["channels"])
 
@@ -29,20 +34,10 @@ class ChannelResponse(BaseModel):
     type: str
 
 
-async def verify_membership(user_id: uuid.UUID, server_id: uuid.UUID, db: AsyncSession):
-    result = await db.execute(
-        select(ServerMember).where(ServerMember.user_id == user_id, ServerMember.server_id == server_id)
-    )
-    member = result.scalar_one_or_none()
-    if not member:
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not a member of this server")
-    return member
-
-
 @router.post("", response_model=ChannelResponse, status_code=status.HTTP_201_CREATED)
 async def create_channel(
     body: CreateChannelRequest,
-    user: User = Depends(get_current_user),
+    user: Principal = Depends(get_current_user),
     db: AsyncSession = Depends(get_db),
 ):
     server_id = uuid.UUID(body.server_id)
@@ -52,18 +47,21 @@ async def create_channel(
     db.add(channel)
     await db.commit()
     await db.refresh(channel)
+    await authz.invalidate_channel(channel.id)
+    replicas.pin(user.id)
     return ChannelResponse(id=str(channel.id), server_id=str(channel.server_id), name=channel.name, type=channel.type.value)
 
 
 @router.get("/by-server/{server_id}", response_model=list[ChannelResponse])
 async def list_channels(
     server_id: uuid.UUID,
-    user: User = Depends(get_current_user),
+    user: Principal = Depends(get_current_user),
     db: AsyncSession = Depends(get_db),
+    read_db: AsyncSession = Depends(get_read_db),
 ):
     await verify_membership(user.id, server_id, db)
 
-    result = await db.execute(select(Channel).where(Channel.server_id == server_id))
+    result = await read_db.execute(select(Channel).where(Channel.server_id == server_id))
     channels = result.scalars().all()
     return [ChannelResponse(id=str(c.id), server_id=str(c.server_id), name=c.name, type=c.type.value) for c in channels]
 
@@ -75,36 +73,48 @@ class MessageResponse(BaseModel):
     sender_username: str
     content: str
     created_at: str
+    # Opaque; pass as `before` / `after` to page from this message
+    cursor: str
 
 
 @router.get("/{channel_id}/messages", response_model=list[MessageResponse])
 async def get_channel_messages(
     channel_id: uuid.UUID,
     before: Optional[str] = Query(None),
+    after: Optional[str] = Query(None),
     limit: int = Query(50, ge=1, le=100),
-    user: User = Depends(get_current_user),
+    user: Principal = Depends(get_current_user),
     db: AsyncSession = Depends(get_db),
+    read_db: AsyncSession = Depends(get_read_db),
 ):
+    if before and after:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Use either before or after")
+
     # Get channel and verify membership
-    ch_result = await db.execute(select(Channel).where(Channel.id == channel_id))
-    channel = ch_result.scalar_one_or_none()
-    if not channel:
+    server_id = await authz.channel_server(channel_id, db)
+    if server_id is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Channel not found")
-    await verify_membership(user.id, channel.server_id, db)
-
-    query = (
-        select(Message, User.username)
-        .join(User, User.id == Message.sender_id)
-        .where(Message.channel_id == channel_id)
-    )
-    if before:
-        query = query.where(Message.created_at < before)
-    query = query.order_by(Message.created_at.desc()).limit(limit)
-
-    result = await db.execute(query)
-    rows = result.all()
+    await verify_membership(user.id, server_id, db)
 
-    return [
+    # The newest page is served from the recent-history cache when it is warm
+    newest = not before and not after
+    if newest:
+        cached = await recent_history.get(channel_id, limit)
+        if cached is not None:
+            return Response(content=b"[" + b",".join(cached) + b"]", media_type="application/json")
+
+    try:
+        # On a miss, load enough rows to prime the cache for any page size it serves
+        fetch = max(limit, recent_history.size) if newest and recent_history.enabled else limit
+        not_before = await retention_cutoff(server_id, db)
+        # Older pages can come from a replica; the newest page primes the cache
+        # and must include the caller's own recent sends, so it reads the primary
+        history_db = db if newest else read_db
+        rows = await fetch_history(history_db, Message.channel_id, channel_id, before, after, fetch, not_before)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+    messages = [
         MessageResponse(
             id=str(msg.id),
             channel_id=str(msg.channel_id),
@@ -112,6 +122,45 @@ async def get_channel_messages(
             sender_username=username,
             content=msg.ciphertext,
             created_at=msg.created_at.isoformat(),
+            cursor=encode_cursor(msg.created_at, msg.id),
         )
-        for msg, username in reversed(rows)
+        for msg, username in rows
     ]
+    if newest and recent_history.enabled:
+        await recent_history.prime(channel_id, [m.model_dump() for m in messages[-recent_history.size:]])
+    return messages[-limit:]
+
+
+class MarkReadRequest(BaseModel):
+    # Cursor of the newest message the user has seen
+    cursor: str
+
+
+@router.put("/{channel_id}/read", status_code=status.HTTP_204_NO_CONTENT)
+async def mark_read(
+    channel_id: uuid.UUID,
+    body: MarkReadRequest,
+    user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    try:
+        read_at, read_id = decode_cursor(body.cursor)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    server_id = await authz.channel_server(channel_id, db)
+    if server_id is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Channel not found")
+    await verify_membership(user.id, server_id, db)
+
+    stmt = insert(ChannelRead).values(user_id=user.id, channel_id=channel_id, last_read_at=read_at, last_read_id=read_id)
+    # Markers only move forward, so a stale device cannot un-read newer messages
+    await db.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[ChannelRead.user_id, ChannelRead.channel_id],
+            set_={"last_read_at": stmt.excluded.last_read_at, "last_read_id": stmt.excluded.last_read_id},
+            where=tuple_(ChannelRead.last_read_at, ChannelRead.last_read_id)
+            < tuple_(stmt.excluded.last_read_at, stmt.excluded.last_read_id),
+        )
+    )
+    await db.commit()
+    replicas.pin(user.id)
@@ -0,0 +1,204 @@
+import uuid
+from typing import Optional
+
+from pydantic import BaseModel, Field
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from server.config import settings
+from server.database import get_db, replicas
+from server.deps import get_current_user, get_read_db, verify_participant
+from server.models.conversation import Conversation
+from server.models.message import Message
+from server.models.user import User
+from server.services import conversations
+from server.services.authz import authz
+from server.services.history import decode_cursor, encode_cursor, fetch_history
+from server.services.principals import Principal
+from server.ws.manager import manager
+
+router = APIRouter(prefix="/dms", tags=["dms"])
+
+
+class CreateConversationRequest(BaseModel):
+    # Everyone but the creator; one id makes a direct conversation
+    participant_ids: list[uuid.UUID] = Field(min_length=1)
+
+
+class ConversationResponse(BaseModel):
+    id: str
+    participant_ids: list[str]
+    last_message_id: Optional[str]
+    last_message_at: Optional[str]
+    # Other participants' messages after the caller's read marker
+    unread_count: int
+    # Pass as `before` for the next inbox page
+    cursor: str
+
+
+class AddParticipantsRequest(BaseModel):
+    participant_ids: list[uuid.UUID] = Field(min_length=1)
+
+
+class MarkReadRequest(BaseModel):
+    # History cursor of the newest message the user has seen
+    cursor: str
+
+
+class DMMessageResponse(BaseModel):
+    id: str
+    conversation_id: str
+    sender_id: str
+    sender_username: str
+    content: str
+    created_at: str
+    # Opaque; pass as `before` / `after` to page from this message
+    cursor: str
+
+
+@router.post("", response_model=ConversationResponse, status_code=status.HTTP_201_CREATED)
+async def create_conversation(
+    body: CreateConversationRequest,
+    response: Response,
+    user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    user_ids = set(body.participant_ids) | {user.id}
+    if len(user_ids) < 2:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="A conversation needs someone else")
+    if len(user_ids) > settings.dm_max_participants:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Too many participants")
+    result = await db.execute(select(func.count()).select_from(User).where(User.id.in_(user_ids)))
+    if result.scalar_one() != len(user_ids):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
+
+    conversation_id, created = await conversations.create(db, user.id, user_ids)
+    rows = await conversations.inbox(db, user.id, 1, conversation_id=conversation_id)
+    summary = summary_response(*rows[0])
+    if not created:
+        # The direct conversation with this user already exists
+        response.status_code = status.HTTP_200_OK
+        return summary
+
+    await authz.invalidate_conversation(conversation_id)
+    replicas.pin(user.id)
+    # Lets the others' clients join_dm without polling the inbox
+    for user_id in user_ids - {user.id}:
+        await manager.send_personal(
+            user_id,
+            {"type": "conversation_created", "conversation_id": summary.id, "participant_ids": summary.participant_ids},
+        )
+    return summary
+
+
+# The user's conversations, most recent activity first, with their summaries
+@router.get("", response_model=list[ConversationResponse])
+async def list_conversations(
+    before: Optional[str] = Query(None),
+    limit: int = Query(50, ge=1, le=100),
+    user: Principal = Depends(get_current_user),
+    read_db: AsyncSession = Depends(get_read_db),
+):
+    try:
+        before_key = decode_cursor(before) if before else None
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    rows = await conversations.inbox(read_db, user.id, limit, before_key)
+    return [summary_response(*row) for row in rows]
+
+
+# Any participant can add people to a conversation that is not a direct one
+@router.post("/{conversation_id}/participants", response_model=ConversationResponse)
+async def add_participants(
+    conversation_id: uuid.UUID,
+    body: AddParticipantsRequest,
+    user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    await verify_participant(user.id, conversation_id, db)
+    conversation = await db.get(Conversation, conversation_id)
+    if conversation.direct_key is not None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Direct conversations cannot be extended")
+    user_ids = set(body.participant_ids)
+    current = await authz.participants(conversation_id, db)
+    if len(current | user_ids) > settings.dm_max_participants:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Too many participants")
+    result = await db.execute(select(func.count()).select_from(User).where(User.id.in_(user_ids)))
+    if result.scalar_one() != len(user_ids):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
+
+    added = await conversations.add_participants(db, conversation, user_ids)
+    rows = await conversations.inbox(db, user.id, 1, conversation_id=conversation_id)
+    summary = summary_response(*rows[0])
+    if added:
+        await authz.invalidate_conversation(conversation_id)
+        replicas.pin(user.id)
+        for user_id in added:
+            await manager.send_personal(
+                user_id,
+                {"type": "conversation_created", "conversation_id": summary.id, "participant_ids": summary.participant_ids},
+            )
+    return summary
+
+
+@router.put("/{conversation_id}/read", status_code=status.HTTP_204_NO_CONTENT)
+async def mark_read(
+    conversation_id: uuid.UUID,
+    body: MarkReadRequest,
+    user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    try:
+        read_at, read_id = decode_cursor(body.cursor)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    await verify_participant(user.id, conversation_id, db)
+    await conversations.mark_read(db, user.id, conversation_id, read_at, read_id)
+    replicas.pin(user.id)
+
+
+@router.get("/{conversation_id}/messages", response_model=list[DMMessageResponse])
+async def get_dm_messages(
+    conversation_id: uuid.UUID,
+    before: Optional[str] = Query(None),
+    after: Optional[str] = Query(None),
+    limit: int = Query(50, ge=1, le=100),
+    user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+    read_db: AsyncSession = Depends(get_read_db),
+):
+    if before and after:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Use either before or after")
+    await verify_participant(user.id, conversation_id, db)
+
+    try:
+        # As for channels, only cursor pages read from a replica
+        history_db = read_db if before or after else db
+        rows = await fetch_history(history_db, Message.conversation_id, conversation_id, before, after, limit)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+    return [
+        DMMessageResponse(
+            id=str(msg.id),
+            conversation_id=str(msg.conversation_id),
+            sender_id=str(msg.sender_id),
+            sender_username=username,
+            content=msg.ciphertext,
+            created_at=msg.created_at.isoformat(),
+            cursor=encode_cursor(msg.created_at, msg.id),
+        )
+        for msg, username in rows
+    ]
+
+
+def summary_response(participant, conversation, participant_ids) -> ConversationResponse:
+    return ConversationResponse(
+        id=str(conversation.id),
+        participant_ids=[str(user_id) for user_id in participant_ids],
+        last_message_id=str(conversation.last_message_id) if conversation.last_message_id else None,
+        last_message_at=conversation.last_message_at.isoformat() if conversation.last_message_at else None,
+        unread_count=participant.unread_count,
+        cursor=encode_cursor(participant.last_message_at, conversation.id),
+    )
@@ -0,0 +1,104 @@
+from typing import Optional
+
+from pydantic import BaseModel, Field
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from sqlalchemy import delete, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from server.database import get_db
+from server.deps import get_current_user
+from server.models.envelope import MessageEnvelope
+from server.models.message import Message
+from server.models.user import User
+from server.services.history import decode_cursor, encode_cursor
+from server.services.principals import Principal
+
+router = APIRouter(prefix="/envelopes", tags=["envelopes"])
+
+
+class EnvelopeResponse(BaseModel):
+    message_id: str
+    channel_id: Optional[str]
+    conversation_id: Optional[str]
+    sender_id: str
+    sender_username: str
+    sender_device_id: Optional[str]
+    content: str
+    nonce: Optional[str]
+    created_at: str
+    # Pass as `after` for the next page, and to /ack once processed
+    cursor: str
+
+
+class AckRequest(BaseModel):
+    device_id: str = Field(min_length=1, max_length=64)
+    # Everything up to and including this envelope is dropped
+    cursor: str
+
+
+# A device's mailbox: envelopes addressed to it that it has not acknowledged,
+# oldest first. Devices read it after reconnecting and ack what they stored;
+# envelopes delivered live are acked the same way.
+@router.get("", response_model=list[EnvelopeResponse])
+async def list_envelopes(
+    device_id: str = Query(min_length=1, max_length=64),
+    after: Optional[str] = Query(None),
+    limit: int = Query(100, ge=1, le=500),
+    user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    query = (
+        select(MessageEnvelope, Message, User.username)
+        .join(
+            Message,
+            (Message.id == MessageEnvelope.message_id) & (Message.created_at == MessageEnvelope.created_at),
+        )
+        .join(User, User.id == Message.sender_id)
+        .where(MessageEnvelope.recipient_id == user.id, MessageEnvelope.device_id == device_id)
+        .order_by(MessageEnvelope.created_at, MessageEnvelope.message_id)
+        .limit(limit)
+    )
+    if after:
+        try:
+            query = query.where(
+                tuple_(MessageEnvelope.created_at, MessageEnvelope.message_id) > tuple_(*decode_cursor(after))
+            )
+        except ValueError:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+    result = await db.execute(query)
+    return [
+        EnvelopeResponse(
+            message_id=str(msg.id),
+            channel_id=str(msg.channel_id) if msg.channel_id else None,
+            conversation_id=str(msg.conversation_id) if msg.conversation_id else None,
+            sender_id=str(msg.sender_id),
+            sender_username=username,
+            sender_device_id=msg.sender_device_id,
+            content=envelope.ciphertext,
+            nonce=envelope.nonce,
+            created_at=envelope.created_at.isoformat(),
+            cursor=encode_cursor(envelope.created_at, envelope.message_id),
+        )
+        for envelope, msg, username in result.all()
+    ]
+
+
+@router.post("/ack", status_code=status.HTTP_204_NO_CONTENT)
+async def ack_envelopes(
+    body: AckRequest,
+    user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    try:
+        upto = decode_cursor(body.cursor)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    await db.execute(
+        delete(MessageEnvelope).where(
+            MessageEnvelope.recipient_id == user.id,
+            MessageEnvelope.device_id == body.device_id,
+            tuple_(MessageEnvelope.created_at, MessageEnvelope.message_id) <= tuple_(*upto),
+        )
+    )
+    await db.commit()
@@ -1,60 +1,101 @@
 import uuid
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from server.config import settings
 from server.database import get_db
 from server.deps import get_current_user
 from server.models.user import User
+from server.services import prekeys
+from server.services.principals import Principal
 
 router = APIRouter(prefix="/auth/keys", tags=["keys"])
 
 
 class PrekeysUpload(BaseModel):
-    prekeys: list[str]
+    prekeys: list[str] = Field(max_length=settings.prekey_upload_max)
+
+
+class BundlesRequest(BaseModel):
+    user_ids: list[uuid.UUID] = Field(min_length=1, max_length=100)
 
 
 class PrekeyBundle(BaseModel):
+    user_id: str
     identity_key_public: str | None
     signed_prekey_public: str | None
     signed_prekey_signature: str | None
     one_time_prekey: str | None
+    # Lets the recipient tell which one-time prekey the session used
+    one_time_prekey_id: int | None
 
 
 @router.post("/prekeys")
 async def upload_prekeys(
     body: PrekeysUpload,
-    user: User = Depends(get_current_user),
+    user: Principal = Depends(get_current_user),
     db: AsyncSession = Depends(get_db),
 ):
-    existing = user.one_time_prekeys or []
-    existing.extend(body.prekeys)
-    user.one_time_prekeys = existing
+    # key_ids[i] is the id assigned to prekeys[i]; bundles report it as one_time_prekey_id
+    key_ids, remaining = await prekeys.upload(db, user.id, body.prekeys)
+    return {"count": remaining, "key_ids": key_ids}
+
+
+@router.get("/prekeys/count")
+async def count_prekeys(
+    user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    return {"count": await prekeys.count(db, user.id)}
+
+
+async def claim_bundles(db: AsyncSession, user_ids: list[uuid.UUID]) -> list[PrekeyBundle]:
+    result = await db.execute(
+        select(User.id, User.identity_key_public, User.signed_prekey_public, User.signed_prekey_signature).where(
+            User.id.in_(user_ids)
+        )
+    )
+    users = result.all()
+    claimed = await prekeys.claim(db, [u.id for u in users])
     await db.commit()
-    return {"count": len(existing)}
+    await prekeys.notify_low(db, list(claimed))
+
+    bundles = []
+    for u in users:
+        key_id, public_key = claimed.get(u.id, (None, None))
+        bundles.append(
+            PrekeyBundle(
+                user_id=str(u.id),
+                identity_key_public=u.identity_key_public,
+                signed_prekey_public=u.signed_prekey_public,
+                signed_prekey_signature=u.signed_prekey_signature,
+                one_time_prekey=public_key,
+                one_time_prekey_id=key_id,
+            )
+        )
+    return bundles
 
 
 @router.get("/bundle/{user_id}", response_model=PrekeyBundle)
 async def get_prekey_bundle(
     user_id: uuid.UUID,
-    _: User = Depends(get_current_user),
+    _: Principal = Depends(get_current_user),
     db: AsyncSession = Depends(get_db),
 ):
-    result = await db.execute(select(User).where(User.id == user_id))
-    target = result.scalar_one_or_none()
-    if not target:
+    bundles = await claim_bundles(db, [user_id])
+    if not bundles:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
+    return bundles[0]
 
-    one_time_prekey = None
-    if target.one_time_prekeys:
-        one_time_prekey = target.one_time_prekeys.pop(0)
-        await db.commit()
 
-    return PrekeyBundle(
-        identity_key_public=target.identity_key_public,
-        signed_prekey_public=target.signed_prekey_public,
-        signed_prekey_signature=target.signed_prekey_signature,
-        one_time_prekey=one_time_prekey,
-    )
+@router.post("/bundles", response_model=list[PrekeyBundle])
+async def get_prekey_bundles(
+    body: BundlesRequest,
+    _: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    # Bundles for many users at once (group sessions); unknown ids are omitted
+    return await claim_bundles(db, list(dict.fromkeys(body.user_ids)))
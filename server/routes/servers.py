@@ -1,17 +1,20 @@
 import secrets
 import uuid
+from typing import Optional
 
 from pydantic import BaseModel, Field
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from server.database import get_db
-from server.deps import get_current_user
-from server.models.user import User
+from server.database import get_db, replicas
+from server.deps import get_current_user, get_read_db, verify_membership
 from server.models.server import Server
 from server.models.channel import Channel, ChannelType
 from server.models.server_member import ServerMember, MemberRole
+from server.services.authz import authz
+from server.services.message_maintenance import invalidate_retention
+from server.services.principals import Principal
 
 router = APIRouter(prefix="/servers", tags=["servers"])
 
@@ -31,6 +34,16 @@ class ServerResponse(BaseModel):
     invite_code: str
 
 
+class RetentionRequest(BaseModel):
+    # None keeps channel messages forever
+    days: Optional[int] = Field(default=None, ge=1)
+
+
+class RetentionResponse(BaseModel):
+    server_id: str
+    days: Optional[int]
+
+
 class MemberResponse(BaseModel):
     user_id: str
     username: str
@@ -40,7 +53,7 @@ class MemberResponse(BaseModel):
 @router.post("", response_model=ServerResponse, status_code=status.HTTP_201_CREATED)
 async def create_server(
     body: CreateServerRequest,
-    user: User = Depends(get_current_user),
+    user: Principal = Depends(get_current_user),
     db: AsyncSession = Depends(get_db),
 ):
     server = Server(
@@ -59,15 +72,17 @@ async def create_server(
 
     await db.commit()
     await db.refresh(server)
+    await authz.invalidate_member(user.id, server.id)
+    replicas.pin(user.id)
     return ServerResponse(id=str(server.id), name=server.name, owner_id=str(server.owner_id), invite_code=server.invite_code)
 
 
 @router.get("", response_model=list[ServerResponse])
 async def list_servers(
-    user: User = Depends(get_current_user),
-    db: AsyncSession = Depends(get_db),
+    user: Principal = Depends(get_current_user),
+    read_db: AsyncSession = Depends(get_read_db),
 ):
-    result = await db.execute(
+    result = await read_db.execute(
         select(Server)
         .join(ServerMember, ServerMember.server_id == Server.id)
         .where(ServerMember.user_id == user.id)
@@ -79,7 +94,7 @@ async def list_servers(
 @router.post("/join", response_model=ServerResponse)
 async def join_server(
     body: JoinServerRequest,
-    user: User = Depends(get_current_user),
+    user: Principal = Depends(get_current_user),
     db: AsyncSession = Depends(get_db),
 ):
     result = await db.execute(select(Server).where(Server.invite_code == body.invite_code))
@@ -96,27 +111,45 @@ async def join_server(
 
     db.add(ServerMember(user_id=user.id, server_id=server.id, role=MemberRole.MEMBER))
     await db.commit()
+    await authz.invalidate_member(user.id, server.id)
+    replicas.pin(user.id)
     return ServerResponse(id=str(server.id), name=server.name, owner_id=str(server.owner_id), invite_code=server.invite_code)
 
 
 @router.get("/{server_id}/members", response_model=list[MemberResponse])
 async def list_members(
     server_id: uuid.UUID,
-    user: User = Depends(get_current_user),
+    user: Principal = Depends(get_current_user),
     db: AsyncSession = Depends(get_db),
+    read_db: AsyncSession = Depends(get_read_db),
 ):
-    # Verify user is a member
-    membership = await db.execute(
-        select(ServerMember).where(ServerMember.user_id == user.id, ServerMember.server_id == server_id)
-    )
-    if not membership.scalar_one_or_none():
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not a member")
+    await verify_membership(user.id, server_id, db)
 
     from server.models.user import User as UserModel
-    result = await db.execute(
+    result = await read_db.execute(
         select(ServerMember, UserModel.username)
         .join(UserModel, UserModel.id == ServerMember.user_id)
         .where(ServerMember.server_id == server_id)
     )
     rows = result.all()
     return [MemberResponse(user_id=str(m.user_id), username=username, role=m.role.value) for m, username in rows]
+
+
+@router.patch("/{server_id}/retention", response_model=RetentionResponse)
+async def set_retention(
+    server_id: uuid.UUID,
+    body: RetentionRequest,
+    user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    role = await verify_membership(user.id, server_id, db)
+    if role not in (MemberRole.OWNER, MemberRole.ADMIN):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only owners and admins can change retention")
+
+    result = await db.execute(select(Server).where(Server.id == server_id))
+    server = result.scalar_one()
+    server.message_retention_days = body.days
+    await db.commit()
+    invalidate_retention(server_id)
+    replicas.pin(user.id)
+    return RetentionResponse(server_id=str(server_id), days=body.days)
@@ -0,0 +1,28 @@
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, Query, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from server.deps import get_current_user, get_read_db
+from server.services import initial_sync
+from server.services.principals import Principal
+
+router = APIRouter(prefix="/sync", tags=["sync"])
+
+
+# Everything the client loads at startup in one request, instead of a
+# /servers call plus channels and members per server
+@router.get("")
+async def initial_sync_state(
+    version: Optional[str] = Query(None),
+    members: bool = Query(True),
+    if_none_match: Optional[str] = Header(None),
+    user: Principal = Depends(get_current_user),
+    read_db: AsyncSession = Depends(get_read_db),
+):
+    body = await initial_sync.build(read_db, user.id, members, version)
+    tag = f'"{initial_sync.digest(body)}"'
+    headers = {"ETag": tag, "Cache-Control": "private, no-cache"}
+    if if_none_match == tag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
@@ -0,0 +1,112 @@
+import asyncio
+import logging
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from server.config import settings
+from server.database import advisory_lock, async_session
+from server.models.attachment import Attachment, AttachmentStatus
+from server.services import storage
+
+logger = logging.getLogger(__name__)
+
+# pg advisory lock key so only one worker collects orphaned uploads at a time
+GC_LOCK = 0x57484952
+GC_BATCH = 500
+
+
+async def server_usage(db: AsyncSession, server_id: uuid.UUID) -> int:
+    # Bytes counted against the server quota, pending uploads included
+    result = await db.execute(select(func.coalesce(func.sum(Attachment.size), 0)).where(Attachment.server_id == server_id))
+    return result.scalar_one()
+
+
+async def uploader_usage(db: AsyncSession, user_id: uuid.UUID) -> int:
+    # Bytes a user has stored in conversations, pending uploads included
+    result = await db.execute(
+        select(func.coalesce(func.sum(Attachment.size), 0)).where(
+            Attachment.uploader_id == user_id, Attachment.server_id.is_(None)
+        )
+    )
+    return result.scalar_one()
+
+
+async def discard(attachment: Attachment):
+    # Remove whatever an upload left in MinIO; the caller deletes the row
+    if attachment.upload_id:
+        await storage.abort_multipart(attachment.object_name, attachment.upload_id)
+    await storage.remove(attachment.object_name)
+
+
+async def collect_orphans(db: AsyncSession, older_than: datetime) -> int:
+    # Uploads that were started but never completed, oldest first
+    removed = 0
+    while True:
+        result = await db.execute(
+            select(Attachment)
+            .where(Attachment.status == AttachmentStatus.PENDING, Attachment.created_at < older_than)
+            .order_by(Attachment.created_at)
+            .limit(GC_BATCH)
+        )
+        orphans = result.scalars().all()
+        for attachment in orphans:
+            await discard(attachment)
+            await db.delete(attachment)
+        await db.commit()
+        removed += len(orphans)
+        if len(orphans) < GC_BATCH:
+            return removed
+
+
+# Periodically deletes pending uploads older than `pending_ttl`, releasing the
+# quota they reserved. Runs on every worker behind an advisory lock.
+class AttachmentJanitor:
+    def __init__(self, interval: float, pending_ttl: timedelta):
+        self.interval = interval
+        self.pending_ttl = pending_ttl
+        self.collected = 0
+        self._task: asyncio.Task | None = None
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        return {"collected": self.collected}
+
+    async def run_once(self):
+        async with advisory_lock(GC_LOCK) as locked:
+            if not locked:
+                return
+            async with async_session() as db:
+                removed = await collect_orphans(db, datetime.now(timezone.utc) - self.pending_ttl)
+            if removed:
+                logger.info("Collected %d orphaned attachment uploads", removed)
+            self.collected += removed
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Attachment garbage collection failed")
+
+
+attachment_janitor = AttachmentJanitor(
+    settings.attachment_gc_interval_seconds,
+    timedelta(hours=settings.attachment_pending_ttl_hours),
+)
@@ -1,28 +1,86 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
 
 from jose import JWTError, jwt
 from passlib.hash import argon2
 
 from server.config import settings
+from server.services.metrics import password_hash_seconds
+from server.services.tracing import span
 
 
-def hash_password(password: str) -> str:
-    return argon2.hash(password)
+class HasherBusy(Exception):
+    pass
 
 
-def verify_password(password: str, password_hash: str) -> bool:
-    return argon2.verify(password, password_hash)
+# Argon2 takes tens of milliseconds of CPU per call, which would stall every
+# socket on the worker if run on the event loop. argon2-cffi releases the GIL,
+# so a small thread pool runs hashes in parallel. At most `max_pending` hashes
+# may be running or queued; past that HasherBusy is raised so the caller can
+# shed load rather than build an unbounded queue.
+class PasswordHasher:
+    def __init__(self, workers: int, max_pending: int, time_cost: int, memory_cost: int, parallelism: int):
+        self.max_pending = max_pending
+        self.pending = 0
+        self.rejected = 0
+        self.rehashed = 0
+        self._argon2 = argon2.using(time_cost=time_cost, memory_cost=memory_cost, parallelism=parallelism)
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="argon2")
 
+    async def hash(self, password: str) -> str:
+        return await self._run("hash", self._argon2.hash, password)
 
-def create_access_token(user_id: str) -> str:
+    async def verify(self, password: str, password_hash: str) -> bool:
+        return await self._run("verify", self._argon2.verify, password, password_hash)
+
+    def needs_rehash(self, password_hash: str) -> bool:
+        return self._argon2.needs_update(password_hash)
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict:
+        return {"pending": self.pending, "rejected": self.rejected, "rehashed": self.rehashed}
+
+    async def _run(self, op: str, fn, *args):
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise HasherBusy
+        self.pending += 1
+        started = time.perf_counter()
+        try:
+            with span(f"password.{op}"):
+                return await asyncio.get_running_loop().run_in_executor(self._pool, fn, *args)
+        finally:
+            self.pending -= 1
+            password_hash_seconds.observe(time.perf_counter() - started, op)
+
+
+passwords = PasswordHasher(
+    settings.password_hash_workers,
+    settings.password_hash_max_pending,
+    settings.argon2_time_cost,
+    settings.argon2_memory_cost,
+    settings.argon2_parallelism,
+)
+
+
+def create_access_token(user_id: str, token_version: int = 0) -> str:
+    # `tv` is the user's revocation counter when issued (see services/principals.py)
     expire = datetime.now(timezone.utc) + timedelta(hours=settings.jwt_expiry_hours)
-    payload = {"sub": user_id, "exp": expire}
+    payload = {"sub": user_id, "exp": expire, "tv": token_version}
     return jwt.encode(payload, settings.jwt_secret, algorithm=settings.jwt_algorithm)
 
 
-def decode_access_token(token: str) -> str | None:
+def decode_access_claims(token: str) -> dict | None:
     try:
-        payload = jwt.decode(token, settings.jwt_secret, algorithms=[settings.jwt_algorithm])
-        return payload.get("sub")
+        return jwt.decode(token, settings.jwt_secret, algorithms=[settings.jwt_algorithm])
     except JWTError:
         return None
+
+
+def decode_access_token(token: str) -> str | None:
+    payload = decode_access_claims(token)
+    return payload.get("sub") if payload is not None else None
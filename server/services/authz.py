@@ -0,0 +1,206 @@
+import asyncio
+import logging
+import uuid
+
+from redis.exceptions import RedisError
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from server.config import settings
+from server.models.channel import Channel
+from server.models.conversation_participant import ConversationParticipant
+from server.models.server_member import MemberRole, ServerMember
+from server.services.cache import MISSING, TTLCache
+
+logger = logging.getLogger(__name__)
+
+INVALIDATION_CHANNEL = "whisper:authz:invalidate"
+# Stored in Redis for "looked up, not a member" so negative results are shared too
+NOT_A_MEMBER = ""
+
+
+def channel_key(channel_id: uuid.UUID) -> str:
+    return f"channel:{channel_id}"
+
+
+def member_key(user_id: uuid.UUID, server_id: uuid.UUID) -> str:
+    return f"member:{user_id}:{server_id}"
+
+
+def conversation_key(conversation_id: uuid.UUID) -> str:
+    return f"conversation:{conversation_id}"
+
+
+# Caches channel_id -> server_id, (user_id, server_id) -> role and
+# conversation_id -> participant ids for the WebSocket join and REST
+# membership checks. Local entries expire after a TTL
+# and are evicted LRU; with Redis attached, lookups fall back to a shared tier
+# and invalidations are broadcast so every worker drops its copy.
+class AuthzCache:
+    def __init__(self, max_entries: int, ttl: float):
+        self.channels = TTLCache(max_entries, ttl)
+        self.members = TTLCache(max_entries, ttl)
+        self.conversations = TTLCache(max_entries, ttl)
+        self.redis_hits = 0
+        self._redis = None
+        self._prefix = "whisper:authz:"
+        self._pubsub = None
+        self._listener: asyncio.Task | None = None
+
+    async def start(self, redis):
+        self._redis = redis
+        self._pubsub = redis.pubsub(ignore_subscribe_messages=True)
+        await self._pubsub.subscribe(INVALIDATION_CHANNEL)
+        self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+        if self._pubsub is not None:
+            await self._pubsub.aclose()
+            self._pubsub = None
+        self._redis = None
+
+    async def channel_server(self, channel_id: uuid.UUID, db: AsyncSession) -> uuid.UUID | None:
+        key = channel_key(channel_id)
+        server_id = self.channels.get(key)
+        if server_id is not MISSING:
+            return server_id
+
+        shared = await self._redis_get(key)
+        if shared is not None:
+            server_id = uuid.UUID(shared)
+            self.channels.set(key, server_id)
+            return server_id
+
+        result = await db.execute(select(Channel.server_id).where(Channel.id == channel_id))
+        server_id = result.scalar_one_or_none()
+        # Unknown channels are not cached so random ids cannot flush the LRU
+        if server_id is not None:
+            self.channels.set(key, server_id)
+            await self._redis_set(key, str(server_id))
+        return server_id
+
+    async def member_role(self, user_id: uuid.UUID, server_id: uuid.UUID, db: AsyncSession) -> MemberRole | None:
+        key = member_key(user_id, server_id)
+        role = self.members.get(key)
+        if role is not MISSING:
+            return role
+
+        shared = await self._redis_get(key)
+        if shared is not None:
+            role = MemberRole(shared) if shared != NOT_A_MEMBER else None
+            self.members.set(key, role)
+            return role
+
+        result = await db.execute(
+            select(ServerMember.role).where(ServerMember.user_id == user_id, ServerMember.server_id == server_id)
+        )
+        role = result.scalar_one_or_none()
+        self.members.set(key, role)
+        await self._redis_set(key, role.value if role is not None else NOT_A_MEMBER)
+        return role
+
+    async def participants(self, conversation_id: uuid.UUID, db: AsyncSession) -> frozenset[uuid.UUID]:
+        # One entry per conversation serves every participant's checks
+        key = conversation_key(conversation_id)
+        user_ids = self.conversations.get(key)
+        if user_ids is not MISSING:
+            return user_ids
+
+        shared = await self._redis_get(key)
+        if shared is not None:
+            user_ids = frozenset(uuid.UUID(user_id) for user_id in shared.split(","))
+            self.conversations.set(key, user_ids)
+            return user_ids
+
+        result = await db.execute(
+            select(ConversationParticipant.user_id).where(ConversationParticipant.conversation_id == conversation_id)
+        )
+        user_ids = frozenset(result.scalars().all())
+        # Unknown conversations are not cached, as for channels
+        if user_ids:
+            self.conversations.set(key, user_ids)
+            await self._redis_set(key, ",".join(str(user_id) for user_id in user_ids))
+        return user_ids
+
+    async def is_participant(self, user_id: uuid.UUID, conversation_id: uuid.UUID, db: AsyncSession) -> bool:
+        return user_id in await self.participants(conversation_id, db)
+
+    async def invalidate_channel(self, channel_id: uuid.UUID):
+        await self._invalidate(channel_key(channel_id))
+
+    async def invalidate_member(self, user_id: uuid.UUID, server_id: uuid.UUID):
+        await self._invalidate(member_key(user_id, server_id))
+
+    async def invalidate_conversation(self, conversation_id: uuid.UUID):
+        await self._invalidate(conversation_key(conversation_id))
+
+    def stats(self) -> dict:
+        return {
+            "channels": self.channels.stats(),
+            "members": self.members.stats(),
+            "conversations": self.conversations.stats(),
+            "redis_hits": self.redis_hits,
+            "redis": self._redis is not None,
+        }
+
+    def _evict(self, key: str):
+        if key.startswith("channel:"):
+            self.channels.pop(key)
+        elif key.startswith("conversation:"):
+            self.conversations.pop(key)
+        else:
+            self.members.pop(key)
+
+    async def _invalidate(self, key: str):
+        self._evict(key)
+        if self._redis is None:
+            return
+        try:
+            await self._redis.delete(self._prefix + key)
+            await self._redis.publish(INVALIDATION_CHANNEL, key)
+        except RedisError:
+            logger.warning("Failed to propagate authz invalidation for %s", key)
+
+    async def _redis_get(self, key: str) -> str | None:
+        if self._redis is None:
+            return None
+        try:
+            value = await self._redis.get(self._prefix + key)
+        except RedisError:
+            return None
+        if value is None:
+            return None
+        self.redis_hits += 1
+        return value.decode()
+
+    async def _redis_set(self, key: str, value: str):
+        if self._redis is None:
+            return
+        try:
+            await self._redis.set(self._prefix + key, value, ex=max(1, int(self.members.ttl)))
+        except RedisError:
+            pass
+
+    async def _listen(self):
+        while True:
+            try:
+                event = await self._pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                if event is None or event["type"] != "message":
+                    continue
+                key = event["data"]
+                self._evict(key.decode() if isinstance(key, bytes) else key)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Authz invalidation listener error")
+                await asyncio.sleep(1.0)
+
+
+authz = AuthzCache(settings.authz_cache_max_entries, settings.authz_cache_ttl_seconds)
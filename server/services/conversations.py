@@ -0,0 +1,180 @@
+import uuid
+from datetime import datetime, timezone
+
+from sqlalchemy import case, func, or_, select, tuple_, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+
+from server.config import settings
+from server.models.conversation import Conversation
+from server.models.conversation_participant import ConversationParticipant
+from server.models.message import Message
+
+
+def direct_key(a: uuid.UUID, b: uuid.UUID) -> str:
+    low, high = sorted((str(a), str(b)))
+    return f"{low}:{high}"
+
+
+def summary_updates(conversation_id, sender_id, count, last_at, last_id) -> list:
+    # Applies `count` messages from one sender, the newest (last_at, last_id),
+    # to the conversation summary. Used on the send path, as CTEs of the message
+    # insert in sync mode and once per (conversation, sender) in a batch, so
+    # arguments may be values or bindparams. Increments add up in any order:
+    # each participant's unread_count grows by the messages other people sent.
+    participants = ConversationParticipant.__table__
+    conversations = Conversation.__table__
+    return [
+        update(participants)
+        .where(participants.c.conversation_id == conversation_id)
+        .values(
+            unread_count=participants.c.unread_count + case((participants.c.user_id == sender_id, 0), else_=count),
+            last_message_at=func.greatest(participants.c.last_message_at, last_at),
+        ),
+        update(conversations)
+        .where(
+            conversations.c.id == conversation_id,
+            or_(
+                conversations.c.last_message_at.is_(None),
+                tuple_(conversations.c.last_message_at, conversations.c.last_message_id) < tuple_(last_at, last_id),
+            ),
+        )
+        .values(last_message_id=last_id, last_message_at=last_at),
+    ]
+
+
+async def create(db: AsyncSession, creator_id: uuid.UUID, user_ids: set[uuid.UUID]) -> tuple[uuid.UUID, bool]:
+    # Returns (conversation id, created). Two-person conversations are unique
+    # per pair: asking again returns the existing one.
+    user_ids = user_ids | {creator_id}
+    key = direct_key(*user_ids) if len(user_ids) == 2 else None
+    now = datetime.now(timezone.utc)
+    conversation_id = uuid.uuid4()
+    stmt = insert(Conversation).values(id=conversation_id, created_by=creator_id, direct_key=key, created_at=now)
+    if key is not None:
+        stmt = stmt.on_conflict_do_nothing(index_elements=[Conversation.direct_key])
+    result = await db.execute(stmt.returning(Conversation.id))
+    if result.scalar_one_or_none() is None:
+        result = await db.execute(select(Conversation.id).where(Conversation.direct_key == key))
+        return result.scalar_one(), False
+    await db.execute(
+        insert(ConversationParticipant),
+        [
+            {"conversation_id": conversation_id, "user_id": user_id, "joined_at": now, "last_message_at": now}
+            for user_id in user_ids
+        ],
+    )
+    await db.commit()
+    return conversation_id, True
+
+
+async def add_participants(db: AsyncSession, conversation: Conversation, user_ids: set[uuid.UUID]) -> set[uuid.UUID]:
+    # Adds users to a group conversation, or restores recipients that the
+    # 0008 backfill could not recover; returns who was actually added. A legacy
+    # conversation that ends up with two people becomes their direct
+    # conversation unless the pair already has one.
+    now = datetime.now(timezone.utc)
+    result = await db.execute(
+        insert(ConversationParticipant)
+        .values(
+            [
+                {
+                    "conversation_id": conversation.id,
+                    "user_id": user_id,
+                    "joined_at": now,
+                    "last_message_at": conversation.last_message_at or now,
+                }
+                for user_id in user_ids
+            ]
+        )
+        .on_conflict_do_nothing()
+        .returning(ConversationParticipant.user_id)
+    )
+    added = set(result.scalars().all())
+    participants = await db.execute(
+        select(ConversationParticipant.user_id).where(ConversationParticipant.conversation_id == conversation.id)
+    )
+    user_ids = participants.scalars().all()
+    if added and len(user_ids) == 2:
+        key = direct_key(*user_ids)
+        other = aliased(Conversation)
+        taken = select(other.id).where(other.direct_key == key)
+        await db.execute(
+            update(Conversation)
+            .where(Conversation.id == conversation.id, ~taken.exists())
+            .values(direct_key=key)
+            .execution_options(synchronize_session=False)
+        )
+    await db.commit()
+    return added
+
+
+async def inbox(
+    db: AsyncSession,
+    user_id: uuid.UUID,
+    limit: int,
+    before: tuple[datetime, uuid.UUID] | None = None,
+    conversation_id: uuid.UUID | None = None,
+) -> list:
+    # One range scan of the user's participant rows, newest activity first,
+    # whatever the size of the history; each row then costs primary key
+    # lookups for its conversation and participant list. Returns
+    # (participant, conversation, participant ids) rows.
+    others = (
+        select(func.array_agg(ConversationParticipant.user_id))
+        .where(ConversationParticipant.conversation_id == Conversation.id)
+        .correlate(Conversation)
+        .scalar_subquery()
+    )
+    query = (
+        select(ConversationParticipant, Conversation, others)
+        .join(Conversation, Conversation.id == ConversationParticipant.conversation_id)
+        .where(ConversationParticipant.user_id == user_id)
+        .order_by(ConversationParticipant.last_message_at.desc(), ConversationParticipant.conversation_id.desc())
+        .limit(limit)
+    )
+    if before is not None:
+        query = query.where(
+            tuple_(ConversationParticipant.last_message_at, ConversationParticipant.conversation_id) < tuple_(*before)
+        )
+    if conversation_id is not None:
+        query = query.where(ConversationParticipant.conversation_id == conversation_id)
+    result = await db.execute(query)
+    return result.all()
+
+
+async def mark_read(
+    db: AsyncSession, user_id: uuid.UUID, conversation_id: uuid.UUID, read_at: datetime, read_id: uuid.UUID
+):
+    # Moves the marker forward only and recounts what is still unread behind
+    # it, capped like the channel counts in /sync. A message committed while
+    # this runs can be missed by the recount but is never counted twice.
+    after_marker = (
+        select(Message.id)
+        .where(
+            Message.conversation_id == conversation_id,
+            Message.sender_id != user_id,
+            tuple_(Message.created_at, Message.id) > tuple_(read_at, read_id),
+        )
+        .limit(settings.initial_sync_unread_cap)
+        .subquery()
+    )
+    await db.execute(
+        update(ConversationParticipant)
+        .where(
+            ConversationParticipant.conversation_id == conversation_id,
+            ConversationParticipant.user_id == user_id,
+            or_(
+                ConversationParticipant.last_read_at.is_(None),
+                tuple_(ConversationParticipant.last_read_at, ConversationParticipant.last_read_id) < tuple_(read_at, read_id),
+            ),
+        )
+        .values(
+            last_read_at=read_at,
+            last_read_id=read_id,
+            unread_count=select(func.count()).select_from(after_marker).scalar_subquery(),
+        )
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
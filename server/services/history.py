@@ -0,0 +1,184 @@
+import base64
+import binascii
+import gzip
+import uuid
+from datetime import datetime
+
+import orjson
+from sqlalchemy import select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import InstrumentedAttribute
+
+from server.models.message import Message
+from server.models.message_archive import MessageArchive
+from server.models.message_archive_target import MessageArchiveTarget
+from server.models.user import User
+from server.services import storage
+from server.services.cache import MISSING, TTLCache
+from server.services.message_maintenance import month_bounds
+
+# Archived months change at most once per maintenance run; decoded archive
+# objects are kept briefly so paging through one month downloads it once
+_archived_months = TTLCache(max_entries=1, ttl=60.0)
+_archived_targets = TTLCache(max_entries=10_000, ttl=60.0)
+_archive_objects = TTLCache(max_entries=256, ttl=300.0)
+
+
+def encode_cursor(created_at: datetime, message_id: uuid.UUID) -> str:
+    raw = f"{created_at.isoformat()}|{message_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, uuid.UUID]:
+    # Raises ValueError on anything that is not a cursor we issued
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+    except (binascii.Error, UnicodeDecodeError) as e:
+        raise ValueError("Invalid cursor") from e
+    created_at, sep, message_id = raw.partition("|")
+    if not sep:
+        raise ValueError("Invalid cursor")
+    created_at = datetime.fromisoformat(created_at)
+    # Issued cursors always carry an offset; a naive one could not be compared
+    # with stored timestamps
+    if created_at.utcoffset() is None:
+        raise ValueError("Invalid cursor")
+    return created_at, uuid.UUID(message_id)
+
+
+async def fetch_history(
+    db: AsyncSession,
+    column: InstrumentedAttribute,
+    target_id: uuid.UUID,
+    before: str | None = None,
+    after: str | None = None,
+    limit: int = 50,
+    not_before: datetime | None = None,
+) -> list[tuple[Message, str]]:
+    # Keyset pagination over (created_at, id) so ties on created_at can neither
+    # skip nor repeat rows. `column` is Message.channel_id or
+    # Message.conversation_id; each has a (column, created_at, id) index, so the
+    # range scan reads exactly `limit` rows in index order without a sort.
+    # Pages that run past the partitions still in Postgres continue into the
+    # archived months in object storage. Messages older than `not_before`
+    # (retention) are never returned. Returns (message, sender username) oldest first.
+    kind = column.key.removesuffix("_id")
+    query = select(Message, User.username).join(User, User.id == Message.sender_id).where(column == target_id)
+    if not_before is not None:
+        query = query.where(Message.created_at >= not_before)
+    key = tuple_(Message.created_at, Message.id)
+    if after:
+        cursor = decode_cursor(after)
+        cold = await _read_archives(db, kind, target_id, limit, not_before, after=cursor)
+        if len(cold) >= limit:
+            return cold[:limit]
+        if cold:
+            cursor = cold[-1][0].created_at, cold[-1][0].id
+        query = query.where(key > tuple_(*cursor))
+        query = query.order_by(Message.created_at.asc(), Message.id.asc()).limit(limit - len(cold))
+        result = await db.execute(query)
+        return cold + list(result.all())
+
+    cursor = decode_cursor(before) if before else None
+    if cursor:
+        query = query.where(key < tuple_(*cursor))
+    query = query.order_by(Message.created_at.desc(), Message.id.desc()).limit(limit)
+    result = await db.execute(query)
+    rows = list(reversed(result.all()))
+    if len(rows) < limit:
+        boundary = (rows[0][0].created_at, rows[0][0].id) if rows else cursor
+        rows = await _read_archives(db, kind, target_id, limit - len(rows), not_before, before=boundary) + rows
+    return rows
+
+
+async def _read_archives(
+    db: AsyncSession,
+    kind: str,
+    target_id: uuid.UUID,
+    limit: int,
+    not_before: datetime | None,
+    before: tuple[datetime, uuid.UUID] | None = None,
+    after: tuple[datetime, uuid.UUID] | None = None,
+) -> list[tuple[Message, str]]:
+    # Walks archived months away from the cursor until `limit` rows are found.
+    # Indexed months are read only when they hold the target within the
+    # requested range; months archived before the index are probed.
+    months = _archived_months.get("months")
+    if months is MISSING:
+        result = await db.execute(
+            select(MessageArchive.month, MessageArchive.prefix, MessageArchive.targets_indexed).order_by(
+                MessageArchive.month
+            )
+        )
+        months = list(result.all())
+        _archived_months.set("months", months)
+    if not months:
+        return []
+    ranges = _archived_targets.get((kind, target_id))
+    if ranges is MISSING:
+        result = await db.execute(
+            select(MessageArchiveTarget.month, MessageArchiveTarget.first_at, MessageArchiveTarget.last_at).where(
+                MessageArchiveTarget.kind == kind, MessageArchiveTarget.target_id == target_id
+            )
+        )
+        ranges = {month: (first_at, last_at) for month, first_at, last_at in result.all()}
+        _archived_targets.set((kind, target_id), ranges)
+
+    candidates = []
+    for month, prefix, indexed in reversed(months) if after is None else months:
+        if indexed:
+            if month not in ranges:
+                continue
+            first, last = ranges[month]
+        else:
+            first, last = month_bounds(month)
+        if before is not None and first > before[0] or after is not None and last < after[0]:
+            continue
+        if not_before is not None and last < not_before:
+            continue
+        candidates.append((month, prefix))
+    found = []
+    for month, prefix in candidates:
+        for entry in await _load_archive(f"{prefix}/{kind}/{target_id}.ndjson.gz"):
+            entry_key = entry.created_at, entry.id
+            if before is not None and entry_key >= before or after is not None and entry_key <= after:
+                continue
+            if not_before is not None and entry.created_at < not_before:
+                continue
+            found.append(entry)
+        if len(found) >= limit:
+            break
+
+    found.sort(key=lambda m: (m.created_at, m.id))
+    found = found[:limit] if after is not None else found[-limit:]
+    if not found:
+        return []
+    result = await db.execute(select(User.id, User.username).where(User.id.in_({m.sender_id for m in found})))
+    usernames = dict(result.all())
+    return [(m, usernames.get(m.sender_id, "")) for m in found]
+
+
+async def _load_archive(name: str) -> list[Message]:
+    # One target's messages for one month, oldest first; detached Message objects
+    cached = _archive_objects.get(name)
+    if cached is not MISSING:
+        return cached
+    data = await storage.get_bytes(name)
+    messages = []
+    if data is not None:
+        for line in gzip.decompress(data).splitlines():
+            row = orjson.loads(line)
+            messages.append(
+                Message(
+                    id=uuid.UUID(row["id"]),
+                    channel_id=uuid.UUID(row["channel_id"]) if row["channel_id"] else None,
+                    conversation_id=uuid.UUID(row["conversation_id"]) if row["conversation_id"] else None,
+                    sender_id=uuid.UUID(row["sender_id"]),
+                    ciphertext=row["ciphertext"],
+                    nonce=row["nonce"],
+                    sender_device_id=row["sender_device_id"],
+                    created_at=datetime.fromisoformat(row["created_at"]),
+                )
+            )
+    _archive_objects.set(name, messages)
+    return messages
@@ -0,0 +1,126 @@
+import hashlib
+import uuid
+
+import orjson
+from sqlalchemy import func, literal, select, true, tuple_
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from server.config import settings
+from server.models.channel import Channel
+from server.models.channel_read import ChannelRead
+from server.models.message import Message
+from server.models.server import Server
+from server.models.server_member import ServerMember
+from server.models.user import User
+from server.services.history import encode_cursor
+
+# Compared against read markers for channels the user has never read
+NEVER_READ = (literal("-infinity").cast(Message.created_at.type), literal(uuid.UUID(int=0), UUID(as_uuid=True)))
+
+
+def digest(data: bytes) -> str:
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+async def load_servers(db: AsyncSession, user_id: uuid.UUID, members: bool) -> list[dict]:
+    # The user's servers with their role, channels and (optionally) member
+    # lists, in three queries however many servers there are
+    result = await db.execute(
+        select(Server, ServerMember.role)
+        .join(ServerMember, ServerMember.server_id == Server.id)
+        .where(ServerMember.user_id == user_id)
+        .order_by(Server.id)
+    )
+    servers = {
+        server.id: {
+            "id": str(server.id),
+            "name": server.name,
+            "owner_id": str(server.owner_id),
+            "invite_code": server.invite_code,
+            "icon_url": server.icon_url,
+            "role": role.value,
+            "channels": [],
+        }
+        for server, role in result.all()
+    }
+    if not servers:
+        return []
+
+    result = await db.execute(
+        select(Channel).where(Channel.server_id.in_(servers)).order_by(Channel.server_id, Channel.id)
+    )
+    for channel in result.scalars().all():
+        servers[channel.server_id]["channels"].append(
+            {"id": str(channel.id), "name": channel.name, "type": channel.type.value}
+        )
+
+    if members:
+        for server in servers.values():
+            server["members"] = []
+        result = await db.execute(
+            select(ServerMember.server_id, ServerMember.user_id, ServerMember.role, User.username)
+            .join(User, User.id == ServerMember.user_id)
+            .where(ServerMember.server_id.in_(servers))
+            .order_by(ServerMember.server_id, ServerMember.user_id)
+        )
+        for server_id, member_id, role, username in result.all():
+            servers[server_id]["members"].append(
+                {"user_id": str(member_id), "username": username, "role": role.value}
+            )
+    return list(servers.values())
+
+
+async def load_unread(db: AsyncSession, user_id: uuid.UUID) -> dict[str, dict]:
+    # Per channel of every server the user is in: the newest message and how
+    # many messages from others follow the user's read marker, capped so a
+    # busy channel costs a bounded index walk. One query.
+    cap = settings.initial_sync_unread_cap
+    read_at = func.coalesce(ChannelRead.last_read_at, NEVER_READ[0])
+    read_id = func.coalesce(ChannelRead.last_read_id, NEVER_READ[1])
+    last = (
+        select(Message.id, Message.created_at)
+        .where(Message.channel_id == Channel.id)
+        .order_by(Message.created_at.desc(), Message.id.desc())
+        .limit(1)
+        .lateral("last")
+    )
+    unread = (
+        select(Message.id)
+        .where(
+            Message.channel_id == Channel.id,
+            tuple_(Message.created_at, Message.id) > tuple_(read_at, read_id),
+            Message.sender_id != user_id,
+        )
+        .limit(cap)
+        .lateral("unread")
+    )
+    result = await db.execute(
+        select(Channel.id, last.c.id, last.c.created_at, func.count(unread.c.id))
+        .join(ServerMember, ServerMember.server_id == Channel.server_id)
+        .outerjoin(ChannelRead, (ChannelRead.channel_id == Channel.id) & (ChannelRead.user_id == user_id))
+        .outerjoin(last, true())
+        .outerjoin(unread, true())
+        .where(ServerMember.user_id == user_id)
+        .group_by(Channel.id, last.c.id, last.c.created_at)
+    )
+    return {
+        str(channel_id): {
+            "count": count,
+            "last_message_id": str(message_id) if message_id else None,
+            "last_cursor": encode_cursor(created_at, message_id) if message_id else None,
+        }
+        for channel_id, message_id, created_at, count in result.all()
+    }
+
+
+async def build(db: AsyncSession, user_id: uuid.UUID, members: bool, known_version: str | None) -> bytes:
+    # Servers, channels and members change rarely and are versioned by their
+    # own hash: a client presenting the current version gets "servers": null
+    # and keeps what it has. Unread state is always sent.
+    servers = orjson.dumps(await load_servers(db, user_id, members))
+    version = digest(servers)
+    unread = orjson.dumps(await load_unread(db, user_id))
+    if known_version == version:
+        servers = b"null"
+    return b'{"version":' + orjson.dumps(version) + b',"servers":' + servers + b',"unread":' + unread + b"}"
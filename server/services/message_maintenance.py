@@ -0,0 +1,294 @@
+import asyncio
+import gzip
+import logging
+import uuid
+from datetime import date, datetime, timedelta, timezone
+
+import orjson
+from sqlalchemy import delete, insert, select, text, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from server.config import settings
+from server.database import advisory_lock, async_session
+from server.models.channel import Channel
+from server.models.envelope import MessageEnvelope
+from server.models.message import Message
+from server.models.message_archive import MessageArchive
+from server.models.message_archive_target import MessageArchiveTarget
+from server.models.server import Server
+from server.services import storage
+from server.services.cache import MISSING, TTLCache
+
+logger = logging.getLogger(__name__)
+
+# pg advisory lock key so only one worker runs maintenance at a time
+MAINTENANCE_LOCK = 0x57484953
+RETENTION_BATCH = 10_000
+
+_retention = TTLCache(max_entries=10_000, ttl=60.0)
+
+
+def add_months(month: date, n: int) -> date:
+    index = month.year * 12 + month.month - 1 + n
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def month_bounds(month: date) -> tuple[datetime, datetime]:
+    start = datetime(month.year, month.month, 1, tzinfo=timezone.utc)
+    end_month = add_months(month, 1)
+    return start, datetime(end_month.year, end_month.month, 1, tzinfo=timezone.utc)
+
+
+def partition_name(month: date) -> str:
+    return f"messages_y{month.year}m{month.month:02d}"
+
+
+def archive_prefix(month: date) -> str:
+    return f"archive/messages/{month:%Y-%m}"
+
+
+def current_month() -> date:
+    return datetime.now(timezone.utc).date().replace(day=1)
+
+
+async def ensure_partitions(db: AsyncSession, months_ahead: int, start: date | None = None):
+    # Idempotent; creates monthly partitions from `start` through `months_ahead` past now
+    month = start or current_month()
+    last = add_months(current_month(), months_ahead)
+    while month <= last:
+        lower, upper = month_bounds(month)
+        await db.execute(
+            text(
+                f"CREATE TABLE IF NOT EXISTS {partition_name(month)} PARTITION OF messages "
+                f"FOR VALUES FROM ('{lower.isoformat()}') TO ('{upper.isoformat()}')"
+            )
+        )
+        month = add_months(month, 1)
+    await db.commit()
+
+
+async def list_partitions(db: AsyncSession) -> list[date]:
+    result = await db.execute(
+        text(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent "
+            "WHERE p.relname = 'messages'"
+        )
+    )
+    months = []
+    for (name,) in result.all():
+        if name.startswith("messages_y") and len(name) == len("messages_y0000m00"):
+            months.append(date(int(name[10:14]), int(name[15:17]), 1))
+    return sorted(months)
+
+
+async def apply_retention(db: AsyncSession) -> int:
+    result = await db.execute(
+        select(Server.id, Server.message_retention_days).where(Server.message_retention_days.is_not(None))
+    )
+    deleted = 0
+    for server_id, days in result.all():
+        cutoff = datetime.now(timezone.utc) - timedelta(days=days)
+        # Small batches keep each transaction and its row locks short
+        while True:
+            expired = (
+                select(Message.id, Message.created_at)
+                .join(Channel, Channel.id == Message.channel_id)
+                .where(Channel.server_id == server_id, Message.created_at < cutoff)
+                .limit(RETENTION_BATCH)
+            )
+            batch = await db.execute(delete(Message).where(tuple_(Message.id, Message.created_at).in_(expired)))
+            await db.commit()
+            deleted += batch.rowcount
+            if batch.rowcount < RETENTION_BATCH:
+                break
+    return deleted
+
+
+async def expire_envelopes(db: AsyncSession, days: int) -> int:
+    # Envelopes for devices that never came back to acknowledge them
+    cutoff = datetime.now(timezone.utc) - timedelta(days=days)
+    deleted = 0
+    while True:
+        expired = (
+            select(
+                MessageEnvelope.recipient_id,
+                MessageEnvelope.device_id,
+                MessageEnvelope.created_at,
+                MessageEnvelope.message_id,
+            )
+            .where(MessageEnvelope.created_at < cutoff)
+            .limit(RETENTION_BATCH)
+        )
+        batch = await db.execute(
+            delete(MessageEnvelope).where(
+                tuple_(
+                    MessageEnvelope.recipient_id,
+                    MessageEnvelope.device_id,
+                    MessageEnvelope.created_at,
+                    MessageEnvelope.message_id,
+                ).in_(expired)
+            )
+        )
+        await db.commit()
+        deleted += batch.rowcount
+        if batch.rowcount < RETENTION_BATCH:
+            return deleted
+
+
+async def archive_partition(db: AsyncSession, month: date) -> int:
+    # Export one monthly partition to object storage as gzipped NDJSON, one
+    # object per channel / conversation, then record it and drop the partition.
+    # Each object gets a message_archive_targets row with its row count and
+    # time range, so history reads skip months that lack the target.
+    # Safe to re-run: objects are overwritten and the records are replaced.
+    prefix = archive_prefix(month)
+    rows = await db.stream(
+        text(
+            f"SELECT id, channel_id, conversation_id, sender_id, ciphertext, nonce, sender_device_id, created_at "
+            f"FROM {partition_name(month)} ORDER BY channel_id, conversation_id, created_at, id"
+        )
+    )
+    count = 0
+    target, lines, first_at = None, [], None
+    targets = []
+
+    async def flush():
+        if target is not None and target[1] is not None and lines:
+            body = gzip.compress(b"\n".join(lines) + b"\n")
+            await storage.put_bytes(f"{prefix}/{target[0]}/{target[1]}.ndjson.gz", body, "application/x-ndjson")
+            targets.append(
+                {
+                    "kind": target[0],
+                    "target_id": target[1],
+                    "month": month,
+                    "row_count": len(lines),
+                    "first_at": first_at,
+                    "last_at": last_at,
+                }
+            )
+
+    async for row in rows:
+        key = ("channel", row.channel_id) if row.channel_id else ("conversation", row.conversation_id)
+        if key != target:
+            await flush()
+            target, lines, first_at = key, [], row.created_at
+        last_at = row.created_at
+        lines.append(
+            orjson.dumps(
+                {
+                    "id": str(row.id),
+                    "channel_id": str(row.channel_id) if row.channel_id else None,
+                    "conversation_id": str(row.conversation_id) if row.conversation_id else None,
+                    "sender_id": str(row.sender_id),
+                    "ciphertext": row.ciphertext,
+                    "nonce": row.nonce,
+                    "sender_device_id": row.sender_device_id,
+                    "created_at": row.created_at.isoformat(),
+                }
+            )
+        )
+        count += 1
+    await flush()
+
+    existing = await db.execute(select(MessageArchive).where(MessageArchive.month == month))
+    archive = existing.scalar_one_or_none()
+    if archive is None:
+        db.add(MessageArchive(month=month, prefix=prefix, row_count=count, targets_indexed=True))
+    else:
+        archive.row_count = count
+        archive.targets_indexed = True
+    await db.execute(delete(MessageArchiveTarget).where(MessageArchiveTarget.month == month))
+    if targets:
+        await db.execute(insert(MessageArchiveTarget), targets)
+    await db.execute(text(f"ALTER TABLE messages DETACH PARTITION {partition_name(month)}"))
+    await db.execute(text(f"DROP TABLE {partition_name(month)}"))
+    await db.commit()
+    return count
+
+
+async def retention_cutoff(server_id: uuid.UUID, db: AsyncSession) -> datetime | None:
+    # Used on reads so expired messages stay hidden between retention runs and
+    # inside archives, which are shared by every server
+    days = _retention.get(server_id)
+    if days is MISSING:
+        result = await db.execute(select(Server.message_retention_days).where(Server.id == server_id))
+        days = result.scalar_one_or_none()
+        _retention.set(server_id, days)
+    if days is None:
+        return None
+    return datetime.now(timezone.utc) - timedelta(days=days)
+
+
+def invalidate_retention(server_id: uuid.UUID):
+    _retention.pop(server_id)
+
+
+# Periodic job: keep partitions created ahead of time, apply per-server
+# retention, and archive partitions older than `archive_after_months`
+# (0 disables archival). Every worker runs the loop; a Postgres advisory lock
+# makes sure only one of them does the work at a time.
+class MessageMaintenance:
+    def __init__(self, interval: float, months_ahead: int, archive_after_months: int, envelope_ttl_days: int):
+        self.interval = interval
+        self.months_ahead = months_ahead
+        self.archive_after_months = archive_after_months
+        self.envelope_ttl_days = envelope_ttl_days
+        self.last_run: datetime | None = None
+        self._task: asyncio.Task | None = None
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "last_run": self.last_run.isoformat() if self.last_run else None,
+            "archive_after_months": self.archive_after_months,
+        }
+
+    async def run_once(self):
+        async with advisory_lock(MAINTENANCE_LOCK) as locked:
+            if not locked:
+                return
+            async with async_session() as db:
+                await ensure_partitions(db, self.months_ahead)
+                deleted = await apply_retention(db)
+                if deleted:
+                    logger.info("Retention removed %d messages", deleted)
+                expired = await expire_envelopes(db, self.envelope_ttl_days)
+                if expired:
+                    logger.info("Expired %d unacknowledged envelopes", expired)
+                if self.archive_after_months > 0:
+                    cutoff = add_months(current_month(), -self.archive_after_months)
+                    for month in await list_partitions(db):
+                        if month < cutoff:
+                            count = await archive_partition(db, month)
+                            logger.info("Archived %d messages from %s", count, partition_name(month))
+            self.last_run = datetime.now(timezone.utc)
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Message maintenance failed")
+            await asyncio.sleep(self.interval)
+
+
+message_maintenance = MessageMaintenance(
+    settings.message_maintenance_interval_seconds,
+    settings.message_partition_months_ahead,
+    settings.message_archive_after_months,
+    settings.envelope_ttl_days,
+)
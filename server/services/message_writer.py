@@ -0,0 +1,271 @@
+import asyncio
+import logging
+import time
+
+import orjson
+from sqlalchemy import DateTime, Integer, bindparam, insert
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.exc import DataError, DBAPIError, IntegrityError, StatementError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from server.config import settings
+from server.database import async_session
+from server.models.envelope import MessageEnvelope
+from server.models.message import Message
+from server.services.conversations import summary_updates
+
+logger = logging.getLogger(__name__)
+# Messages that could not be written, one JSON line each; route this logger to
+# durable storage in production
+dead_letter = logging.getLogger("whisper.dead_letter")
+
+WRITE_MODES = ("sync", "batched")
+
+# Persists chat messages for the WebSocket send path.
+#
+# sync    - the row is committed before the message is broadcast (commit-before-ack).
+# batched - the message is broadcast immediately and buffered in memory; a
+#           background task writes the buffer with multi-row INSERTs every
+#           `batch_size` messages or `interval` seconds, whichever comes first.
+#
+# Durability in batched mode: a message is durable once its batch commits, at most
+# `interval` after it was broadcast (longer while Postgres is unavailable, as failed
+# batches are retried). A graceful shutdown drains the buffer in lifespan; a crash or
+# SIGKILL loses whatever was still buffered. History reads may lag broadcasts by up
+# to one interval. When the buffer reaches `max_buffer`, senders wait for a flush.
+#
+# A batch that fails on its contents (a constraint or data error) is bisected so
+# every other message still commits; only a single message that fails on its
+# own data goes to the whisper.dead_letter log. Any other error (connection
+# reset, serialization failure, outage), including one hit while bisecting,
+# leaves the unsettled messages at the head of the buffer to be retried; after
+# `max_retries` failed attempts they are dead-lettered, so an outage cannot
+# block senders forever.
+class MessageWriter:
+    def __init__(self, mode: str, batch_size: int, interval: float, max_buffer: int, max_retries: int):
+        if mode not in WRITE_MODES:
+            raise ValueError(f"Unknown message write mode: {mode}")
+        self.mode = mode
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_buffer = max_buffer
+        self.max_retries = max_retries
+        self.flushed = 0
+        self.failed_flushes = 0
+        self.dead_lettered = 0
+        # Consecutive failed attempts at the batch at the head of the buffer
+        self._head_failures = 0
+        self.last_flush_ms = 0.0
+        # (message values, its envelopes)
+        self._buffer: list[tuple[dict, list[dict]]] = []
+        self._wake = asyncio.Event()
+        self._space = asyncio.Event()
+        self._stopping = False
+        self._task: asyncio.Task | None = None
+
+    async def start(self):
+        if self.mode == "batched":
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wake.set()
+        await self._task
+        self._task = None
+        if self._buffer:
+            logger.error("Shut down with %d unwritten messages", len(self._buffer))
+
+    async def write(self, db: AsyncSession, values: dict, envelopes: list[dict] | None = None):
+        if self.mode == "sync":
+            stmt = insert(Message).values(**values)
+            if envelopes:
+                # The message rides along as a data-modifying CTE, so the row and
+                # all its envelopes are still one atomic statement
+                stmt = insert(MessageEnvelope).values(envelopes).add_cte(stmt.cte("message"))
+            if values.get("conversation_id") is not None:
+                # So do the DM summary updates
+                updates = summary_updates(
+                    values["conversation_id"], values["sender_id"], 1, values["created_at"], values["id"]
+                )
+                stmt = stmt.add_cte(*(update.cte(f"summary_{i}") for i, update in enumerate(updates)))
+            if db.in_transaction():
+                # Earlier reads on this session (authz, envelope recipients)
+                # already began a transaction, and the isolation level of its
+                # connection can no longer change; commit it with the INSERT
+                await db.execute(stmt)
+                await db.commit()
+            else:
+                # Autocommit: a single round trip, no BEGIN / COMMIT around the INSERT
+                connection = await db.connection(execution_options={"isolation_level": "AUTOCOMMIT"})
+                await connection.execute(stmt)
+            return
+
+        while len(self._buffer) >= self.max_buffer:
+            self._space.clear()
+            self._wake.set()
+            await self._space.wait()
+        self._buffer.append((values, envelopes or []))
+        if len(self._buffer) >= self.batch_size:
+            self._wake.set()
+
+    def stats(self) -> dict:
+        return {
+            "mode": self.mode,
+            "buffered": len(self._buffer),
+            "flushed": self.flushed,
+            "failed_flushes": self.failed_flushes,
+            "dead_lettered": self.dead_lettered,
+            "last_flush_ms": round(self.last_flush_ms, 2),
+        }
+
+    async def _run(self):
+        retries = 0
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            if await self._flush():
+                retries = 0
+            else:
+                retries += 1
+                if self._stopping and retries >= 5:
+                    return
+                await asyncio.sleep(min(0.1 * 2**retries, 5.0))
+            if self._stopping and not self._buffer:
+                return
+
+    async def _flush(self) -> bool:
+        while self._buffer:
+            batch = self._buffer[: self.batch_size]
+            started = time.perf_counter()
+            dead_lettered = self.dead_lettered
+            try:
+                await self._write(batch)
+                settled = len(batch)
+            except Exception as e:
+                self.failed_flushes += 1
+                settled = await self._settle(batch, e)
+                if settled < len(batch):
+                    self._head_failures += 1
+                    if self._head_failures < self.max_retries:
+                        logger.exception("Failed to write %d buffered messages, will retry", len(batch) - settled)
+                        self._drop(settled, dead_lettered)
+                        return False
+                    # Failing for max_retries attempts; stop blocking every
+                    # sender on these messages
+                    logger.error(
+                        "Giving up on %d buffered messages after %d attempts", len(batch) - settled, self._head_failures
+                    )
+                    self._dead_letter(batch[settled:], e)
+                    settled = len(batch)
+            self._head_failures = 0
+            self._drop(settled, dead_lettered)
+            self.last_flush_ms = (time.perf_counter() - started) * 1000
+        return True
+
+    def _drop(self, settled: int, dead_lettered: int):
+        # Only drop rows once they are committed or dead-lettered
+        del self._buffer[:settled]
+        self.flushed += settled - (self.dead_lettered - dead_lettered)
+        if settled:
+            self._space.set()
+
+    async def _write(self, batch: list[tuple[dict, list[dict]]]):
+        async with async_session() as db:
+            await db.execute(insert(Message), [values for values, _ in batch])
+            envelopes = [envelope for _, envelopes in batch for envelope in envelopes]
+            if envelopes:
+                await db.execute(insert(MessageEnvelope), envelopes)
+            summaries = conversation_summaries([values for values, _ in batch])
+            if summaries:
+                connection = await db.connection()
+                for update in SUMMARY_UPDATES:
+                    await connection.execute(update, summaries)
+            await db.commit()
+
+    async def _settle(self, batch: list[tuple[dict, list[dict]]], error: Exception) -> int:
+        # `batch` failed with `error`. Bisects it while the failures are about
+        # the rows: halves that commit are kept, a single message that fails on
+        # its data is dead-lettered. Returns how many leading messages are
+        # committed or dead-lettered; stops at the first other error.
+        if not poison(error):
+            return 0
+        if len(batch) == 1:
+            self._dead_letter(batch, error)
+            return 1
+        settled = 0
+        for half in (batch[: len(batch) // 2], batch[len(batch) // 2:]):
+            try:
+                await self._write(half)
+                done = len(half)
+            except Exception as e:
+                done = await self._settle(half, e)
+            settled += done
+            if done < len(half):
+                break
+        return settled
+
+    def _dead_letter(self, batch: list[tuple[dict, list[dict]]], error: Exception):
+        # One JSON line per message on the whisper.dead_letter logger, with
+        # everything needed to replay it
+        self.dead_lettered += len(batch)
+        for values, envelopes in batch:
+            dead_letter.error(
+                orjson.dumps({"error": repr(error), "message": values, "envelopes": envelopes}).decode()
+            )
+
+
+def poison(error: Exception) -> bool:
+    # Errors caused by the rows being written: constraint and data errors from
+    # Postgres, and values that could not even be bound. Anything else says
+    # nothing about the rows and is retried.
+    if isinstance(error, (IntegrityError, DataError)):
+        return True
+    return isinstance(error, StatementError) and not isinstance(error, DBAPIError)
+
+
+# The send-path summary updates with one parameter set per (conversation,
+# sender) in a batch; see services/conversations.py
+SUMMARY_UPDATES = summary_updates(
+    bindparam("p_conversation_id", type_=UUID(as_uuid=True)),
+    bindparam("p_sender_id", type_=UUID(as_uuid=True)),
+    bindparam("p_count", type_=Integer),
+    bindparam("p_last_at", type_=DateTime(timezone=True)),
+    bindparam("p_last_id", type_=UUID(as_uuid=True)),
+)
+
+
+def conversation_summaries(messages: list[dict]) -> list[dict]:
+    summaries: dict[tuple, dict] = {}
+    for values in messages:
+        if values.get("conversation_id") is None:
+            continue
+        key = (values["conversation_id"], values["sender_id"])
+        summary = summaries.get(key)
+        if summary is None:
+            summaries[key] = {
+                "p_conversation_id": key[0],
+                "p_sender_id": key[1],
+                "p_count": 1,
+                "p_last_at": values["created_at"],
+                "p_last_id": values["id"],
+            }
+            continue
+        summary["p_count"] += 1
+        if (values["created_at"], values["id"]) > (summary["p_last_at"], summary["p_last_id"]):
+            summary["p_last_at"], summary["p_last_id"] = values["created_at"], values["id"]
+    return list(summaries.values())
+
+
+message_writer = MessageWriter(
+    settings.message_write_mode,
+    settings.message_batch_size,
+    settings.message_batch_interval_ms / 1000,
+    settings.message_buffer_max,
+    settings.message_flush_max_retries,
+)
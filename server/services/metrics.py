@@ -0,0 +1,167 @@
+import asyncio
+import bisect
+import logging
+import time
+from typing import Callable
+
+from server.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in seconds for latency histograms
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+# Upper bounds in seconds for the pool checkout wait histogram
+CHECKOUT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+# Upper bounds for broadcast recipient counts
+FANOUT_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+# Minimal Prometheus metrics, rendered in the text exposition format by
+# GET /metrics. Each histogram has at most one label so recording stays a dict
+# lookup, a bisect and two adds; label values must come from a small fixed set.
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: tuple = LATENCY_BUCKETS, label: str | None = None):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.buckets = buckets
+        # label value -> [per-bucket counts (last is +Inf), sum]
+        self._values: dict[str | None, list] = {}
+        REGISTRY.append(self)
+
+    def observe(self, value: float, label_value: str | None = None):
+        entry = self._values.get(label_value)
+        if entry is None:
+            entry = self._values[label_value] = [[0] * (len(self.buckets) + 1), 0.0]
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+    def render(self) -> list[str]:
+        lines = []
+        for value, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(self.label, value, le=bound)} {cumulative}")
+            cumulative += counts[-1]
+            lines.append(f"{self.name}_bucket{_labels(self.label, value, le='+Inf')} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label, value)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.label, value)} {cumulative}")
+        return lines
+
+
+# Exposes a component's stats() dict (the same one /stats shows) as untyped
+# samples named whisper_<prefix>_<key>, read only when /metrics is scraped
+class StatsCollector:
+    kind = "untyped"
+
+    def __init__(self, prefix: str, stats: Callable[[], dict]):
+        self.prefix = prefix
+        self.stats = stats
+        REGISTRY.append(self)
+
+    def render(self) -> list[str]:
+        lines = []
+        for key, value in _flatten(self.stats()):
+            name = f"whisper_{self.prefix}_{key}"
+            lines.append(f"# TYPE {name} untyped")
+            lines.append(f"{name} {value}")
+        return lines
+
+
+REGISTRY: list = []
+
+
+def _labels(label: str | None, value: str | None, **extra) -> str:
+    pairs = [(label, value)] if label is not None else []
+    pairs += extra.items()
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+
+def _flatten(stats: dict, prefix: str = ""):
+    for key, value in stats.items():
+        if isinstance(value, dict):
+            yield from _flatten(value, f"{prefix}{key}_")
+        elif isinstance(value, (bool, int, float)):
+            yield f"{prefix}{key}", int(value) if isinstance(value, bool) else value
+
+
+def render() -> str:
+    lines = []
+    for metric in REGISTRY:
+        try:
+            samples = metric.render()
+        except Exception:
+            logger.exception("Failed to render metric %s", getattr(metric, "name", metric))
+            continue
+        if isinstance(metric, StatsCollector):
+            lines += samples
+            continue
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines += samples
+    return "\n".join(lines) + "\n"
+
+
+ws_frame_seconds = Histogram(
+    "whisper_ws_frame_seconds", "Time to handle one inbound WebSocket frame", label="type"
+)
+ws_fanout_recipients = Histogram(
+    "whisper_ws_fanout_recipients", "Local sockets an event was delivered to", FANOUT_BUCKETS, label="topic"
+)
+ws_fanout_seconds = Histogram(
+    "whisper_ws_fanout_seconds", "Time to encode and enqueue an event for local sockets", label="topic"
+)
+db_query_seconds = Histogram(
+    "whisper_db_query_seconds", "Database statement execution time", label="statement"
+)
+db_checkout_seconds = Histogram(
+    "whisper_db_pool_checkout_seconds",
+    "Wait for a pooled database connection",
+    CHECKOUT_BUCKETS,
+)
+password_hash_seconds = Histogram(
+    "whisper_password_hash_seconds", "Argon2 hash or verify time, including pool queueing", label="op"
+)
+event_loop_lag_seconds = Histogram(
+    "whisper_event_loop_lag_seconds", "How late the event loop ran a timer"
+)
+
+
+# Measures event-loop lag: a timer due every `interval` records how late it
+# actually ran. Any handler that blocks the loop shows up here.
+class LoopMonitor:
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.max_lag = 0.0
+        self._task: asyncio.Task | None = None
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        return {"max_lag_ms": round(self.max_lag * 1000, 3)}
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - started - self.interval)
+            self.max_lag = max(self.max_lag, lag)
+            event_loop_lag_seconds.observe(lag)
+
+
+loop_monitor = LoopMonitor(settings.metrics_loop_interval_seconds)
@@ -0,0 +1,70 @@
+import uuid
+
+from sqlalchemy import delete, func, insert, select, true, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from server.config import settings
+from server.models.prekey import OneTimePrekey
+from server.models.user import User
+from server.ws.manager import manager
+
+
+async def upload(db: AsyncSession, user_id: uuid.UUID, public_keys: list[str]) -> tuple[list[int], int]:
+    # One multi-row INSERT. Returns the key_id assigned to each key, in upload
+    # order, so the owner can match claims to private keys, and how many keys
+    # the user now has.
+    key_ids = []
+    if public_keys:
+        result = await db.execute(
+            insert(OneTimePrekey).returning(OneTimePrekey.key_id, sort_by_parameter_order=True),
+            [{"user_id": user_id, "public_key": key} for key in public_keys],
+        )
+        key_ids = list(result.scalars().all())
+    remaining = await count(db, user_id)
+    await db.commit()
+    return key_ids, remaining
+
+
+async def count(db: AsyncSession, user_id: uuid.UUID) -> int:
+    result = await db.execute(select(func.count()).where(OneTimePrekey.user_id == user_id))
+    return result.scalar_one()
+
+
+async def claim(db: AsyncSession, user_ids: list[uuid.UUID]) -> dict[uuid.UUID, tuple[int, str]]:
+    # Atomically removes the oldest prekey of each user in one statement. SKIP
+    # LOCKED lets concurrent claims for the same user take different keys
+    # instead of queueing on (or both reading) the same row.
+    requested = select(User.id).where(User.id.in_(user_ids)).subquery()
+    oldest = (
+        select(OneTimePrekey.user_id, OneTimePrekey.key_id)
+        .where(OneTimePrekey.user_id == requested.c.id)
+        .order_by(OneTimePrekey.key_id)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+        .lateral()
+    )
+    picked = select(oldest.c.user_id, oldest.c.key_id).select_from(requested.join(oldest, true()))
+    result = await db.execute(
+        delete(OneTimePrekey)
+        .where(tuple_(OneTimePrekey.user_id, OneTimePrekey.key_id).in_(picked))
+        .returning(OneTimePrekey.user_id, OneTimePrekey.key_id, OneTimePrekey.public_key)
+    )
+    return {user_id: (key_id, public_key) for user_id, key_id, public_key in result.all()}
+
+
+async def notify_low(db: AsyncSession, user_ids: list[uuid.UUID]):
+    # Pushes `prekeys_low` to owners whose supply dropped under the watermark
+    if not user_ids:
+        return
+    result = await db.execute(
+        select(OneTimePrekey.user_id, func.count())
+        .where(OneTimePrekey.user_id.in_(user_ids))
+        .group_by(OneTimePrekey.user_id)
+    )
+    remaining = dict(result.all())
+    for user_id in user_ids:
+        left = remaining.get(user_id, 0)
+        if left < settings.prekey_low_watermark:
+            await manager.send_personal(
+                user_id, {"type": "prekeys_low", "remaining": left}, coalesce_key="prekeys_low"
+            )
@@ -0,0 +1,167 @@
+import asyncio
+import hashlib
+import logging
+import time
+import uuid
+from dataclasses import dataclass
+
+from redis.exceptions import RedisError
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from server.config import settings
+from server.models.user import User
+from server.services.auth import decode_access_claims
+from server.services.cache import MISSING, TTLCache
+from server.ws.manager import manager
+
+logger = logging.getLogger(__name__)
+
+REVOCATION_CHANNEL = "whisper:auth:revoke"
+# Close code for sockets whose token was revoked; clients sign in again
+REVOKED_CLOSE_CODE = 4001
+
+
+class RevocationUnavailable(Exception):
+    pass
+
+
+def version_key(user_id: uuid.UUID) -> str:
+    return f"whisper:auth:tv:{user_id}"
+
+
+# The authenticated user as handlers see it: just the columns they need, not
+# the full row with its key material
+@dataclass(frozen=True, slots=True)
+class Principal:
+    id: uuid.UUID
+    username: str
+    token_version: int
+    expires_at: float
+
+
+# Caches verified tokens (keyed by a hash of the token) so authenticated REST
+# calls and WebSocket handshakes skip both the JWT check and the users query.
+#
+# Revocation is a per-user version counter in Redis. Tokens carry the version
+# current when they were issued ("tv"); bumping the counter (logout, password
+# change) invalidates every older token. Workers learn about bumps over pub/sub
+# and remember them for one cache TTL, after which any surviving principals
+# have expired and are re-validated against Redis. Every worker also closes the
+# user's open WebSockets, which were authenticated with a now revoked token.
+class PrincipalCache:
+    def __init__(self, max_entries: int, ttl: float):
+        self.principals = TTLCache(max_entries, ttl)
+        self.revoked = TTLCache(max_entries, ttl)
+        self._redis = None
+        self._pubsub = None
+        self._listener: asyncio.Task | None = None
+
+    async def start(self, redis):
+        self._redis = redis
+        self._pubsub = redis.pubsub(ignore_subscribe_messages=True)
+        await self._pubsub.subscribe(REVOCATION_CHANNEL)
+        self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+        if self._pubsub is not None:
+            await self._pubsub.aclose()
+            self._pubsub = None
+        self._redis = None
+
+    async def resolve(self, token: str, db: AsyncSession) -> Principal | None:
+        key = hashlib.sha256(token.encode()).digest()
+        principal = self.principals.get(key)
+        if principal is not MISSING:
+            if principal.expires_at > time.time() and principal.token_version >= self.revoked.get(principal.id, 0):
+                return principal
+            self.principals.pop(key)
+            return None
+
+        claims = decode_access_claims(token)
+        if claims is None or "sub" not in claims:
+            return None
+        user_id = uuid.UUID(claims["sub"])
+        token_version = claims.get("tv", 0)
+        if token_version < await self.token_version(user_id):
+            return None
+
+        result = await db.execute(select(User.username).where(User.id == user_id))
+        username = result.scalar_one_or_none()
+        if username is None:
+            return None
+        principal = Principal(user_id, username, token_version, float(claims["exp"]))
+        self.principals.set(key, principal)
+        return principal
+
+    async def token_version(self, user_id: uuid.UUID) -> int:
+        if self._redis is None:
+            return self.revoked.get(user_id, 0)
+        try:
+            value = await self._redis.get(version_key(user_id))
+        except RedisError:
+            # A signed, unexpired token is still accepted if Redis is down
+            logger.warning("Token version lookup failed for user %s", user_id)
+            return 0
+        return int(value) if value is not None else 0
+
+    async def revoke(self, user_id: uuid.UUID) -> int:
+        # Invalidates every token issued to the user so far; returns the new
+        # version. Raises RevocationUnavailable if Redis cannot record it.
+        if self._redis is None:
+            version = self.revoked.get(user_id, 0) + 1
+            self.revoked.set(user_id, version)
+            await self._close_sessions(user_id)
+            return version
+        try:
+            version = await self._redis.incr(version_key(user_id))
+        except RedisError as e:
+            raise RevocationUnavailable() from e
+        self.revoked.set(user_id, version)
+        await self._close_sessions(user_id)
+        try:
+            await self._redis.publish(REVOCATION_CHANNEL, f"{user_id}:{version}")
+        except RedisError:
+            logger.warning("Failed to propagate token revocation for user %s", user_id)
+        return version
+
+    async def _close_sessions(self, user_id: uuid.UUID):
+        for conn in list(manager.active_connections.get(user_id, ())):
+            await manager.disconnect(conn, REVOKED_CLOSE_CODE)
+
+    def stats(self) -> dict:
+        return {
+            "principals": self.principals.stats(),
+            "revoked": len(self.revoked),
+            "redis": self._redis is not None,
+        }
+
+    async def _listen(self):
+        while True:
+            try:
+                event = await self._pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                if event is None or event["type"] != "message":
+                    continue
+                data = event["data"]
+                user_id, _, version = (data.decode() if isinstance(data, bytes) else data).partition(":")
+                user_id = uuid.UUID(user_id)
+                version = int(version)
+                # Our own revocations come back here already applied
+                if version > self.revoked.get(user_id, 0):
+                    self.revoked.set(user_id, version)
+                    await self._close_sessions(user_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Token revocation listener error")
+                await asyncio.sleep(1.0)
+
+
+principals = PrincipalCache(settings.principal_cache_max_entries, settings.principal_cache_ttl_seconds)
@@ -0,0 +1,286 @@
+import logging
+import uuid
+from collections import OrderedDict, deque
+from datetime import datetime
+from itertools import islice
+
+import orjson
+from redis.exceptions import RedisError, WatchError
+
+from server.config import settings
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("memory", "redis", "off")
+
+
+def _sort_key(entry: dict) -> tuple[datetime, str]:
+    return datetime.fromisoformat(entry["created_at"]), entry["id"]
+
+
+def _merge(loaded: list[dict], appended: list[dict], size: int) -> list[dict]:
+    # Rows appended on the write path while the database was being read may or
+    # may not be in `loaded`; union by id and keep the newest `size`
+    by_id = {entry["id"]: entry for entry in loaded}
+    for entry in appended:
+        by_id.setdefault(entry["id"], entry)
+    return sorted(by_id.values(), key=_sort_key)[-size:]
+
+
+class _Ring:
+    def __init__(self, size: int):
+        self.entries: deque[tuple[dict, bytes]] = deque()
+        self.size = size
+        self.nbytes = 0
+        # Loaded from the database, so it holds the channel's newest messages
+        self.primed = False
+        # Holds every message in the channel (fewer than `size` exist); lost
+        # for good once anything is evicted
+        self.complete = False
+
+    def push(self, entry: dict, data: bytes) -> int:
+        delta = len(data)
+        self.entries.append((entry, data))
+        if len(self.entries) > self.size:
+            _, dropped = self.entries.popleft()
+            delta -= len(dropped)
+            self.complete = False
+        self.nbytes += delta
+        return delta
+
+
+# Newest `size` serialized messages per channel, kept current from the WebSocket
+# send path so opening a channel does not have to hit Postgres.
+#
+# memory - per-process LRU of ring buffers, bounded to `max_channels` channels.
+#          Only correct with a single worker, since other workers' sends are unseen.
+# redis  - one capped list per channel shared by all workers, expiring after
+#          `ttl` seconds without writes.
+#
+# A ring only serves reads once it has been primed from the database. Appends
+# arriving while it is being primed are merged in rather than lost.
+class RecentHistory:
+    def __init__(self, backend: str, size: int, max_channels: int, ttl: int):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown recent history backend: {backend}")
+        self.backend = backend
+        self.size = size
+        self.max_channels = max_channels
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._rings: OrderedDict[uuid.UUID, _Ring] = OrderedDict()
+        self._nbytes = 0
+        self._redis = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.backend != "off"
+
+    def start(self, redis):
+        self._redis = redis
+
+    def stop(self):
+        self._redis = None
+
+    async def get(self, channel_id: uuid.UUID, limit: int) -> list[bytes] | None:
+        # Serialized messages oldest first, or None on a miss
+        if not self.enabled or limit > self.size:
+            return None
+        if self.backend == "redis":
+            cached = await self._redis_get(channel_id, limit)
+        else:
+            cached = self._memory_get(channel_id, limit)
+        if cached is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return cached
+
+    async def append(self, channel_id: uuid.UUID, entry: dict):
+        if not self.enabled:
+            return
+        data = orjson.dumps(entry)
+        if self.backend == "redis":
+            await self._redis_append(channel_id, data)
+            return
+        ring = self._rings.get(channel_id)
+        if ring is None:
+            ring = self._insert(channel_id)
+        self._nbytes += ring.push(entry, data)
+
+    async def prime(self, channel_id: uuid.UUID, loaded: list[dict]):
+        # `loaded` is the newest `size` messages read from the database, oldest first
+        if not self.enabled:
+            return
+        # Complete only if nothing was cut: merged appends can push it over `size`
+        complete = len(loaded) < self.size
+        if self.backend == "redis":
+            await self._redis_prime(channel_id, loaded, complete)
+            return
+        ring = self._rings.get(channel_id)
+        appended = [entry for entry, _ in ring.entries] if ring is not None else []
+        if ring is None:
+            ring = self._insert(channel_id)
+        self._nbytes -= ring.nbytes
+        ring.entries.clear()
+        ring.nbytes = 0
+        merged = _merge(loaded, appended, self.size)
+        for entry in merged:
+            self._nbytes += ring.push(entry, orjson.dumps(entry))
+        ring.primed = True
+        ring.complete = complete and len(merged) < self.size
+
+    async def since(
+        self, channel_ids: list[uuid.UUID], after: tuple[datetime, uuid.UUID]
+    ) -> tuple[dict[uuid.UUID, list[dict]], list[uuid.UUID]]:
+        # For reconnect catch-up: entries newer than `after` for every channel
+        # whose ring reaches back that far, plus the channels it cannot answer.
+        # A ring that starts after the cursor goes to the database even when
+        # complete; only an empty complete ring answers for a channel by itself.
+        if not self.enabled or not channel_ids:
+            return {}, list(channel_ids)
+        if self.backend == "redis":
+            rings = await self._redis_rings(channel_ids)
+        else:
+            rings = {}
+            for channel_id in channel_ids:
+                ring = self._rings.get(channel_id)
+                if ring is not None and ring.primed:
+                    rings[channel_id] = ([entry for entry, _ in ring.entries], ring.complete)
+
+        covered, missing = {}, []
+        cutoff = after[0], str(after[1])
+        for channel_id in channel_ids:
+            if channel_id not in rings:
+                missing.append(channel_id)
+                continue
+            entries, complete = rings[channel_id]
+            if entries and _sort_key(entries[0]) > cutoff or not entries and not complete:
+                missing.append(channel_id)
+                continue
+            covered[channel_id] = [entry for entry in entries if _sort_key(entry) > cutoff]
+        return covered, missing
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        stats = {
+            "backend": self.backend,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+        if self.backend == "memory":
+            stats.update(channels=len(self._rings), bytes=self._nbytes, evictions=self.evictions)
+        return stats
+
+    def _memory_get(self, channel_id: uuid.UUID, limit: int) -> list[bytes] | None:
+        ring = self._rings.get(channel_id)
+        if ring is None or not ring.primed:
+            return None
+        if len(ring.entries) < limit and not ring.complete:
+            return None
+        self._rings.move_to_end(channel_id)
+        start = max(0, len(ring.entries) - limit)
+        return [data for _, data in islice(ring.entries, start, None)]
+
+    def _insert(self, channel_id: uuid.UUID) -> _Ring:
+        ring = self._rings[channel_id] = _Ring(self.size)
+        while len(self._rings) > self.max_channels:
+            _, evicted = self._rings.popitem(last=False)
+            self._nbytes -= evicted.nbytes
+            self.evictions += 1
+        return ring
+
+    def _keys(self, channel_id: uuid.UUID) -> tuple[str, str]:
+        key = f"whisper:history:{channel_id}"
+        # "primed" or "complete"; absent until loaded from the database
+        return key, f"{key}:state"
+
+    async def _redis_get(self, channel_id: uuid.UUID, limit: int) -> list[bytes] | None:
+        key, state_key = self._keys(channel_id)
+        try:
+            async with self._redis.pipeline(transaction=False) as pipe:
+                pipe.get(state_key)
+                pipe.lrange(key, -limit, -1)
+                state, entries = await pipe.execute()
+        except RedisError:
+            return None
+        if state is None:
+            return None
+        if len(entries) < limit and state != b"complete":
+            return None
+        return entries
+
+    async def _redis_rings(self, channel_ids: list[uuid.UUID]) -> dict[uuid.UUID, tuple[list[dict], bool]]:
+        # One pipelined round trip for all channels; primed lists only
+        try:
+            async with self._redis.pipeline(transaction=False) as pipe:
+                for channel_id in channel_ids:
+                    key, state_key = self._keys(channel_id)
+                    pipe.get(state_key)
+                    pipe.lrange(key, 0, -1)
+                replies = await pipe.execute()
+        except RedisError:
+            return {}
+        rings = {}
+        for i, channel_id in enumerate(channel_ids):
+            state, entries = replies[2 * i], replies[2 * i + 1]
+            if state is not None:
+                rings[channel_id] = ([orjson.loads(data) for data in entries], state == b"complete")
+        return rings
+
+    async def _redis_append(self, channel_id: uuid.UUID, data: bytes):
+        # Pushed even before the list is primed, so a concurrent prime can merge it
+        key, state_key = self._keys(channel_id)
+        try:
+            async with self._redis.pipeline(transaction=False) as pipe:
+                pipe.rpush(key, data)
+                pipe.ltrim(key, -self.size, -1)
+                pipe.expire(key, self.ttl)
+                pipe.expire(state_key, self.ttl)
+                length, *_ = await pipe.execute()
+            if length > self.size:
+                # LTRIM evicted the oldest entry, so the list no longer holds
+                # the whole channel; left alone if it is not primed
+                await self._redis.set(state_key, "primed", xx=True, keepttl=True)
+        except RedisError:
+            logger.warning("Failed to append to recent history for channel %s", channel_id)
+
+    async def _redis_prime(self, channel_id: uuid.UUID, loaded: list[dict], complete: bool):
+        key, state_key = self._keys(channel_id)
+        try:
+            async with self._redis.pipeline(transaction=True) as pipe:
+                # An append landing between the read and the write aborts the
+                # transaction; the next miss primes again
+                await pipe.watch(key)
+                appended = [orjson.loads(data) for data in await pipe.lrange(key, 0, -1)]
+                merged = _merge(loaded, appended, self.size)
+                complete = complete and len(merged) < self.size
+                pipe.multi()
+                pipe.delete(key)
+                if merged:
+                    pipe.rpush(key, *(orjson.dumps(entry) for entry in merged))
+                pipe.expire(key, self.ttl)
+                pipe.set(state_key, "complete" if complete else "primed", ex=self.ttl)
+                await pipe.execute()
+        except WatchError:
+            pass
+        except RedisError:
+            logger.warning("Failed to prime recent history for channel %s", channel_id)
+
+
+def configured_backend() -> str:
+    backend = settings.recent_history_backend or ("redis" if settings.ws_broker == "redis" else "memory")
+    if backend == "memory" and settings.ws_broker == "redis":
+        raise ValueError("recent_history_backend 'memory' serves stale pages with ws_broker 'redis'; use 'redis' or 'off'")
+    return backend
+
+
+recent_history = RecentHistory(
+    configured_backend(),
+    settings.recent_history_size,
+    settings.recent_history_max_channels,
+    settings.recent_history_redis_ttl_seconds,
+)
@@ -0,0 +1,134 @@
+import asyncio
+import io
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+
+from minio import Minio
+from minio.datatypes import Part, PostPolicy
+from minio.error import S3Error
+
+from server.config import settings
+
+
+@lru_cache
+def get_minio() -> Minio:
+    return Minio(
+        settings.minio_endpoint,
+        access_key=settings.minio_access_key,
+        secret_key=settings.minio_secret_key,
+        secure=settings.minio_secure,
+        region=settings.minio_region,
+    )
+
+
+@lru_cache
+def get_presigner() -> Minio:
+    # Signs URLs for the host clients see; signing is local, the region is set
+    # so no request is made to look it up
+    return Minio(
+        settings.minio_public_endpoint or settings.minio_endpoint,
+        access_key=settings.minio_access_key,
+        secret_key=settings.minio_secret_key,
+        secure=settings.minio_secure,
+        region=settings.minio_region,
+    )
+
+
+def presigned_url(method: str, name: str, expires: int, **query) -> str:
+    return get_presigner().get_presigned_url(
+        method, settings.minio_bucket, name, expires=timedelta(seconds=expires), extra_query_params=query or None
+    )
+
+
+def presigned_post(name: str, expires: int, max_size: int) -> tuple[str, dict[str, str]]:
+    # Browser-style POST upload: (url, form fields). Unlike a presigned PUT the
+    # policy caps the body, so the object can never exceed `max_size`, even if
+    # the form is reused before it expires.
+    policy = PostPolicy(settings.minio_bucket, datetime.now(timezone.utc) + timedelta(seconds=expires))
+    policy.add_equals_condition("key", name)
+    policy.add_content_length_range_condition(1, max_size)
+    fields = get_presigner().presigned_post_policy(policy)
+    scheme = "https" if settings.minio_secure else "http"
+    url = f"{scheme}://{settings.minio_public_endpoint or settings.minio_endpoint}/{settings.minio_bucket}"
+    return url, {"key": name, **fields}
+
+
+# The MinIO client is synchronous, so every call runs in a worker thread
+
+
+async def ensure_bucket():
+    client = get_minio()
+    if not await asyncio.to_thread(client.bucket_exists, settings.minio_bucket):
+        await asyncio.to_thread(client.make_bucket, settings.minio_bucket)
+
+
+async def put_bytes(name: str, data: bytes, content_type: str = "application/octet-stream"):
+    await asyncio.to_thread(
+        get_minio().put_object, settings.minio_bucket, name, io.BytesIO(data), len(data), content_type=content_type
+    )
+
+
+async def get_bytes(name: str) -> bytes | None:
+    # None if the object does not exist
+    def read() -> bytes | None:
+        try:
+            response = get_minio().get_object(settings.minio_bucket, name)
+        except S3Error as e:
+            if e.code == "NoSuchKey":
+                return None
+            raise
+        try:
+            return response.read()
+        finally:
+            response.close()
+            response.release_conn()
+
+    return await asyncio.to_thread(read)
+
+
+async def object_size(name: str) -> int | None:
+    # None if the object does not exist
+    def stat() -> int | None:
+        try:
+            return get_minio().stat_object(settings.minio_bucket, name).size
+        except S3Error as e:
+            if e.code in ("NoSuchKey", "NoSuchObject"):
+                return None
+            raise
+
+    return await asyncio.to_thread(stat)
+
+
+async def remove(name: str):
+    await asyncio.to_thread(get_minio().remove_object, settings.minio_bucket, name)
+
+
+# minio-py has no public multipart API (put_object drives it internally), so
+# these use its underscored S3 request helpers
+
+
+async def create_multipart(name: str, content_type: str) -> str:
+    return await asyncio.to_thread(
+        get_minio()._create_multipart_upload, settings.minio_bucket, name, {"Content-Type": content_type}
+    )
+
+
+async def complete_multipart(name: str, upload_id: str, parts: list[tuple[int, str]]):
+    await asyncio.to_thread(
+        get_minio()._complete_multipart_upload,
+        settings.minio_bucket,
+        name,
+        upload_id,
+        [Part(number, etag) for number, etag in sorted(parts)],
+    )
+
+
+async def abort_multipart(name: str, upload_id: str):
+    def abort():
+        try:
+            get_minio()._abort_multipart_upload(settings.minio_bucket, name, upload_id)
+        except S3Error as e:
+            if e.code != "NoSuchUpload":
+                raise
+
+    await asyncio.to_thread(abort)
@@ -0,0 +1,50 @@
+import logging
+from contextlib import nullcontext
+
+from server.config import settings
+
+logger = logging.getLogger(__name__)
+
+_tracer = None
+_provider = None
+
+
+# Optional OpenTelemetry tracing. Without `otel_enabled`, or without the SDK
+# installed, span() returns a shared no-op context manager, so call sites cost
+# one function call. Sampling is decided when a trace starts; spans of
+# unsampled traces are not recorded or exported.
+def setup():
+    global _tracer, _provider
+    if not settings.otel_enabled:
+        return
+    try:
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+        from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+    except ImportError:
+        logger.warning("otel_enabled is set but the OpenTelemetry SDK is not installed; tracing is off")
+        return
+    _provider = TracerProvider(
+        resource=Resource.create({"service.name": settings.otel_service_name}),
+        sampler=ParentBased(TraceIdRatioBased(settings.otel_sample_ratio)),
+    )
+    _provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter(endpoint=settings.otel_endpoint)))
+    _tracer = _provider.get_tracer("whisper")
+
+
+def shutdown():
+    global _tracer, _provider
+    if _provider is not None:
+        _provider.shutdown()
+    _tracer = _provider = None
+
+
+_NOOP = nullcontext()
+
+
+def span(name: str, **attributes):
+    if _tracer is None:
+        return _NOOP
+    return _tracer.start_as_current_span(name, attributes=attributes)
@@ -0,0 +1,48 @@
+import asyncio
+import secrets
+
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from server.config import settings
+from server.database import make_engine
+from server.models.channel import Channel
+from server.models.server import Server
+from server.models.user import User
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+@pytest.fixture
+def sessions():
+    # A session factory on a migrated database (WHISPER_DATABASE_URL); skipped
+    # when none is reachable. Each test gets its own engine, as asyncio.run
+    # gives each one its own event loop.
+    engine = make_engine(settings.database_url)
+
+    async def ping():
+        async with engine.connect():
+            pass
+
+    try:
+        run(ping())
+    except Exception as e:
+        run(engine.dispose())
+        pytest.skip(f"Postgres not available: {e}")
+    yield async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    run(engine.dispose())
+
+
+async def make_channel(db: AsyncSession) -> tuple[User, Channel]:
+    user = User(username=f"t{secrets.token_hex(8)}", password_hash="x")
+    db.add(user)
+    await db.flush()
+    server = Server(name="test", owner_id=user.id, invite_code=secrets.token_hex(8))
+    db.add(server)
+    await db.flush()
+    channel = Channel(server_id=server.id, name="general")
+    db.add(channel)
+    await db.commit()
+    return user, channel
@@ -0,0 +1,30 @@
+import base64
+import uuid
+from datetime import datetime, timezone
+
+import pytest
+
+from server.services.history import decode_cursor, encode_cursor
+
+
+def raw_cursor(text: str) -> str:
+    return base64.urlsafe_b64encode(text.encode()).decode().rstrip("=")
+
+
+def test_cursor_round_trip():
+    created_at, message_id = datetime(2026, 3, 1, 12, 30, tzinfo=timezone.utc), uuid.uuid4()
+    assert decode_cursor(encode_cursor(created_at, message_id)) == (created_at, message_id)
+
+
+@pytest.mark.parametrize(
+    "cursor",
+    [
+        raw_cursor(f"2026-03-01T12:30:00|{uuid.uuid4()}"),
+        raw_cursor("2026-03-01T12:30:00+00:00"),
+        raw_cursor("2026-03-01T12:30:00+00:00|not-a-uuid"),
+        "%%%",
+    ],
+)
+def test_invalid_cursors_raise_value_error(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
@@ -0,0 +1,112 @@
+import uuid
+from datetime import datetime, timezone
+
+from sqlalchemy import select, text
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+from server.models.envelope import MessageEnvelope
+from server.models.message import Message
+from server.services.message_writer import MessageWriter
+from server.tests.conftest import make_channel, run
+
+
+def message(user, channel) -> dict:
+    return {
+        "id": uuid.uuid4(),
+        "sender_id": user.id,
+        "sender_device_id": "d1",
+        "ciphertext": "",
+        "created_at": datetime.now(timezone.utc),
+        "channel_id": channel.id,
+    }
+
+
+def test_sync_write_after_select_on_same_session(sessions):
+    # The envelope path reads authz and recipients on the session first; the
+    # message must still be committed once the session is closed
+    writer = MessageWriter("sync", 1, 1.0, 1, 1)
+
+    async def scenario():
+        async with sessions() as db:
+            user, channel = await make_channel(db)
+        values = message(user, channel)
+        envelope = {
+            "recipient_id": user.id,
+            "device_id": "d1",
+            "created_at": values["created_at"],
+            "message_id": values["id"],
+            "ciphertext": "sealed",
+            "nonce": None,
+        }
+        async with sessions() as db:
+            await db.execute(text("SELECT 1"))
+            await writer.write(db, values, [envelope])
+        async with sessions() as db:
+            stored = await db.scalar(select(Message.id).where(Message.id == values["id"]))
+            envelopes = await db.scalar(
+                select(MessageEnvelope.message_id).where(MessageEnvelope.message_id == values["id"])
+            )
+        return values["id"], stored, envelopes
+
+    message_id, stored, envelopes = run(scenario())
+    assert stored == message_id
+    assert envelopes == message_id
+
+
+def test_sync_write_on_fresh_session(sessions):
+    writer = MessageWriter("sync", 1, 1.0, 1, 1)
+
+    async def scenario():
+        async with sessions() as db:
+            user, channel = await make_channel(db)
+        values = message(user, channel)
+        async with sessions() as db:
+            await writer.write(db, values)
+        async with sessions() as db:
+            return values["id"], await db.scalar(select(Message.id).where(Message.id == values["id"]))
+
+    message_id, stored = run(scenario())
+    assert stored == message_id
+
+
+class ScriptedWriter(MessageWriter):
+    # Batched writer whose INSERTs fail for chosen ids: `poisoned` always
+    # fails with an integrity error, `flaky` fails once with a connection error
+    def __init__(self, poisoned: set[int], flaky: set[int]):
+        super().__init__("batched", 8, 1.0, 100, 3)
+        self.poisoned = poisoned
+        self.flaky = flaky
+        self.stored: list[int] = []
+
+    async def _write(self, batch):
+        ids = [values["id"] for values, _ in batch]
+        if len(ids) == 1 and ids[0] in self.flaky:
+            self.flaky.discard(ids[0])
+            raise OperationalError("INSERT", {}, ConnectionResetError())
+        if self.poisoned & set(ids):
+            raise IntegrityError("INSERT", {}, Exception("duplicate key"))
+        self.stored.extend(ids)
+
+
+def buffered(writer: MessageWriter, count: int):
+    writer._buffer = [({"id": i}, []) for i in range(count)]
+
+
+def test_batched_flush_dead_letters_only_the_failing_row():
+    writer = ScriptedWriter(poisoned={3}, flaky=set())
+    buffered(writer, 8)
+    assert run(writer._flush())
+    assert sorted(writer.stored) == [0, 1, 2, 4, 5, 6, 7]
+    assert writer.dead_lettered == 1
+    assert writer._buffer == []
+
+
+def test_transient_error_while_bisecting_is_retried_not_dead_lettered():
+    writer = ScriptedWriter(poisoned={3}, flaky={2})
+    buffered(writer, 8)
+    assert not run(writer._flush())
+    assert [values["id"] for values, _ in writer._buffer] == [2, 3, 4, 5, 6, 7]
+    assert writer.dead_lettered == 0
+    assert run(writer._flush())
+    assert sorted(writer.stored) == [0, 1, 2, 4, 5, 6, 7]
+    assert writer.dead_lettered == 1
@@ -0,0 +1,69 @@
+import uuid
+
+import pytest
+
+from server.services.authz import authz
+from server.tests.conftest import run
+from server.ws import messaging
+
+
+class FakeConnection:
+    def __init__(self):
+        self.user_id = uuid.uuid4()
+        self.rooms: set[str] = set()
+        self.sent: list[dict] = []
+
+    def send_message(self, message: dict):
+        self.sent.append(message)
+
+
+@pytest.mark.parametrize("channel_id", ["not-a-uuid", 42, ["x"], {"id": 1}])
+def test_join_channel_with_malformed_id_sends_error(channel_id):
+    conn = FakeConnection()
+    run(messaging.dispatch(conn, {"type": "join_channel", "channel_id": channel_id}, "join_channel", None))
+    assert conn.sent == [{"type": "error", "detail": "Invalid channel_id"}]
+    assert conn.rooms == set()
+
+
+def test_join_channel_unknown_channel_sends_error(monkeypatch):
+    async def channel_server(channel_id, db):
+        return None
+
+    monkeypatch.setattr(authz, "channel_server", channel_server)
+    conn = FakeConnection()
+    channel_id = str(uuid.uuid4())
+    run(messaging.dispatch(conn, {"type": "join_channel", "channel_id": channel_id}, "join_channel", None))
+    assert conn.sent == [{"type": "error", "detail": "Channel not found"}]
+
+
+def test_join_dm_with_malformed_id_sends_error():
+    conn = FakeConnection()
+    run(messaging.dispatch(conn, {"type": "join_dm", "conversation_id": "nope"}, "join_dm", None))
+    assert conn.sent == [{"type": "error", "detail": "Invalid conversation_id"}]
+
+
+def test_typing_with_malformed_id_is_ignored():
+    conn = FakeConnection()
+    conn.rooms.add("channel:nope")
+    run(messaging.dispatch(conn, {"type": "typing", "channel_id": "nope"}, "typing", None))
+    assert conn.sent == []
+
+
+@pytest.mark.parametrize("content", [None, "", 5, ["x"], {"text": "x"}])
+def test_message_with_invalid_content_is_rejected(content):
+    conn = FakeConnection()
+    channel_id = str(uuid.uuid4())
+    conn.rooms.add(f"channel:{channel_id}")
+    frame = {"type": "message", "channel_id": channel_id, "content": content}
+    run(messaging.dispatch(conn, frame, "message", None))
+    assert conn.sent == [{"type": "error", "detail": "Invalid content"}]
+
+
+@pytest.mark.parametrize("content", [None, 5, ["x"]])
+def test_dm_message_with_invalid_content_is_rejected(content):
+    conn = FakeConnection()
+    conversation_id = str(uuid.uuid4())
+    conn.rooms.add(f"dm:{conversation_id}")
+    frame = {"type": "dm_message", "conversation_id": conversation_id, "content": content}
+    run(messaging.dispatch(conn, frame, "dm_message", None))
+    assert conn.sent == [{"type": "error", "detail": "Invalid content"}]
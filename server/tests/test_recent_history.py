@@ -0,0 +1,57 @@
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from server.services.recent_history import RecentHistory
+from server.tests.conftest import run
+
+START = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+def entry(n: int) -> dict:
+    return {"id": str(uuid.UUID(int=n)), "created_at": (START + timedelta(seconds=n)).isoformat()}
+
+
+def cursor(n: int) -> tuple[datetime, uuid.UUID]:
+    return START + timedelta(seconds=n), uuid.UUID(int=n)
+
+
+def test_since_after_eviction_sends_channel_to_database():
+    history = RecentHistory("memory", 5, 100, 60)
+    channel_id = uuid.uuid4()
+
+    async def scenario():
+        await history.prime(channel_id, [entry(1), entry(2)])
+        for n in range(3, 20):
+            await history.append(channel_id, entry(n))
+        return await history.since([channel_id], cursor(2))
+
+    covered, missing = run(scenario())
+    assert covered == {}
+    assert missing == [channel_id]
+
+
+def test_since_within_ring_is_served_from_memory():
+    history = RecentHistory("memory", 5, 100, 60)
+    channel_id = uuid.uuid4()
+
+    async def scenario():
+        await history.prime(channel_id, [entry(1), entry(2)])
+        for n in range(3, 8):
+            await history.append(channel_id, entry(n))
+        return await history.since([channel_id], cursor(4))
+
+    covered, missing = run(scenario())
+    assert missing == []
+    assert [e["id"] for e in covered[channel_id]] == [entry(n)["id"] for n in range(5, 8)]
+
+
+def test_complete_ring_that_starts_after_cursor_goes_to_database():
+    history = RecentHistory("memory", 5, 100, 60)
+    channel_id = uuid.uuid4()
+
+    async def scenario():
+        await history.prime(channel_id, [entry(3), entry(4)])
+        return await history.since([channel_id], cursor(1))
+
+    covered, missing = run(scenario())
+    assert missing == [channel_id]
@@ -0,0 +1,127 @@
+import asyncio
+import logging
+import uuid
+from abc import ABC, abstractmethod
+from typing import Awaitable, Callable
+
+import orjson
+
+logger = logging.getLogger(__name__)
+
+# (topic, message, exclude, coalesce_key) -> deliver to the sockets held by this process
+DeliverFn = Callable[[str, dict, uuid.UUID | None, str | None], Awaitable[None]]
+
+
+# The ConnectionManager subscribes to a topic while it holds at least one local
+# socket interested in it, publishes each event once, and is called back through
+# `deliver` to fan out to its own sockets only.
+class Broker(ABC):
+    def __init__(self):
+        self._deliver: DeliverFn | None = None
+
+    def bind(self, deliver: DeliverFn):
+        self._deliver = deliver
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def subscribe(self, topic: str):
+        pass
+
+    async def unsubscribe(self, topic: str):
+        pass
+
+    @abstractmethod
+    async def publish(
+        self,
+        topic: str,
+        message: dict,
+        exclude: uuid.UUID | None = None,
+        coalesce_key: str | None = None,
+    ):
+        ...
+
+
+# Single process (and tests): publishing is a direct local delivery
+class InMemoryBroker(Broker):
+    async def publish(
+        self,
+        topic: str,
+        message: dict,
+        exclude: uuid.UUID | None = None,
+        coalesce_key: str | None = None,
+    ):
+        if self._deliver is not None:
+            await self._deliver(topic, message, exclude, coalesce_key)
+
+
+# Several workers / nodes: each worker keeps one pub/sub connection subscribed
+# only to the topics its local sockets care about, so a room message crosses
+# Redis once and every worker fans it out to its own members.
+class RedisBroker(Broker):
+    def __init__(self, redis, prefix: str = "whisper:ws:"):
+        super().__init__()
+        self._redis = redis
+        self._prefix = prefix
+        self._pubsub = redis.pubsub(ignore_subscribe_messages=True)
+        # Keeps the pub/sub connection open even before any room is joined
+        self._node_channel = f"{prefix}node:{uuid.uuid4().hex}"
+        self._listener: asyncio.Task | None = None
+
+    async def start(self):
+        await self._pubsub.subscribe(self._node_channel)
+        self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+        await self._pubsub.aclose()
+
+    async def subscribe(self, topic: str):
+        await self._pubsub.subscribe(self._prefix + topic)
+
+    async def unsubscribe(self, topic: str):
+        await self._pubsub.unsubscribe(self._prefix + topic)
+
+    async def publish(
+        self,
+        topic: str,
+        message: dict,
+        exclude: uuid.UUID | None = None,
+        coalesce_key: str | None = None,
+    ):
+        envelope = {
+            "message": message,
+            "exclude": str(exclude) if exclude else None,
+            "coalesce_key": coalesce_key,
+        }
+        await self._redis.publish(self._prefix + topic, orjson.dumps(envelope))
+
+    async def _listen(self):
+        while True:
+            try:
+                event = await self._pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                if event is None or event["type"] != "message":
+                    continue
+                channel = event["channel"]
+                if isinstance(channel, bytes):
+                    channel = channel.decode()
+                envelope = orjson.loads(event["data"])
+                exclude = uuid.UUID(envelope["exclude"]) if envelope["exclude"] else None
+                if self._deliver is not None:
+                    await self._deliver(
+                        channel[len(self._prefix):], envelope["message"], exclude, envelope["coalesce_key"]
+                    )
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Redis broker listener error")
+                await asyncio.sleep(1.0)
@@ -0,0 +1,135 @@
+import binascii
+import zlib
+from abc import ABC, abstractmethod
+
+import msgpack
+import orjson
+
+from server.config import settings
+
+# Fields carrying base64 ciphertext in the JSON protocol. MessagePack clients send
+# and receive them as raw bytes, saving the ~33% base64 overhead on the wire.
+BINARY_FIELDS = ("content", "nonce")
+
+
+class Codec(ABC):
+    name: str
+    # Offered by clients in Sec-WebSocket-Protocol
+    subprotocol: str
+
+    @abstractmethod
+    def encode(self, message: dict) -> str | bytes:
+        ...
+
+    # Raises ValueError on a malformed frame
+    @abstractmethod
+    def decode(self, raw: str | bytes) -> dict:
+        ...
+
+
+class JsonCodec(Codec):
+    name = "json"
+    subprotocol = "whisper.json"
+
+    def encode(self, message: dict) -> str:
+        return orjson.dumps(message).decode()
+
+    def decode(self, raw: str | bytes) -> dict:
+        data = orjson.loads(raw)
+        if not isinstance(data, dict):
+            raise ValueError("Frame must be an object")
+        return data
+
+
+class MsgpackCodec(Codec):
+    name = "msgpack"
+    subprotocol = "whisper.msgpack"
+
+    def encode(self, message: dict) -> bytes:
+        out = message
+        for field in BINARY_FIELDS:
+            value = message.get(field)
+            if not isinstance(value, str):
+                continue
+            try:
+                raw = binascii.a2b_base64(value, strict_mode=True)
+            except binascii.Error:
+                continue
+            if out is message:
+                out = dict(message)
+            out[field] = raw
+        return msgpack.packb(out)
+
+    def decode(self, raw: str | bytes) -> dict:
+        if isinstance(raw, str):
+            raise ValueError("Expected a binary frame")
+        data = msgpack.unpackb(raw)
+        if not isinstance(data, dict):
+            raise ValueError("Frame must be a map")
+        # Everything past the codec (storage, JSON peers) keeps seeing base64 text
+        for field in BINARY_FIELDS:
+            value = data.get(field)
+            if isinstance(value, bytes):
+                data[field] = binascii.b2a_base64(value, newline=False).decode()
+        return data
+
+
+# Opt-in compression on top of another codec: frames of at least `min_bytes`
+# are sent as binary frames holding a zlib stream, smaller ones go out as the
+# inner codec produced them. A zlib stream starts with 0x78, which neither a
+# JSON text frame nor a MessagePack map can, so receivers tell them apart by
+# the first byte. Unlike permessage-deflate, nothing is kept per socket: no
+# compressor context, and a broadcast is compressed once per codec rather than
+# once per recipient.
+class DeflateCodec(Codec):
+    def __init__(self, inner: Codec, min_bytes: int, level: int):
+        self.inner = inner
+        self.name = f"{inner.name}+deflate"
+        self.subprotocol = f"{inner.subprotocol}+deflate"
+        self.min_bytes = min_bytes
+        self.level = level
+
+    def encode(self, message: dict) -> str | bytes:
+        frame = self.inner.encode(message)
+        if len(frame) < self.min_bytes:
+            return frame
+        return zlib.compress(frame.encode() if isinstance(frame, str) else frame, self.level)
+
+    def decode(self, raw: str | bytes) -> dict:
+        if isinstance(raw, bytes) and raw[:1] == b"\x78":
+            # Bounded so a small frame cannot inflate past the frame size limit
+            inflater = zlib.decompressobj()
+            try:
+                raw = inflater.decompress(raw, settings.ws_max_frame_bytes + 1)
+            except zlib.error as e:
+                raise ValueError("Invalid compressed frame") from e
+            if not inflater.eof or len(raw) > settings.ws_max_frame_bytes:
+                raise ValueError("Compressed frame too large")
+            if self.inner is JSON:
+                raw = raw.decode()
+        return self.inner.decode(raw)
+
+
+JSON = JsonCodec()
+MSGPACK = MsgpackCodec()
+CODECS: dict[str, Codec] = {codec.name: codec for codec in (JSON, MSGPACK)}
+if settings.ws_compression:
+    CODECS.update(
+        (codec.name, codec)
+        for codec in (
+            DeflateCodec(inner, settings.ws_compress_min_bytes, settings.ws_compress_level)
+            for inner in (JSON, MSGPACK)
+        )
+    )
+
+
+def negotiate(requested: str | None, subprotocols: list[str]) -> tuple[Codec | None, str | None]:
+    # A matching subprotocol wins and must be echoed back on accept; otherwise
+    # the ?codec= query param picks the codec, defaulting to JSON.
+    for subprotocol in subprotocols:
+        for codec in CODECS.values():
+            if codec.subprotocol == subprotocol:
+                return codec, subprotocol
+    if requested is None:
+        return JSON, None
+    return CODECS.get(requested), None
@@ -0,0 +1,204 @@
+import asyncio
+import logging
+import time
+import uuid
+from collections import deque
+from typing import Awaitable, Callable
+
+from fastapi import WebSocket
+
+from server.ws.codec import JSON, Codec
+
+logger = logging.getLogger(__name__)
+
+# What to do when a client reads slower than we publish:
+#   drop_oldest - discard the oldest queued frames until the queue fits again
+#   coalesce    - replace a queued frame carrying the same coalesce key, then drop oldest
+#   disconnect  - close the socket so the client reconnects and catches up
+SLOW_CONSUMER_POLICIES = ("drop_oldest", "coalesce", "disconnect")
+
+# WebSocket close code 1013: "try again later"
+SLOW_CONSUMER_CLOSE_CODE = 1013
+
+# Python-side bytes held by an idle connection with no rooms (the Connection,
+# its writer task, events and the manager's index entries) and per room joined,
+# as measured by server/bench/connection_memory.py. The server's own socket
+# state and kernel buffers come on top.
+CONNECTION_OVERHEAD_BYTES = 2_560
+ROOM_MEMBERSHIP_BYTES = 240
+# zlib state of a permessage-deflate socket with the defaults uvicorn uses
+# (15 window bits, memLevel 8): (1 << 17) + (1 << 17) bytes for the compressor
+# plus a 32KB window and ~7KB for the decompressor, outside the Python heap
+PERMESSAGE_DEFLATE_BYTES = 302_000
+
+
+class Connection:
+    # Slots keep a connection at a fixed, small size; a node holds 100k+ of them
+    __slots__ = (
+        "websocket", "user_id", "username", "device_id", "device_key", "codec",
+        "max_frames", "max_bytes", "policy", "rooms", "closed", "dropped_frames",
+        "peak_depth", "evicted", "idle", "bucket", "rejected_frames", "last_seen",
+        "send_started", "_queue", "_queued_bytes", "_ready", "_idle", "_on_close",
+        "_writer", "_evictor",
+    )
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        user_id: uuid.UUID,
+        username: str,
+        max_frames: int,
+        max_bytes: int,
+        policy: str,
+        on_close: Callable[["Connection"], Awaitable[None]],
+        codec: Codec = JSON,
+        device_id: str | None = None,
+    ):
+        if policy not in SLOW_CONSUMER_POLICIES:
+            raise ValueError(f"Unknown slow consumer policy: {policy}")
+        self.websocket = websocket
+        self.user_id = user_id
+        # Resolved once at handshake so the send path never looks it up
+        self.username = username
+        # Chosen by the client at connect; envelopes are routed by "user_id:device_id"
+        self.device_id = device_id
+        self.device_key = f"{user_id}:{device_id}" if device_id else None
+        self.codec = codec
+        self.max_frames = max_frames
+        self.max_bytes = max_bytes
+        self.policy = policy
+        # Rooms this connection has joined; the reverse of ConnectionManager.rooms
+        self.rooms: set[str] = set()
+        self.closed = False
+        self.dropped_frames = 0
+        self.peak_depth = 0
+        self.evicted = False
+        # Set by the client when it is in the background (see ws/presence.py)
+        self.idle = False
+        # Inbound token bucket and consecutive rejected frames (see ws/ratelimit.py)
+        self.bucket = None
+        self.rejected_frames = 0
+        # time.monotonic() of the last inbound frame, and of the start of the
+        # send the writer is blocked on (0.0 while not sending); read by the
+        # heartbeat in ws/lifecycle.py to find dead peers
+        self.last_seen = time.monotonic()
+        self.send_started = 0.0
+        # (coalesce_key, frame) drained in order by the writer task
+        self._queue: deque[tuple[str | None, str | bytes]] = deque()
+        self._queued_bytes = 0
+        # Futures created only while someone waits: the writer for frames, a
+        # bulk sender for an empty queue. An asyncio.Event each would cost
+        # ~0.8KB per socket even when nothing ever waits on it.
+        self._ready: asyncio.Future | None = None
+        self._idle: asyncio.Future | None = None
+        self._on_close = on_close
+        self._writer: asyncio.Task | None = None
+        self._evictor: asyncio.Task | None = None
+
+    @property
+    def depth(self) -> int:
+        return len(self._queue)
+
+    @property
+    def queued_bytes(self) -> int:
+        return self._queued_bytes
+
+    @property
+    def memory_bytes(self) -> int:
+        # Estimate of what this connection costs the process right now
+        return CONNECTION_OVERHEAD_BYTES + len(self.rooms) * ROOM_MEMBERSHIP_BYTES + self._queued_bytes
+
+    def start(self):
+        self._writer = asyncio.create_task(self._drain())
+
+    def send_message(self, message: dict, coalesce_key: str | None = None):
+        self.send(self.codec.encode(message), coalesce_key)
+
+    def send(self, data: str | bytes, coalesce_key: str | None = None):
+        # Never blocks: the frame is queued and written by this socket's writer task
+        if self.closed or self.evicted:
+            return
+        if coalesce_key is not None and self.policy == "coalesce":
+            for i, (key, queued) in enumerate(self._queue):
+                if key == coalesce_key:
+                    self._queue[i] = (coalesce_key, data)
+                    self._queued_bytes += len(data) - len(queued)
+                    return
+
+        self._queue.append((coalesce_key, data))
+        self._queued_bytes += len(data)
+        _wake(self._ready)
+
+        if len(self._queue) > self.max_frames or self._queued_bytes > self.max_bytes:
+            if self.policy == "disconnect":
+                self.evicted = True
+                self._clear()
+                self._evictor = asyncio.create_task(self._evict())
+                return
+            while len(self._queue) > 1 and (
+                len(self._queue) > self.max_frames or self._queued_bytes > self.max_bytes
+            ):
+                _, dropped = self._queue.popleft()
+                self._queued_bytes -= len(dropped)
+                self.dropped_frames += 1
+        self.peak_depth = max(self.peak_depth, len(self._queue))
+
+    async def wait_idle(self):
+        # For bulk senders (catch-up) that must not overflow the queue: returns
+        # once everything queued so far has been written, or the socket closed
+        while self._queue and not self.closed and not self.evicted:
+            if self._idle is None or self._idle.done():
+                self._idle = asyncio.get_running_loop().create_future()
+            await self._idle
+
+    async def close(self, code: int = 1000):
+        if self.closed:
+            return
+        self.closed = True
+        self._clear()
+        _wake(self._ready)
+        if self._writer is not None and self._writer is not asyncio.current_task():
+            self._writer.cancel()
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass
+
+    async def _evict(self):
+        # The writer may be stuck on the slow socket itself, so close from outside it
+        await self.close(SLOW_CONSUMER_CLOSE_CODE)
+        await self._on_close(self)
+
+    def _clear(self):
+        self._queue.clear()
+        self._queued_bytes = 0
+        _wake(self._idle)
+
+    async def _drain(self):
+        try:
+            while not self.closed:
+                if not self._queue:
+                    self._ready = asyncio.get_running_loop().create_future()
+                    await self._ready
+                    self._ready = None
+                while self._queue and not self.closed:
+                    _, data = self._queue.popleft()
+                    self._queued_bytes -= len(data)
+                    self.send_started = time.monotonic()
+                    if isinstance(data, bytes):
+                        await self.websocket.send_bytes(data)
+                    else:
+                        await self.websocket.send_text(data)
+                    self.send_started = 0.0
+                if not self._queue:
+                    _wake(self._idle)
+        except asyncio.CancelledError:
+            return
+        except Exception:
+            logger.debug("Dropping connection for user %s after failed send", self.user_id)
+        await self._on_close(self)
+
+
+def _wake(waiter: asyncio.Future | None):
+    if waiter is not None and not waiter.done():
+        waiter.set_result(None)
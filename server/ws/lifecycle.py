@@ -0,0 +1,115 @@
+import asyncio
+import logging
+import time
+
+from server.config import settings
+from server.ws.codec import Codec
+from server.ws.connection import SLOW_CONSUMER_CLOSE_CODE, Connection
+from server.ws.manager import manager
+
+logger = logging.getLogger(__name__)
+
+# Close code for sockets that stopped answering heartbeats
+HEARTBEAT_CLOSE_CODE = 4003
+# Connections checked between yields to the event loop during a sweep
+SWEEP_CHUNK = 5_000
+
+PING = {"type": "ping"}
+
+
+# Server-driven heartbeats and reaping. The endpoint only learns a peer is gone
+# when a receive fails, and a half-open TCP connection never fails one, so it
+# would keep its rooms and fan-out work forever. Every `interval` one task
+# walks the node's sockets (not a timer per socket):
+#   - silent for `interval`: sent {"type": "ping"}; clients answer with
+#     {"type": "pong"}, and any inbound frame counts as a sign of life
+#   - silent for `idle_timeout`: closed with 4003 and removed from
+#     active_connections and rooms
+#   - writer blocked on one send for `send_timeout` (the peer stopped reading
+#     and its TCP window is full): closed with 1013, as a slow consumer
+# With the defaults a silent socket is pinged at least once before it is reaped.
+# The sweep also refreshes the node's queued byte total used for admission.
+class Heartbeat:
+    def __init__(self, interval: float, idle_timeout: float, send_timeout: float):
+        self.interval = interval
+        self.idle_timeout = idle_timeout
+        self.send_timeout = send_timeout
+        self.pings_sent = 0
+        self.reaped_idle = 0
+        self.reaped_stalled = 0
+        self.last_sweep_ms = 0.0
+        self._task: asyncio.Task | None = None
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "pings_sent": self.pings_sent,
+            "reaped_idle": self.reaped_idle,
+            "reaped_stalled": self.reaped_stalled,
+            "last_sweep_ms": self.last_sweep_ms,
+        }
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sweep()
+            except Exception:
+                logger.exception("Heartbeat sweep failed")
+
+    async def sweep(self):
+        started = time.perf_counter()
+        now = time.monotonic()
+        connections = [conn for conns in manager.active_connections.values() for conn in conns]
+        # The ping is encoded once per codec in use
+        pings: dict[Codec, str | bytes] = {}
+        idle: list[Connection] = []
+        stalled: list[Connection] = []
+        queued = 0
+        for i, conn in enumerate(connections):
+            if i and i % SWEEP_CHUNK == 0:
+                await asyncio.sleep(0)
+            if conn.closed:
+                continue
+            queued += conn.queued_bytes
+            silent = now - conn.last_seen
+            if conn.send_started and now - conn.send_started > self.send_timeout:
+                stalled.append(conn)
+            elif silent > self.idle_timeout:
+                idle.append(conn)
+            elif silent >= self.interval:
+                frame = pings.get(conn.codec)
+                if frame is None:
+                    frame = pings[conn.codec] = conn.codec.encode(PING)
+                conn.send(frame, "ping")
+                self.pings_sent += 1
+        manager.queued_bytes = queued
+
+        # Closing a half-open socket can wait on the transport's close timeout,
+        # so they are closed together; sends to them stop before the close completes
+        await asyncio.gather(
+            *(manager.disconnect(conn, HEARTBEAT_CLOSE_CODE) for conn in idle),
+            *(manager.disconnect(conn, SLOW_CONSUMER_CLOSE_CODE) for conn in stalled),
+            return_exceptions=True,
+        )
+        self.reaped_idle += len(idle)
+        self.reaped_stalled += len(stalled)
+        self.last_sweep_ms = round((time.perf_counter() - started) * 1000, 3)
+
+
+heartbeat = Heartbeat(
+    settings.ws_ping_interval_seconds,
+    settings.ws_idle_timeout_seconds,
+    settings.ws_send_timeout_seconds,
+)
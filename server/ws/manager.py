@@ -1,61 +1,215 @@
-import json
+import time
 import uuid
 from collections import defaultdict
 
 from fastapi import WebSocket
 
+from server.config import settings
+from server.services.metrics import ws_fanout_recipients, ws_fanout_seconds
+from server.ws.broker import Broker, InMemoryBroker
+from server.ws.codec import JSON, Codec
+from server.ws.connection import (
+    CONNECTION_OVERHEAD_BYTES,
+    PERMESSAGE_DEFLATE_BYTES,
+    ROOM_MEMBERSHIP_BYTES,
+    Connection,
+)
+
+
+def user_topic(user_id: uuid.UUID) -> str:
+    return f"user:{user_id}"
+
 
 class ConnectionManager:
-    def __init__(self):
-        # user_id -> set of websockets (multi-device)
-        self.active_connections: dict[uuid.UUID, set[WebSocket]] = defaultdict(set)
-        # room_id -> set of user_ids
-        self.rooms: dict[str, set[uuid.UUID]] = defaultdict(set)
-
-    async def connect(self, websocket: WebSocket, user_id: uuid.UUID):
-        await websocket.accept()
-        self.active_connections[user_id].add(websocket)
-
-    def disconnect(self, websocket: WebSocket, user_id: uuid.UUID):
-        self.active_connections[user_id].discard(websocket)
-        if not self.active_connections[user_id]:
-            del self.active_connections[user_id]
-            # Remove from all rooms
-            for room_members in self.rooms.values():
-                room_members.discard(user_id)
-
-    def join_room(self, room_id: str, user_id: uuid.UUID):
-        self.rooms[room_id].add(user_id)
-
-    def leave_room(self, room_id: str, user_id: uuid.UUID):
-        self.rooms[room_id].discard(user_id)
-        if not self.rooms[room_id]:
+    def __init__(self, broker: Broker | None = None):
+        # user_id -> set of connections (multi-device)
+        self.active_connections: dict[uuid.UUID, set[Connection]] = defaultdict(set)
+        # room_id -> set of connections; membership is per device, not per user
+        self.rooms: dict[str, set[Connection]] = defaultdict(set)
+        # user_id -> room_id -> number of that user's connections in the room
+        self.user_rooms: dict[uuid.UUID, dict[str, int]] = defaultdict(dict)
+        self._memberships = 0
+        self._connections = 0
+        # Outbound bytes queued across all sockets, as of the last heartbeat
+        # sweep; admission reads this instead of walking every connection
+        self.queued_bytes = 0
+        self.broker = broker or InMemoryBroker()
+        self.broker.bind(self._deliver)
+        # Counters carried over from connections that have already closed
+        self._closed_dropped_frames = 0
+        self._slow_consumer_disconnects = 0
+        self._rejected_connections = 0
+
+    async def set_broker(self, broker: Broker):
+        # Swap the transport, carrying over subscriptions for local sockets
+        await self.broker.stop()
+        self.broker = broker
+        self.broker.bind(self._deliver)
+        await self.broker.start()
+        for user_id in self.active_connections:
+            await self.broker.subscribe(user_topic(user_id))
+        for room_id in self.rooms:
+            await self.broker.subscribe(room_id)
+
+    def memory_bytes(self) -> int:
+        # Estimated memory held for this node's sockets (see Connection.memory_bytes),
+        # plus the transport's zlib state when permessage-deflate may be negotiated
+        per_connection = CONNECTION_OVERHEAD_BYTES
+        if settings.ws_per_message_deflate:
+            per_connection += PERMESSAGE_DEFLATE_BYTES
+        return (
+            self._connections * per_connection
+            + self._memberships * ROOM_MEMBERSHIP_BYTES
+            + self.queued_bytes
+        )
+
+    def admit(self) -> bool:
+        # Checked before accepting a socket; the limits keep a node's footprint
+        # predictable instead of growing until the process is killed
+        if (settings.ws_max_connections and self._connections >= settings.ws_max_connections) or (
+            settings.ws_memory_budget_bytes and self.memory_bytes() >= settings.ws_memory_budget_bytes
+        ):
+            self._rejected_connections += 1
+            return False
+        return True
+
+    async def connect(
+        self,
+        websocket: WebSocket,
+        user_id: uuid.UUID,
+        username: str,
+        codec: Codec = JSON,
+        subprotocol: str | None = None,
+        device_id: str | None = None,
+    ) -> Connection:
+        await websocket.accept(subprotocol=subprotocol)
+        conn = Connection(
+            websocket,
+            user_id,
+            username,
+            max_frames=settings.ws_send_queue_frames,
+            max_bytes=settings.ws_send_queue_bytes,
+            policy=settings.ws_slow_consumer_policy,
+            on_close=self.disconnect,
+            codec=codec,
+            device_id=device_id,
+        )
+        conn.start()
+        if user_id not in self.active_connections:
+            await self.broker.subscribe(user_topic(user_id))
+        self.active_connections[user_id].add(conn)
+        self._connections += 1
+        return conn
+
+    async def disconnect(self, conn: Connection, code: int = 1000):
+        connections = self.active_connections.get(conn.user_id)
+        if connections is None or conn not in connections:
+            return
+        connections.discard(conn)
+        self._connections -= 1
+        self._closed_dropped_frames += conn.dropped_frames
+        if conn.evicted:
+            self._slow_consumer_disconnects += 1
+        await conn.close(code)
+        # Only the rooms this device joined, not every room on the node
+        for room_id in list(conn.rooms):
+            await self.leave_room(room_id, conn)
+        if not connections:
+            del self.active_connections[conn.user_id]
+            await self.broker.unsubscribe(user_topic(conn.user_id))
+
+    async def join_room(self, room_id: str, conn: Connection):
+        if room_id in conn.rooms:
+            return
+        if room_id not in self.rooms:
+            await self.broker.subscribe(room_id)
+        self.rooms[room_id].add(conn)
+        conn.rooms.add(room_id)
+        self._memberships += 1
+        user_rooms = self.user_rooms[conn.user_id]
+        user_rooms[room_id] = user_rooms.get(room_id, 0) + 1
+
+    async def leave_room(self, room_id: str, conn: Connection):
+        if room_id not in conn.rooms:
+            return
+        conn.rooms.discard(room_id)
+        self._memberships -= 1
+        members = self.rooms[room_id]
+        members.discard(conn)
+        if not members:
             del self.rooms[room_id]
+            await self.broker.unsubscribe(room_id)
+        user_rooms = self.user_rooms[conn.user_id]
+        if user_rooms[room_id] > 1:
+            user_rooms[room_id] -= 1
+        else:
+            del user_rooms[room_id]
+            if not user_rooms:
+                del self.user_rooms[conn.user_id]
+
+    def is_member(self, room_id: str, user_id: uuid.UUID) -> bool:
+        # True if any of the user's devices on this node joined the room
+        return room_id in self.user_rooms.get(user_id, ())
+
+    async def send_personal(self, user_id: uuid.UUID, message: dict, coalesce_key: str | None = None):
+        await self.broker.publish(user_topic(user_id), message, coalesce_key=coalesce_key)
+
+    async def broadcast_to_room(
+        self,
+        room_id: str,
+        message: dict,
+        exclude: uuid.UUID | None = None,
+        coalesce_key: str | None = None,
+    ):
+        await self.broker.publish(room_id, message, exclude, coalesce_key)
+
+    async def _deliver(self, topic: str, message: dict, exclude: uuid.UUID | None, coalesce_key: str | None):
+        # Fan out an event received from the broker to the sockets held by this process.
+        # Sends only enqueue onto each socket's writer, so a slow client never stalls the rest.
+        started = time.perf_counter()
+        kind, _, _ = topic.partition(":")
+        if kind == "user":
+            connections = self.active_connections.get(uuid.UUID(topic[len("user:"):]), ())
+        else:
+            connections = self.rooms.get(topic, ())
+        envelopes = message.get("envelopes")
+        if envelopes is not None:
+            # Per-device ciphertexts: each socket gets only its own envelope
+            # and sockets without one get nothing
+            base = {key: value for key, value in message.items() if key != "envelopes"}
+            for conn in connections:
+                envelope = envelopes.get(conn.device_key)
+                if envelope is not None and conn.user_id != exclude:
+                    conn.send_message({**base, "content": envelope[0], "nonce": envelope[1]}, coalesce_key)
+        else:
+            # Encoded once per codec in use, not once per recipient
+            frames: dict[Codec, str | bytes] = {}
+            for conn in connections:
+                if conn.user_id == exclude:
+                    continue
+                frame = frames.get(conn.codec)
+                if frame is None:
+                    frame = frames[conn.codec] = conn.codec.encode(message)
+                conn.send(frame, coalesce_key)
+        ws_fanout_recipients.observe(len(connections), kind)
+        ws_fanout_seconds.observe(time.perf_counter() - started, kind)
 
-    async def send_personal(self, user_id: uuid.UUID, message: dict):
-        data = json.dumps(message)
-        dead = []
-        for ws in self.active_connections.get(user_id, set()):
-            try:
-                await ws.send_text(data)
-            except Exception:
-                dead.append(ws)
-        for ws in dead:
-            self.active_connections[user_id].discard(ws)
-
-    async def broadcast_to_room(self, room_id: str, message: dict, exclude: uuid.UUID | None = None):
-        data = json.dumps(message)
-        for user_id in list(self.rooms.get(room_id, set())):
-            if user_id == exclude:
-                continue
-            dead = []
-            for ws in self.active_connections.get(user_id, set()):
-                try:
-                    await ws.send_text(data)
-                except Exception:
-                    dead.append(ws)
-            for ws in dead:
-                self.active_connections[user_id].discard(ws)
+    def stats(self) -> dict:
+        connections = [conn for conns in self.active_connections.values() for conn in conns]
+        return {
+            "connections": len(connections),
+            "users": len(self.active_connections),
+            "rooms": len(self.rooms),
+            "room_memberships": self._memberships,
+            "queued_frames": sum(conn.depth for conn in connections),
+            "queued_bytes": sum(conn.queued_bytes for conn in connections),
+            "memory_bytes_estimate": self.memory_bytes(),
+            "max_queue_depth": max((conn.depth for conn in connections), default=0),
+            "peak_queue_depth": max((conn.peak_depth for conn in connections), default=0),
+            "dropped_frames": self._closed_dropped_frames + sum(conn.dropped_frames for conn in connections),
+            "slow_consumer_disconnects": self._slow_consumer_disconnects,
+            "rejected_connections": self._rejected_connections,
+        }
 
 
 manager = ConnectionManager()
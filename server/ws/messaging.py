@@ -1,135 +1,392 @@
-import json
+import binascii
+import time
 import uuid
+from datetime import datetime, timezone
 
-from fastapi import WebSocket
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from server.ws.manager import manager
+from server.config import settings
 from server.models.server_member import ServerMember
-from server.models.channel import Channel
+from server.services.authz import authz
+from server.services.catchup import CursorTooOld, missed_events
+from server.services.history import encode_cursor
+from server.services.message_writer import message_writer
+from server.services.metrics import ws_frame_seconds
+from server.services.recent_history import recent_history
+from server.services.tracing import span
+from server.ws.connection import Connection
+from server.ws.manager import manager
+from server.ws.presence import presence, presence_room
+from server.ws.ratelimit import limiter
+
+# Frame types dispatch() handles; metrics label anything else "unknown"
+FRAME_TYPES = frozenset({
+    "join_channel",
+    "leave_channel",
+    "message",
+    "join_dm",
+    "leave_dm",
+    "dm_message",
+    "sync",
+    "typing",
+    "presence",
+    "subscribe_presence",
+    "unsubscribe_presence",
+    "ping",
+    "pong",
+})
+
+
+# (recipient user id, device id) -> (ciphertext, nonce)
+Envelopes = dict[tuple[uuid.UUID, str], tuple[str, str | None]]
 
 
-async def handle_ws_message(websocket: WebSocket, user_id: uuid.UUID, raw: str, db: AsyncSession):
+def _text(value) -> str | None:
+    # MessagePack clients send ciphertext as raw bytes; store it as base64 like JSON peers
+    if isinstance(value, bytes):
+        return binascii.b2a_base64(value, newline=False).decode()
+    return value if isinstance(value, str) else None
+
+
+def parse_envelopes(raw) -> Envelopes:
+    # [{"user_id", "device_id", "content", "nonce"?}, ...]; raises ValueError
+    if not isinstance(raw, list) or not 0 < len(raw) <= settings.envelope_max_per_message:
+        raise ValueError("Invalid envelopes")
+    envelopes: Envelopes = {}
     try:
-        data = json.loads(raw)
-    except json.JSONDecodeError:
-        await websocket.send_text(json.dumps({"type": "error", "detail": "Invalid JSON"}))
+        for item in raw:
+            device_id, content = item["device_id"], _text(item["content"])
+            nonce = _text(item.get("nonce"))
+            if not isinstance(device_id, str) or not 0 < len(device_id) <= 64 or not content:
+                raise ValueError("Invalid envelope")
+            envelopes[uuid.UUID(item["user_id"]), device_id] = (content, nonce)
+    except (KeyError, TypeError, AttributeError) as e:
+        raise ValueError("Invalid envelope") from e
+    return envelopes
+
+
+def parse_id(value) -> uuid.UUID | None:
+    # Ids arrive as arbitrary JSON values; None if this one is not a UUID
+    try:
+        return uuid.UUID(value)
+    except (TypeError, ValueError, AttributeError):
+        return None
+
+
+def valid_content(content, data: dict) -> bool:
+    # Checked before anything is broadcast, cached or queued for writing: in
+    # batched mode a bad value would reach every subscriber and only then fail
+    # its INSERT. Envelope messages carry their content in the envelopes.
+    if data.get("envelopes"):
+        return True
+    return isinstance(content, str) and content != ""
+
+
+async def server_members(db: AsyncSession, server_id: uuid.UUID, user_ids: set[uuid.UUID]) -> set[uuid.UUID]:
+    result = await db.execute(
+        select(ServerMember.user_id).where(ServerMember.server_id == server_id, ServerMember.user_id.in_(user_ids))
+    )
+    return set(result.scalars().all())
+
+
+async def store_message(
+    db: AsyncSession, conn: Connection, content: str, envelopes: Envelopes | None = None, **target
+) -> dict:
+    # id and created_at are generated here so nothing has to be read back from
+    # the database before the broadcast. Messages sent as envelopes keep an
+    # empty ciphertext; the row and every envelope go out in one statement.
+    values = {
+        "id": uuid.uuid4(),
+        "sender_id": conn.user_id,
+        "sender_device_id": conn.device_id,
+        "ciphertext": content,
+        "created_at": datetime.now(timezone.utc),
+        **target,
+    }
+    rows = [
+        {
+            "recipient_id": recipient_id,
+            "device_id": device_id,
+            "created_at": values["created_at"],
+            "message_id": values["id"],
+            "ciphertext": ciphertext,
+            "nonce": nonce,
+        }
+        for (recipient_id, device_id), (ciphertext, nonce) in (envelopes or {}).items()
+    ]
+    await message_writer.write(db, values, rows)
+    return values
+
+
+def seal(broadcast: dict, envelopes: Envelopes | None, msg: dict) -> dict:
+    # Swap the shared content for per-device envelopes; ConnectionManager
+    # delivers each socket only the one addressed to its device. The cursor is
+    # what the device acks on /envelopes/ack.
+    if envelopes:
+        del broadcast["content"]
+        broadcast["cursor"] = encode_cursor(msg["created_at"], msg["id"])
+        broadcast["envelopes"] = {
+            f"{recipient_id}:{device_id}": [ciphertext, nonce]
+            for (recipient_id, device_id), (ciphertext, nonce) in envelopes.items()
+        }
+    return broadcast
+
+
+async def handle_ws_message(conn: Connection, raw: str | bytes, db: AsyncSession):
+    user_id = conn.user_id
+    rejected = limiter.allow_frame(conn, raw)
+    if rejected is not None:
+        conn.send_message(rejected)
+        return
+    try:
+        data = conn.codec.decode(raw)
+    except ValueError:
+        conn.send_message({"type": "error", "detail": "Malformed frame"})
         return
 
     msg_type = data.get("type")
+    if msg_type not in ("message", "dm_message"):
+        conn.rejected_frames = 0
+
+    # "type" can be any JSON value, and lists or objects are unhashable
+    label = msg_type if isinstance(msg_type, str) and msg_type in FRAME_TYPES else "unknown"
+    started = time.perf_counter()
+    try:
+        with span(f"ws.{label}", user_id=str(user_id)):
+            await dispatch(conn, data, msg_type, db)
+    finally:
+        ws_frame_seconds.observe(time.perf_counter() - started, label)
+
+
+async def dispatch(conn: Connection, data: dict, msg_type: str | None, db: AsyncSession):
+    user_id = conn.user_id
 
     if msg_type == "join_channel":
         channel_id = data.get("channel_id")
         if not channel_id:
             return
-
-        # Verify membership in the channel's server
-        result = await db.execute(select(Channel).where(Channel.id == uuid.UUID(channel_id)))
-        channel = result.scalar_one_or_none()
-        if not channel:
+        parsed_id = parse_id(channel_id)
+        if parsed_id is None:
+            conn.send_message({"type": "error", "detail": "Invalid channel_id"})
             return
 
-        membership = await db.execute(
-            select(ServerMember).where(
-                ServerMember.user_id == user_id,
-                ServerMember.server_id == channel.server_id,
-            )
-        )
-        if not membership.scalar_one_or_none():
+        # Verify membership in the channel's server; unknown channels get the
+        # same answer as ones the user cannot see
+        server_id = await authz.channel_server(parsed_id, db)
+        if server_id is None or await authz.member_role(user_id, server_id, db) is None:
+            conn.send_message({"type": "error", "detail": "Channel not found"})
             return
 
         room_id = f"channel:{channel_id}"
-        manager.join_room(room_id, user_id)
-        await websocket.send_text(json.dumps({"type": "joined", "channel_id": channel_id}))
+        await manager.join_room(room_id, conn)
+        conn.send_message({"type": "joined", "channel_id": channel_id})
 
     elif msg_type == "leave_channel":
         channel_id = data.get("channel_id")
         if channel_id:
-            manager.leave_room(f"channel:{channel_id}", user_id)
+            await manager.leave_room(f"channel:{channel_id}", conn)
 
     elif msg_type == "message":
         channel_id = data.get("channel_id")
         content = data.get("content")
-        if not channel_id or not content:
+        if not channel_id:
+            return
+        if not valid_content(content, data):
+            conn.send_message({"type": "error", "detail": "Invalid content"})
             return
 
         room_id = f"channel:{channel_id}"
-        if user_id not in manager.rooms.get(room_id, set()):
+        if room_id not in conn.rooms:
+            return
+        parsed_id = parse_id(channel_id)
+        if parsed_id is None:
+            conn.send_message({"type": "error", "detail": "Invalid channel_id"})
+            return
+        rejected = await limiter.allow_message(conn, room_id, "message")
+        if rejected is not None:
+            conn.send_message(rejected)
             return
 
-        # Import here to avoid circular imports
-        from server.models.message import Message
-        from server.models.user import User
-
-        # Get username
-        user_result = await db.execute(select(User.username).where(User.id == user_id))
-        username = user_result.scalar_one()
-
-        msg = Message(
-            channel_id=uuid.UUID(channel_id),
-            sender_id=user_id,
-            ciphertext=content,
-        )
-        db.add(msg)
-        await db.commit()
-        await db.refresh(msg)
+        envelopes = None
+        if data.get("envelopes"):
+            try:
+                envelopes = parse_envelopes(data["envelopes"])
+            except ValueError:
+                conn.send_message({"type": "error", "detail": "Invalid envelopes"})
+                return
+            # Envelopes for users outside the server are dropped, not stored
+            server_id = await authz.channel_server(parsed_id, db)
+            members = await server_members(db, server_id, {recipient_id for recipient_id, _ in envelopes})
+            envelopes = {key: value for key, value in envelopes.items() if key[0] in members}
+            content = ""
 
+        msg = await store_message(db, conn, content, envelopes, channel_id=parsed_id)
         broadcast = {
             "type": "message",
-            "id": str(msg.id),
+            "id": str(msg["id"]),
             "channel_id": channel_id,
             "sender_id": str(user_id),
-            "sender_username": username,
+            "sender_username": conn.username,
             "content": content,
-            "created_at": msg.created_at.isoformat(),
+            "created_at": msg["created_at"].isoformat(),
         }
-        await manager.broadcast_to_room(room_id, broadcast)
+        await manager.broadcast_to_room(room_id, seal(dict(broadcast), envelopes, msg))
+        # Same shape as GET /channels/{channel_id}/messages entries; envelope
+        # messages appear with empty content and are read from the mailbox
+        await recent_history.append(
+            msg["channel_id"],
+            {
+                "id": broadcast["id"],
+                "channel_id": str(msg["channel_id"]),
+                "sender_id": broadcast["sender_id"],
+                "sender_username": conn.username,
+                "content": content,
+                "created_at": broadcast["created_at"],
+                "cursor": encode_cursor(msg["created_at"], msg["id"]),
+            },
+        )
 
     elif msg_type == "join_dm":
         conversation_id = data.get("conversation_id")
-        if conversation_id:
-            room_id = f"dm:{conversation_id}"
-            manager.join_room(room_id, user_id)
-            await websocket.send_text(json.dumps({"type": "joined_dm", "conversation_id": conversation_id}))
+        if not conversation_id:
+            return
+        parsed_id = parse_id(conversation_id)
+        if parsed_id is None:
+            conn.send_message({"type": "error", "detail": "Invalid conversation_id"})
+            return
+        # Same answer for unknown conversations as for ones the user is not in
+        if not await authz.is_participant(user_id, parsed_id, db):
+            conn.send_message({"type": "error", "detail": "Conversation not found"})
+            return
+
+        room_id = f"dm:{conversation_id}"
+        await manager.join_room(room_id, conn)
+        conn.send_message({"type": "joined_dm", "conversation_id": conversation_id})
 
     elif msg_type == "leave_dm":
         conversation_id = data.get("conversation_id")
         if conversation_id:
-            manager.leave_room(f"dm:{conversation_id}", user_id)
+            await manager.leave_room(f"dm:{conversation_id}", conn)
 
     elif msg_type == "dm_message":
         conversation_id = data.get("conversation_id")
         content = data.get("content")
-        if not conversation_id or not content:
+        if not conversation_id:
+            return
+        if not valid_content(content, data):
+            conn.send_message({"type": "error", "detail": "Invalid content"})
             return
 
         room_id = f"dm:{conversation_id}"
-        if user_id not in manager.rooms.get(room_id, set()):
+        if room_id not in conn.rooms:
+            return
+        parsed_id = parse_id(conversation_id)
+        if parsed_id is None:
+            conn.send_message({"type": "error", "detail": "Invalid conversation_id"})
+            return
+        rejected = await limiter.allow_message(conn, room_id, "dm_message")
+        if rejected is not None:
+            conn.send_message(rejected)
             return
 
-        from server.models.message import Message
-        from server.models.user import User
-
-        user_result = await db.execute(select(User.username).where(User.id == user_id))
-        username = user_result.scalar_one()
-
-        msg = Message(
-            conversation_id=uuid.UUID(conversation_id),
-            sender_id=user_id,
-            ciphertext=content,
-        )
-        db.add(msg)
-        await db.commit()
-        await db.refresh(msg)
+        envelopes = None
+        if data.get("envelopes"):
+            try:
+                envelopes = parse_envelopes(data["envelopes"])
+            except ValueError:
+                conn.send_message({"type": "error", "detail": "Invalid envelopes"})
+                return
+            # Envelopes for users outside the conversation are dropped, not stored
+            participants = await authz.participants(parsed_id, db)
+            envelopes = {key: value for key, value in envelopes.items() if key[0] in participants}
+            content = ""
 
+        msg = await store_message(db, conn, content, envelopes, conversation_id=parsed_id)
         broadcast = {
             "type": "dm_message",
-            "id": str(msg.id),
+            "id": str(msg["id"]),
             "conversation_id": conversation_id,
             "sender_id": str(user_id),
-            "sender_username": username,
+            "sender_username": conn.username,
             "content": content,
-            "created_at": msg.created_at.isoformat(),
+            "created_at": msg["created_at"].isoformat(),
+        }
+        await manager.broadcast_to_room(room_id, seal(broadcast, envelopes, msg))
+
+    elif msg_type == "sync":
+        # Reconnect catch-up. Clients join their rooms first, then send the
+        # cursor of the newest event they saw, so nothing falls in between;
+        # events may overlap live ones and are deduplicated by id.
+        since = data.get("since")
+        if not since:
+            return
+        try:
+            conversation_ids = [uuid.UUID(c) for c in data.get("conversation_ids", [])]
+            events, more = await missed_events(db, user_id, since, conversation_ids, settings.sync_max_events)
+        except CursorTooOld:
+            conn.send_message({"type": "sync_done", "reset": True})
+            return
+        except (ValueError, TypeError, AttributeError):
+            conn.send_message({"type": "error", "detail": "Invalid sync cursor"})
+            return
+
+        for start in range(0, len(events), settings.sync_batch_size):
+            # Paced by the client's reads so catch-up never trips the slow-consumer policy
+            await conn.wait_idle()
+            conn.send_message({"type": "sync_batch", "events": events[start:start + settings.sync_batch_size]})
+        # With `more`, the client sends sync again from `cursor`
+        cursor = events[-1]["cursor"] if events else since
+        conn.send_message({"type": "sync_done", "cursor": cursor, "more": more})
+
+    elif msg_type == "typing":
+        channel_id = data.get("channel_id")
+        parsed_id = parse_id(channel_id)
+        if parsed_id is not None and f"channel:{channel_id}" in conn.rooms:
+            presence.typing(conn, parsed_id)
+
+    elif msg_type == "presence":
+        status = data.get("status")
+        if status in ("online", "idle"):
+            await presence.set_idle(conn, status == "idle")
+
+    elif msg_type == "subscribe_presence":
+        # Sent while the client shows a server's member list
+        server_id = data.get("server_id")
+        if not server_id:
+            return
+        server_id = parse_id(server_id)
+        if server_id is None:
+            conn.send_message({"type": "error", "detail": "Invalid server_id"})
+            return
+        if await authz.member_role(user_id, server_id, db) is None:
+            conn.send_message({"type": "error", "detail": "Server not found"})
+            return
+        await manager.join_room(presence_room(server_id), conn)
+        # Present members only, capped; everyone else is offline. With
+        # `truncated`, the list holds the most recently seen members.
+        limit = settings.presence_snapshot_max_users
+        members = await presence.online_members(server_id, limit)
+        frame = {
+            "type": "presence",
+            "server_id": str(server_id),
+            "changes": await presence.snapshot(members),
+            "snapshot": True,
         }
-        await manager.broadcast_to_room(room_id, broadcast)
+        if len(members) >= limit:
+            frame["truncated"] = True
+        conn.send_message(frame)
+
+    elif msg_type == "unsubscribe_presence":
+        server_id = data.get("server_id")
+        if server_id:
+            parsed_id = parse_id(server_id)
+            if parsed_id is None:
+                conn.send_message({"type": "error", "detail": "Invalid server_id"})
+                return
+            await manager.leave_room(presence_room(parsed_id), conn)
+
+    elif msg_type == "ping":
+        # Client-side liveness checks; server pings are answered with "pong",
+        # which needs no handling beyond having been received (ws/lifecycle.py)
+        conn.send_message({"type": "pong"})
@@ -0,0 +1,278 @@
+import asyncio
+import logging
+import time
+import uuid
+from collections import defaultdict
+
+from redis.exceptions import RedisError
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from server.config import settings
+from server.models.server_member import ServerMember
+from server.services.cache import MISSING, TTLCache
+from server.ws.connection import Connection
+from server.ws.manager import manager
+
+logger = logging.getLogger(__name__)
+
+ONLINE, IDLE, OFFLINE = "online", "idle", "offline"
+# Across devices and workers the most present status wins
+RANK = {OFFLINE: 0, IDLE: 1, ONLINE: 2}
+
+
+def presence_room(server_id: uuid.UUID) -> str:
+    return f"presence:{server_id}"
+
+
+def presence_key(user_id: uuid.UUID) -> str:
+    return f"whisper:presence:{user_id}"
+
+
+def server_presence_key(server_id: uuid.UUID) -> str:
+    return f"whisper:presence:server:{server_id}"
+
+
+# Presence (online / idle / offline per user) and typing indicators. Nothing
+# here touches Postgres except loading a connecting user's server list.
+#
+# A user's status on this worker comes from their sockets in
+# manager.active_connections: online if any is not idle, idle if all are,
+# offline with none. With Redis attached, each worker writes its view into one
+# hash per user (field per worker, value "status|timestamp", refreshed every
+# ttl / 3) and the user's status is the best fresh field, so a crashed worker's
+# entries age out after `ttl`.
+#
+# Member list snapshots come from the same store, never from the member table:
+# each worker indexes its present users by server, and with Redis also adds
+# them to a sorted set per server scored by when they were last written, so a
+# snapshot only looks at users seen within `ttl`, however large the server.
+#
+# Changes are not broadcast one by one: they collect per server and every
+# `interval` one diff per server goes to the `presence:{server_id}` room, which
+# clients join only while they show that server's member list. Typing works
+# the same way per channel room, throttled to one event per user per channel
+# every `typing_throttle` seconds; clients expire typers after `typing_ttl`.
+class Presence:
+    def __init__(self, interval: float, ttl: float, typing_ttl: float, typing_throttle: float):
+        self.interval = interval
+        self.ttl = ttl
+        self.typing_ttl = typing_ttl
+        self.node_id = uuid.uuid4().hex
+        self.diffs_sent = 0
+        self.typing_sent = 0
+        # Last status published per user, to only announce real changes
+        self._status: dict[uuid.UUID, str] = {}
+        self._servers: dict[uuid.UUID, list[uuid.UUID]] = {}
+        # server_id -> users present on this worker; the reverse of _servers
+        self._members: dict[uuid.UUID, set[uuid.UUID]] = defaultdict(set)
+        self._pending: dict[uuid.UUID, dict[uuid.UUID, str]] = defaultdict(dict)
+        self._typing: dict[str, dict[uuid.UUID, str]] = defaultdict(dict)
+        self._typing_throttle = TTLCache(max_entries=100_000, ttl=typing_throttle)
+        self._redis = None
+        self._tasks: list[asyncio.Task] = []
+
+    async def start(self, redis=None):
+        self._redis = redis
+        self._tasks.append(asyncio.create_task(self._flush_loop()))
+        if redis is not None:
+            self._tasks.append(asyncio.create_task(self._heartbeat_loop()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks.clear()
+        if self._redis is not None:
+            try:
+                async with self._redis.pipeline(transaction=False) as pipe:
+                    for user_id in self._status:
+                        pipe.hdel(presence_key(user_id), self.node_id)
+                    await pipe.execute()
+            except RedisError:
+                pass
+        self._redis = None
+
+    async def connected(self, conn: Connection, db: AsyncSession):
+        if conn.user_id not in self._servers:
+            result = await db.execute(select(ServerMember.server_id).where(ServerMember.user_id == conn.user_id))
+            self._servers[conn.user_id] = list(result.scalars().all())
+        await self._update(conn.user_id)
+
+    async def disconnected(self, conn: Connection):
+        await self._update(conn.user_id)
+        if conn.user_id not in manager.active_connections:
+            self._servers.pop(conn.user_id, None)
+            self._status.pop(conn.user_id, None)
+
+    async def set_idle(self, conn: Connection, idle: bool):
+        if conn.idle != idle:
+            conn.idle = idle
+            await self._update(conn.user_id)
+
+    def typing(self, conn: Connection, channel_id: uuid.UUID):
+        key = conn.user_id, channel_id
+        if self._typing_throttle.get(key) is not MISSING:
+            return
+        self._typing_throttle.set(key, True)
+        self._typing[f"channel:{channel_id}"][conn.user_id] = conn.username
+
+    async def online_members(self, server_id: uuid.UUID, limit: int) -> list[uuid.UUID]:
+        # Up to `limit` members of the server that may be present, most
+        # recently seen first when they come from Redis; snapshot() has the
+        # final say on their status
+        members = list(self._members.get(server_id, ()))[:limit]
+        if self._redis is None or len(members) >= limit:
+            return members
+        key = server_presence_key(server_id)
+        fresh_after = time.time() - self.ttl
+        try:
+            async with self._redis.pipeline(transaction=False) as pipe:
+                pipe.zremrangebyscore(key, "-inf", f"({fresh_after}")
+                pipe.zrevrangebyscore(key, "+inf", fresh_after, start=0, num=limit)
+                _, shared = await pipe.execute()
+        except RedisError:
+            return members
+        seen = set(members)
+        for value in shared:
+            user_id = uuid.UUID(value.decode())
+            if user_id not in seen and len(members) < limit:
+                seen.add(user_id)
+                members.append(user_id)
+        return members
+
+    async def snapshot(self, user_ids: list[uuid.UUID]) -> dict[str, str]:
+        # Current status of each user who is not offline
+        if self._redis is None:
+            statuses = {user_id: self._local_status(user_id) for user_id in user_ids}
+        else:
+            statuses = await self._shared_status(user_ids)
+        return {str(user_id): status for user_id, status in statuses.items() if status != OFFLINE}
+
+    def stats(self) -> dict:
+        return {
+            "users": len(self._status),
+            "diffs_sent": self.diffs_sent,
+            "typing_sent": self.typing_sent,
+            "redis": self._redis is not None,
+        }
+
+    def _local_status(self, user_id: uuid.UUID) -> str:
+        connections = manager.active_connections.get(user_id)
+        if not connections:
+            return OFFLINE
+        return IDLE if all(c.idle for c in connections) else ONLINE
+
+    async def _update(self, user_id: uuid.UUID):
+        status = self._local_status(user_id)
+        for server_id in self._servers.get(user_id, ()):
+            if status == OFFLINE:
+                members = self._members.get(server_id)
+                if members is not None:
+                    members.discard(user_id)
+                    if not members:
+                        del self._members[server_id]
+            else:
+                self._members[server_id].add(user_id)
+        if self._redis is not None:
+            await self._write_shared({user_id: status})
+            status = (await self._shared_status([user_id]))[user_id]
+        if self._status.get(user_id, OFFLINE) == status:
+            return
+        self._status[user_id] = status
+        for server_id in self._servers.get(user_id, ()):
+            self._pending[server_id][user_id] = status
+
+    async def _write_shared(self, statuses: dict[uuid.UUID, str]):
+        now = time.time()
+        try:
+            async with self._redis.pipeline(transaction=False) as pipe:
+                for user_id, status in statuses.items():
+                    key = presence_key(user_id)
+                    if status == OFFLINE:
+                        pipe.hdel(key, self.node_id)
+                    else:
+                        pipe.hset(key, self.node_id, f"{status}|{now:.0f}")
+                        pipe.expire(key, int(self.ttl))
+                        # Another worker may still have the user online, so
+                        # going offline leaves the score to age out instead
+                        for server_id in self._servers.get(user_id, ()):
+                            pipe.zadd(server_presence_key(server_id), {str(user_id): now})
+                            pipe.expire(server_presence_key(server_id), int(self.ttl))
+                await pipe.execute()
+        except RedisError:
+            logger.warning("Failed to write presence for %d users", len(statuses))
+
+    async def _shared_status(self, user_ids: list[uuid.UUID]) -> dict[uuid.UUID, str]:
+        statuses = {user_id: self._local_status(user_id) for user_id in user_ids}
+        try:
+            async with self._redis.pipeline(transaction=False) as pipe:
+                for user_id in user_ids:
+                    pipe.hgetall(presence_key(user_id))
+                replies = await pipe.execute()
+        except RedisError:
+            return statuses
+        fresh_after = time.time() - self.ttl
+        for user_id, fields in zip(user_ids, replies):
+            for value in fields.values():
+                status, _, stamp = value.decode().partition("|")
+                if float(stamp) >= fresh_after and RANK.get(status, 0) > RANK[statuses[user_id]]:
+                    statuses[user_id] = status
+        return statuses
+
+    async def _flush(self):
+        pending, self._pending = self._pending, defaultdict(dict)
+        for server_id, changes in pending.items():
+            await manager.broadcast_to_room(
+                presence_room(server_id),
+                {
+                    "type": "presence",
+                    "server_id": str(server_id),
+                    "changes": {str(user_id): status for user_id, status in changes.items()},
+                },
+            )
+            self.diffs_sent += 1
+
+        typing, self._typing = self._typing, defaultdict(dict)
+        for room_id, users in typing.items():
+            # Typing is ephemeral, so a slow client may skip straight to the newest window
+            await manager.broadcast_to_room(
+                room_id,
+                {
+                    "type": "typing",
+                    "channel_id": room_id.removeprefix("channel:"),
+                    "users": [{"user_id": str(user_id), "username": name} for user_id, name in users.items()],
+                    "ttl": self.typing_ttl,
+                },
+                coalesce_key=f"typing:{room_id}",
+            )
+            self.typing_sent += 1
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self._flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Presence flush failed")
+
+    async def _heartbeat_loop(self):
+        # Keeps this worker's fields fresh; other workers ignore stale ones
+        while True:
+            await asyncio.sleep(self.ttl / 3)
+            statuses = {user_id: self._local_status(user_id) for user_id in list(self._status)}
+            if statuses:
+                await self._write_shared(statuses)
+
+
+presence = Presence(
+    settings.presence_flush_interval_ms / 1000,
+    settings.presence_ttl_seconds,
+    settings.typing_ttl_seconds,
+    settings.typing_throttle_seconds,
+)
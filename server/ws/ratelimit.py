@@ -0,0 +1,195 @@
+import logging
+import time
+
+from redis.exceptions import RedisError
+
+from server.config import settings
+from server.services.cache import MISSING, TTLCache
+
+logger = logging.getLogger(__name__)
+
+# WebSocket close code 1008: policy violation
+FLOOD_CLOSE_CODE = 1008
+
+
+def frame_size(raw: str | bytes, limit: int) -> int:
+    # Size in bytes as sent. A text frame is UTF-8 with 1-4 bytes per
+    # character, so it is only encoded when the character count cannot decide.
+    if isinstance(raw, bytes) or len(raw) > limit or len(raw) * 4 <= limit:
+        return len(raw)
+    return len(raw.encode())
+
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "stamp")
+
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = now
+
+    def take(self, now: float) -> float:
+        # 0 if a token was taken, else seconds until one is available
+        tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        if tokens >= 1:
+            self.tokens = tokens - 1
+            return 0.0
+        self.tokens = tokens
+        return (1 - tokens) / self.rate
+
+
+def rejection(scope: str, retry_after: float, frame_type: str | None = None) -> dict:
+    return {
+        "type": "error",
+        "code": "rate_limited",
+        "detail": "Rate limit exceeded",
+        "scope": scope,
+        "retry_after": round(retry_after, 3),
+        "frame_type": frame_type,
+    }
+
+
+# Inbound flood protection for the WebSocket path, checked before a frame is
+# decoded or touches Postgres:
+#   frame size  - frames over `max_frame_bytes` are rejected undecoded
+#   connection  - every frame takes a token from the socket's own bucket
+#   user        - messages take a token from the sender's bucket (all devices)
+#   room        - messages take a token from the target room's bucket, which
+#                 bounds the broadcast fan-out a room can cause
+# Buckets live in this process. With Redis attached, messages also count
+# against a sliding window per user and per room shared by every worker; that
+# costs one pipelined round trip per message, never per frame. A socket whose
+# frames keep being rejected is closed after `close_after` in a row; the count
+# resets on an accepted message, or on any accepted frame of another type.
+class RateLimiter:
+    def __init__(
+        self,
+        max_frame_bytes: int,
+        connection_rate: float,
+        connection_burst: int,
+        user_rate: float,
+        user_burst: int,
+        room_rate: float,
+        room_burst: int,
+        close_after: int,
+        shared_window: float,
+    ):
+        self.max_frame_bytes = max_frame_bytes
+        self.connection_rate = connection_rate
+        self.connection_burst = connection_burst
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.room_rate = room_rate
+        self.room_burst = room_burst
+        self.close_after = close_after
+        self.shared_window = shared_window
+        # A bucket idle this long is full again, so expiring it changes nothing
+        self._users = TTLCache(100_000, max(user_burst / user_rate, 1.0))
+        self._rooms = TTLCache(100_000, max(room_burst / room_rate, 1.0))
+        self._redis = None
+        self.rejected: dict[str, int] = {"size": 0, "connection": 0, "user": 0, "room": 0}
+        self.flood_disconnects = 0
+
+    def start(self, redis=None):
+        self._redis = redis
+
+    def stop(self):
+        self._redis = None
+
+    def allow_frame(self, conn, raw: str | bytes) -> dict | None:
+        # None if the frame may be handled, else the rejection to send back
+        if frame_size(raw, self.max_frame_bytes) > self.max_frame_bytes:
+            self.rejected["size"] += 1
+            conn.rejected_frames += 1
+            return {"type": "error", "code": "frame_too_large", "detail": "Frame too large", "max_bytes": self.max_frame_bytes}
+        now = time.monotonic()
+        if conn.bucket is None:
+            conn.bucket = TokenBucket(self.connection_rate, self.connection_burst, now)
+        wait = conn.bucket.take(now)
+        if wait:
+            self.rejected["connection"] += 1
+            conn.rejected_frames += 1
+            return rejection("connection", wait)
+        return None
+
+    async def allow_message(self, conn, room_id: str, frame_type: str) -> dict | None:
+        now = time.monotonic()
+        for scope, buckets, key, rate, burst in (
+            ("user", self._users, conn.user_id, self.user_rate, self.user_burst),
+            ("room", self._rooms, room_id, self.room_rate, self.room_burst),
+        ):
+            bucket = buckets.get(key)
+            if bucket is MISSING:
+                bucket = TokenBucket(rate, burst, now)
+                buckets.set(key, bucket)
+            wait = bucket.take(now)
+            if wait:
+                self.rejected[scope] += 1
+                conn.rejected_frames += 1
+                return rejection(scope, wait, frame_type)
+        if self._redis is not None:
+            rejected = await self._allow_shared(conn, room_id, frame_type)
+            if rejected is not None:
+                return rejected
+        conn.rejected_frames = 0
+        return None
+
+    def flooding(self, conn) -> bool:
+        if conn.rejected_frames < self.close_after:
+            return False
+        self.flood_disconnects += 1
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "rejected": dict(self.rejected),
+            "flood_disconnects": self.flood_disconnects,
+            "users": len(self._users),
+            "rooms": len(self._rooms),
+            "shared": self._redis is not None,
+        }
+
+    async def _allow_shared(self, conn, room_id: str, frame_type: str) -> dict | None:
+        # Sliding window counter: this window's count plus the previous one's
+        # weighted by how much of it still overlaps the sliding window
+        window = self.shared_window
+        now = time.time()
+        current = int(now // window)
+        overlap = 1 - (now % window) / window
+        checks = (
+            ("user", f"whisper:rl:user:{conn.user_id}", self.user_burst + self.user_rate * window),
+            ("room", f"whisper:rl:room:{room_id}", self.room_burst + self.room_rate * window),
+        )
+        try:
+            async with self._redis.pipeline(transaction=False) as pipe:
+                for _, key, _ in checks:
+                    pipe.incr(f"{key}:{current}")
+                    pipe.expire(f"{key}:{current}", int(window * 2) + 1)
+                    pipe.get(f"{key}:{current - 1}")
+                replies = await pipe.execute()
+        except RedisError:
+            # Local buckets still apply; failing open keeps chat up
+            logger.warning("Shared rate limit check failed")
+            return None
+        for i, (scope, _, limit) in enumerate(checks):
+            count, _, previous = replies[i * 3:i * 3 + 3]
+            if count + int(previous or 0) * overlap > limit:
+                self.rejected[scope] += 1
+                conn.rejected_frames += 1
+                return rejection(scope, window - now % window, frame_type)
+        return None
+
+
+limiter = RateLimiter(
+    max_frame_bytes=settings.ws_max_frame_bytes,
+    connection_rate=settings.ws_frames_per_second,
+    connection_burst=settings.ws_frame_burst,
+    user_rate=settings.ws_user_messages_per_second,
+    user_burst=settings.ws_user_message_burst,
+    room_rate=settings.ws_room_messages_per_second,
+    room_burst=settings.ws_room_message_burst,
+    close_after=settings.ws_flood_close_after,
+    shared_window=settings.ws_rate_limit_window_seconds,
+)